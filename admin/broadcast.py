@@ -0,0 +1,192 @@
+import logging
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from admin.storage.broadcast_repository import BroadcastRepository
+from service.outbound import OutboundScheduler
+
+logger = logging.getLogger(__name__)
+
+_OPTION = re.compile(r'^\s*(level=(\d+)|registered|unregistered)(?=\s|$)', re.IGNORECASE)
+
+
+def parse_broadcast_command(text: str) -> Tuple[str, Optional[int], Optional[bool]]:
+    """
+    Разбирает "/broadcast [level=N] [registered|unregistered] текст".
+    Возвращает (текст, уровень, регистрация); переносы строк в тексте сохраняются.
+    """
+    rest = text.split(None, 1)[1] if len(text.split(None, 1)) > 1 else ""
+    level, registered = None, None
+    match = _OPTION.match(rest)
+    while match:
+        option = match.group(1).lower()
+        if match.group(2):
+            level = int(match.group(2))
+            if not 1 <= level <= 21:
+                raise ValueError("Уровень должен быть от 1 до 21")
+        else:
+            registered = option == 'registered'
+        rest = rest[match.end():]
+        match = _OPTION.match(rest)
+
+    rest = rest.strip()
+    if not rest:
+        raise ValueError("Пустой текст рассылки")
+    return rest, level, registered
+
+
+class _PageTracker:
+    """Ожидание результатов отправки одной страницы рассылки"""
+
+    def __init__(self):
+        self.expected = 0
+        self.sent = 0
+        self.failed = 0
+        self._cond = threading.Condition()
+
+    def add(self) -> None:
+        with self._cond:
+            self.expected += 1
+
+    def remove(self) -> None:
+        with self._cond:
+            self.expected -= 1
+
+    def done(self, delivered: bool) -> None:
+        with self._cond:
+            if delivered:
+                self.sent += 1
+            else:
+                self.failed += 1
+            self._cond.notify_all()
+
+    def wait(self, timeout: float) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self.sent + self.failed >= self.expected, timeout)
+
+
+# Класс Broadcaster
+# Массовые рассылки, запускаемые администратором:
+#     start_broadcast(admin_id, text, level, registered) - создать рассылку (фильтр по
+#         current_level и/или registration_complete), фоновый поток подхватит ее сразу
+#     cancel(broadcast_id) - остановить рассылку после текущей страницы
+#     run_forever(stop_event) - цикл фонового потока
+# Получатели читаются страницами по page_size (keyset по users.id), каждая страница
+# отправляется через OutboundScheduler.submit_bulk - с общим лимитом Telegram, но не
+# быстрее bulk_rate, так что обычные ответы пользователям не ждут рассылку. После того
+# как все сообщения страницы отправлены (или окончательно не доставлены), в broadcasts
+# сохраняется last_user_id. После перезапуска рассылка продолжается с этой точки:
+# повторно могут уйти только сообщения страницы, прерванной падением процесса.
+class Broadcaster:
+    def __init__(self, repo: BroadcastRepository, outbound: OutboundScheduler, bot,
+                 page_size: int = 200, lease: float = 300.0, page_timeout: float = 600.0,
+                 idle_interval: float = 30.0):
+        self.repo = repo
+        self.outbound = outbound
+        self.bot = bot
+        self.page_size = page_size
+        self.lease = lease
+        self.page_timeout = page_timeout
+        self.idle_interval = idle_interval
+        self._wakeup = threading.Event()
+        self._current: Optional[Dict[str, Any]] = None
+
+    def start_broadcast(self, admin_id: int, text: str, level: Optional[int] = None,
+                        registered: Optional[bool] = None) -> Optional[int]:
+        broadcast_id = self.repo.create(admin_id, text, level, registered)
+        if broadcast_id is not None:
+            logger.info(f"[Broadcast] #{broadcast_id} created by {admin_id} "
+                        f"(level={level}, registered={registered})")
+            self._wakeup.set()
+        return broadcast_id
+
+    def cancel(self, broadcast_id: int) -> bool:
+        return self.repo.cancel(broadcast_id)
+
+    def get_current(self) -> Optional[Dict[str, Any]]:
+        """Прогресс рассылки, которую сейчас ведет этот процесс"""
+        current = self._current
+        return dict(current) if current else None
+
+    def run_forever(self, stop_event: threading.Event) -> None:
+        while not stop_event.is_set():
+            job = self.repo.claim_next(self.lease)
+            if job is None:
+                self._wakeup.wait(self.idle_interval)
+                self._wakeup.clear()
+                continue
+
+            try:
+                self._run(job, stop_event)
+            except Exception as e:
+                logger.error(f"[Broadcast] #{job['id']} interrupted: {e}", exc_info=True)
+                self.repo.release(job['id'])
+                stop_event.wait(self.idle_interval)
+            finally:
+                self._current = None
+
+    def _run(self, job: Dict[str, Any], stop_event: threading.Event) -> None:
+        broadcast_id = job['id']
+        last_user_id = job['last_user_id']
+        started = time.monotonic()
+        self._current = {'id': broadcast_id, 'sent': job['sent'], 'failed': job['failed'], 'rate': 0.0}
+        if last_user_id:
+            logger.info(f"[Broadcast] #{broadcast_id} resumed after user {last_user_id}")
+
+        while not stop_event.is_set():
+            user_ids = self.repo.get_audience_page(job['level'], job['registered'], last_user_id, self.page_size)
+            if not user_ids:
+                summary = self.repo.finish(broadcast_id)
+                if summary:
+                    self._report(summary, time.monotonic() - started)
+                return
+
+            page_started = time.monotonic()
+            submitted, tracker = self._send_page(job['text'], user_ids, stop_event)
+            if not tracker.wait(self.page_timeout):
+                logger.warning(f"[Broadcast] #{broadcast_id} page not finished in {self.page_timeout}s")
+            if submitted:
+                last_user_id = submitted[-1]
+
+            status = self.repo.checkpoint(broadcast_id, last_user_id, tracker.sent, tracker.failed, self.lease)
+            elapsed = time.monotonic() - page_started
+            rate = round(len(submitted) / elapsed, 1) if elapsed > 0 else 0.0
+            self._current['sent'] += tracker.sent
+            self._current['failed'] += tracker.failed
+            self._current['rate'] = rate
+            logger.info(f"[Broadcast] #{broadcast_id} page up to user {last_user_id}: "
+                        f"sent {tracker.sent}, failed {tracker.failed}, {rate} msg/s")
+
+            if status != 'running':
+                logger.info(f"[Broadcast] #{broadcast_id} stopped, status {status}")
+                return
+
+        self.repo.release(broadcast_id)
+        logger.info(f"[Broadcast] #{broadcast_id} paused on shutdown after user {last_user_id}")
+
+    def _send_page(self, text: str, user_ids: List[int],
+                   stop_event: threading.Event) -> Tuple[List[int], _PageTracker]:
+        """Ставит страницу в очередь по порядку id; возвращает id, принятые в очередь"""
+        tracker = _PageTracker()
+        submitted = []
+        for user_id in user_ids:
+            tracker.add()
+            while not self.outbound.submit_bulk(user_id, tracker.done, self.bot.send_message, user_id, text):
+                # Очередь исходящих переполнена: ждем, пока она разгрузится
+                if stop_event.wait(1.0):
+                    tracker.remove()
+                    return submitted, tracker
+            submitted.append(user_id)
+        return submitted, tracker
+
+    def _report(self, summary: Dict[str, Any], duration: float) -> None:
+        message = (
+            f"📣 Рассылка #{summary['id']} завершена\n"
+            f"✅ Доставлено: {summary['sent']}\n"
+            f"⚠️ Не доставлено: {summary['failed']}\n"
+            f"⏱ Время: {duration / 60:.1f} мин"
+        )
+        logger.info(f"[Broadcast] #{summary['id']} completed: sent {summary['sent']}, failed {summary['failed']}")
+        self.outbound.send_message(summary['created_by'], message)
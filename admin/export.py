@@ -0,0 +1,158 @@
+import gzip
+import logging
+import queue
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import IO, List, Optional, Sequence, Tuple
+
+from service.outbound import OutboundScheduler
+from storage.postgres_storage import PostgresStorage
+
+logger = logging.getLogger(__name__)
+
+# Таблицы, которые можно выгрузить командой /export
+EXPORT_TABLES = ('users', 'user_data', 'tasks', 'donations', 'referrals')
+
+# Ограничение Bot API на размер отправляемого документа
+TELEGRAM_DOCUMENT_LIMIT = 50 * 1024 * 1024
+
+
+class ExportFile:
+    """Сжатая выгрузка одной таблицы во временном файле на диске"""
+    __slots__ = ('table', 'file', 'file_name', 'rows', 'size', 'duration')
+
+    def __init__(self, table: str, file: IO[bytes], file_name: str, rows: int, size: int, duration: float):
+        self.table = table
+        self.file = file
+        self.file_name = file_name
+        self.rows = rows
+        self.size = size
+        self.duration = duration
+
+    def close(self) -> None:
+        self.file.close()
+
+
+# Класс AdminExporter
+# Выгрузка таблиц в CSV, сжатый gzip на лету:
+#     export(tables) - список ExportFile, по одному на таблицу, все из одного снимка БД
+# Данные идут потоком: COPY ... TO STDOUT отдает CSV частями по chunk_size байт прямо
+# в GzipFile поверх временного файла, поэтому память процесса не зависит от размера
+# таблицы. Отдельное соединение (вне пула) в транзакции REPEATABLE READ READ ONLY:
+# долгая выгрузка не занимает слот пула, а все таблицы согласованы между собой.
+# Транзакция закрывается сразу после записи последнего файла, до отправки файлов:
+# снимок не держит горизонт очистки (xmin) на время загрузки в Telegram.
+class AdminExporter:
+    def __init__(self, storage: PostgresStorage, chunk_size: int = 64 * 1024, tmp_dir: Optional[str] = None):
+        self.storage = storage
+        self.chunk_size = chunk_size
+        self.tmp_dir = tmp_dir
+
+    def export(self, tables: Sequence[str] = EXPORT_TABLES) -> List[ExportFile]:
+        unknown = [table for table in tables if table not in EXPORT_TABLES]
+        if unknown:
+            raise ValueError(f"Таблицы недоступны для выгрузки: {', '.join(unknown)}")
+
+        stamp = datetime.now().strftime('%Y%m%d_%H%M')
+        files: List[ExportFile] = []
+        conn = self.storage.dedicated_connection()
+        try:
+            conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+            cursor = conn.cursor()
+            for table in tables:
+                files.append(self._export_table(cursor, table, f"{table}_{stamp}.csv.gz"))
+            conn.rollback()
+        except Exception:
+            for export_file in files:
+                export_file.close()
+            raise
+        finally:
+            conn.close()
+        return files
+
+    def _export_table(self, cursor, table: str, file_name: str) -> ExportFile:
+        started = time.monotonic()
+        output = tempfile.TemporaryFile(dir=self.tmp_dir)
+        try:
+            with gzip.GzipFile(filename=file_name[:-3], mode='wb', fileobj=output) as compressed:
+                cursor.copy_expert(
+                    f"COPY {table} TO STDOUT WITH (FORMAT csv, HEADER)",
+                    compressed,
+                    size=self.chunk_size
+                )
+            size = output.tell()
+            output.seek(0)
+        except Exception:
+            output.close()
+            raise
+
+        export_file = ExportFile(table, output, file_name, max(cursor.rowcount, 0), size,
+                                 time.monotonic() - started)
+        logger.info(f"[Export] {table}: {export_file.rows} rows, {size} bytes, {export_file.duration:.1f}s")
+        return export_file
+
+
+# Класс ExportRunner
+# Выполняет /export в фоновом потоке, а не в дорожке обработчика обновлений:
+#     request(chat_id, tables) - поставить выгрузку в очередь (False - очередь занята)
+#     run_forever(stop_event) - цикл фонового потока
+# Сначала все таблицы пишутся во временные файлы и транзакция выгрузки закрывается,
+# затем файлы по одному отправляются документами. Пока идет загрузка до 50 МБ,
+# пользователи в дорожке администратора не ждут.
+class ExportRunner:
+    def __init__(self, exporter: AdminExporter, outbound: OutboundScheduler, bot, max_pending: int = 2):
+        self.exporter = exporter
+        self.outbound = outbound
+        self.bot = bot
+        self._jobs: "queue.Queue[Tuple[int, Sequence[str]]]" = queue.Queue(maxsize=max_pending)
+
+    def request(self, chat_id: int, tables: Sequence[str]) -> bool:
+        try:
+            self._jobs.put_nowait((chat_id, tables))
+            return True
+        except queue.Full:
+            return False
+
+    def run_forever(self, stop_event: threading.Event) -> None:
+        while not stop_event.is_set():
+            try:
+                chat_id, tables = self._jobs.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            try:
+                self._run(chat_id, tables)
+            except Exception as e:
+                logger.error(f"[Export] Export to {chat_id} failed: {e}", exc_info=True)
+                self.outbound.send_message(chat_id, "⚠️ Не удалось выгрузить данные")
+
+    def _run(self, chat_id: int, tables: Sequence[str]) -> None:
+        files = self.exporter.export(tables)
+        try:
+            for export_file in files:
+                if export_file.size > TELEGRAM_DOCUMENT_LIMIT:
+                    self.outbound.send_message(
+                        chat_id,
+                        f"⚠️ {export_file.file_name}: {export_file.size // (1024 * 1024)} МБ, "
+                        f"больше лимита Telegram на документ"
+                    )
+                    continue
+                self.bot.send_document(
+                    chat_id,
+                    export_file.file,
+                    visible_file_name=export_file.file_name,
+                    caption=f"{export_file.table}: {export_file.rows} строк"
+                )
+        finally:
+            for export_file in files:
+                export_file.close()
+
+
+def parse_export_tables(args: List[str]) -> Sequence[str]:
+    """Аргументы команды "/export [таблица ...]"; без аргументов - все таблицы"""
+    tables = [arg.lower() for arg in args] or list(EXPORT_TABLES)
+    unknown = [table for table in tables if table not in EXPORT_TABLES]
+    if unknown:
+        raise ValueError(f"Таблицы недоступны для выгрузки: {', '.join(unknown)}")
+    return tables
@@ -0,0 +1,25 @@
+import logging
+import threading
+import time
+
+from admin.storage.admin_repository import AdminRepository
+
+logger = logging.getLogger(__name__)
+
+
+# Класс StatsRefresher
+# Пересчитывает admin_stats раз в interval секунд:
+#     run_forever(stop_event) - цикл для фонового потока; первый пересчет сразу при старте
+# Несколько экземпляров бота могут пересчитывать одновременно: REFRESH ... CONCURRENTLY
+# сериализуется самим Postgres и не блокирует чтение статистики.
+class StatsRefresher:
+    def __init__(self, admin_repo: AdminRepository, interval: float = 300.0):
+        self.admin_repo = admin_repo
+        self.interval = interval
+
+    def run_forever(self, stop_event: threading.Event) -> None:
+        while not stop_event.is_set():
+            started = time.monotonic()
+            if self.admin_repo.refresh_statistics():
+                logger.info(f"[Admin Stats] Refreshed in {time.monotonic() - started:.2f}s")
+            stop_event.wait(self.interval)
@@ -1,5 +1,5 @@
 import logging
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
 from datetime import datetime
 from storage.postgres_storage import PostgresStorage
 from settings import ADMIN_IDS
@@ -14,6 +14,9 @@ logger = logging.getLogger(__name__)
 #     Статистики по уровням
 #     Статистики донатов
 #     Статистики рефералов
+#     Сводной статистики из материализованного представления admin_stats:
+#         get_statistics() - одна строка, время ответа не зависит от числа пользователей
+#         refresh_statistics() - пересчет без блокировки чтения (REFRESH ... CONCURRENTLY)
 
 class AdminRepository:
     def __init__(self, storage: PostgresStorage):
@@ -113,3 +116,56 @@ class AdminRepository:
                     'completed_referrals': 0,
                     'pending_referrals': 0
                 }
+
+    def get_statistics(self) -> Optional[Dict[str, Any]]:
+        """Сводная статистика из admin_stats; None, если представление еще не создано"""
+        with self.storage.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    """SELECT active_users, good_deeds, level_stats, donations_count,
+                        donations_amount, referrals_total, referrals_completed, refreshed_at
+                    FROM admin_stats WHERE id = 1"""
+                )
+                row = cursor.fetchone()
+                if not row:
+                    return None
+                return {
+                    'active_users': row[0],
+                    'good_deeds': row[1],
+                    'level_stats': {int(level): count for level, count in (row[2] or {}).items()},
+                    'donation_stats': {'total_count': row[3], 'total_amount': float(row[4])},
+                    'referral_stats': {
+                        'total_referrals': row[5],
+                        'completed_referrals': row[6],
+                        'pending_referrals': row[5] - row[6]
+                    },
+                    'refreshed_at': row[7],
+                }
+            except Exception as e:
+                logger.error(f"Error getting admin statistics: {e}")
+                return None
+
+    def refresh_statistics(self) -> bool:
+        """Пересчитывает admin_stats; чтение статистики во время пересчета не блокируется"""
+        with self.storage.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY admin_stats")
+                conn.commit()
+                return True
+            except Exception as e:
+                logger.error(f"Error refreshing admin statistics: {e}")
+                conn.rollback()
+                return False
+
+    def get_live_statistics(self) -> Dict[str, Any]:
+        """Та же статистика прямыми запросами к таблицам (если admin_stats недоступно)"""
+        return {
+            'active_users': self.get_active_users_count(),
+            'good_deeds': self.get_completed_good_deeds_count(),
+            'level_stats': self.get_level_statistics(),
+            'donation_stats': self.get_donation_statistics(),
+            'referral_stats': self.get_referral_statistics(),
+            'refreshed_at': datetime.now(),
+        }
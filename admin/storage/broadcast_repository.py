@@ -0,0 +1,168 @@
+import logging
+from typing import Any, Dict, List, Optional
+
+from storage.postgres_storage import PostgresStorage
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_COLUMNS = "id, created_by, text, level, registered, status, last_user_id, sent, failed, created_at"
+
+
+# Класс BroadcastRepository
+# Работает с рассылками (broadcasts):
+#     create(created_by, text, level, registered) - новая рассылка в статусе running
+#     claim_next(lease) - взять в работу следующую незанятую рассылку (аренда на lease секунд)
+#     get_audience_page(level, registered, after_user_id, limit) - следующая страница получателей
+#     checkpoint(...) - сохранить прогресс и продлить аренду, вернуть текущий статус
+#     finish(broadcast_id) / cancel(broadcast_id) / release(broadcast_id)
+#     get_recent(limit) - последние рассылки для /broadcast_status
+class BroadcastRepository:
+    def __init__(self, storage: PostgresStorage):
+        self.storage = storage
+
+    def create(self, created_by: int, text: str, level: Optional[int] = None,
+               registered: Optional[bool] = None) -> Optional[int]:
+        with self.storage.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    """INSERT INTO broadcasts (created_by, text, level, registered)
+                    VALUES (%s, %s, %s, %s) RETURNING id""",
+                    (created_by, text, level, registered)
+                )
+                broadcast_id = cursor.fetchone()[0]
+                conn.commit()
+                return broadcast_id
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Error creating broadcast: {e}")
+                return None
+
+    def claim_next(self, lease: float) -> Optional[Dict[str, Any]]:
+        """Старейшая рассылка в статусе running, которую не ведет другой экземпляр бота"""
+        with self.storage.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(f"""
+                    UPDATE broadcasts SET locked_until = NOW() + %s * INTERVAL '1 second'
+                    WHERE id = (
+                        SELECT id FROM broadcasts
+                        WHERE status = 'running'
+                            AND (locked_until IS NULL OR locked_until < NOW())
+                        ORDER BY id LIMIT 1
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING {BROADCAST_COLUMNS}
+                """, (lease,))
+                row = cursor.fetchone()
+                conn.commit()
+                if not row:
+                    return None
+                columns = [desc[0] for desc in cursor.description]
+                return dict(zip(columns, row))
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Error claiming broadcast: {e}")
+                return None
+
+    def get_audience_page(self, level: Optional[int], registered: Optional[bool],
+                          after_user_id: int, limit: int) -> List[int]:
+        """Получатели с id больше after_user_id по возрастанию id (keyset по первичному ключу)"""
+        conditions = ["id > %s"]
+        params: List[Any] = [after_user_id]
+        if level is not None:
+            conditions.append("current_level = %s")
+            params.append(level)
+        if registered is not None:
+            conditions.append("registration_complete = %s")
+            params.append(registered)
+        params.append(limit)
+
+        with self.storage.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT id FROM users WHERE {' AND '.join(conditions)} ORDER BY id LIMIT %s",
+                params
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def checkpoint(self, broadcast_id: int, last_user_id: int, sent: int, failed: int,
+                   lease: float) -> Optional[str]:
+        """Сохраняет прогресс страницы; возвращает статус рассылки (canceled - остановить)"""
+        with self.storage.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("""
+                    UPDATE broadcasts
+                    SET last_user_id = %s, sent = sent + %s, failed = failed + %s,
+                        updated_at = NOW(), locked_until = NOW() + %s * INTERVAL '1 second'
+                    WHERE id = %s
+                    RETURNING status
+                """, (last_user_id, sent, failed, lease, broadcast_id))
+                row = cursor.fetchone()
+                conn.commit()
+                return row[0] if row else None
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Error saving broadcast {broadcast_id} checkpoint: {e}")
+                return None
+
+    def finish(self, broadcast_id: int) -> Optional[Dict[str, Any]]:
+        with self.storage.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(f"""
+                    UPDATE broadcasts
+                    SET status = 'completed', finished_at = NOW(), updated_at = NOW(), locked_until = NULL
+                    WHERE id = %s AND status = 'running'
+                    RETURNING {BROADCAST_COLUMNS}
+                """, (broadcast_id,))
+                row = cursor.fetchone()
+                conn.commit()
+                if not row:
+                    return None
+                columns = [desc[0] for desc in cursor.description]
+                return dict(zip(columns, row))
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Error finishing broadcast {broadcast_id}: {e}")
+                return None
+
+    def cancel(self, broadcast_id: int) -> bool:
+        with self.storage.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("""
+                    UPDATE broadcasts
+                    SET status = 'canceled', finished_at = NOW(), updated_at = NOW()
+                    WHERE id = %s AND status = 'running'
+                """, (broadcast_id,))
+                canceled = cursor.rowcount > 0
+                conn.commit()
+                return canceled
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Error canceling broadcast {broadcast_id}: {e}")
+                return False
+
+    def release(self, broadcast_id: int) -> None:
+        """Снимает аренду, чтобы после перезапуска рассылка продолжилась сразу"""
+        with self.storage.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("UPDATE broadcasts SET locked_until = NULL WHERE id = %s", (broadcast_id,))
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Error releasing broadcast {broadcast_id}: {e}")
+
+    def get_recent(self, limit: int = 5) -> List[Dict[str, Any]]:
+        with self.storage.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(f"SELECT {BROADCAST_COLUMNS} FROM broadcasts ORDER BY id DESC LIMIT %s", (limit,))
+                columns = [desc[0] for desc in cursor.description]
+                return [dict(zip(columns, row)) for row in cursor.fetchall()]
+            except Exception as e:
+                logger.error(f"Error getting broadcasts: {e}")
+                return []
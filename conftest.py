@@ -0,0 +1 @@
+# Корень репозитория в sys.path, чтобы тесты из tests/ импортировали service, admin, payments
@@ -1,6 +1,5 @@
 import os
 import logging
-from pathlib import Path
 import threading
 import time
 from datetime import datetime, timedelta
@@ -8,120 +7,206 @@ import telebot
 from telebot import types
 from yookassa import Payment
 from service.config import MAX_LEVEL
+from admin.broadcast import Broadcaster, parse_broadcast_command
+from admin.export import EXPORT_TABLES, AdminExporter, ExportRunner, parse_export_tables
+from admin.stats_refresher import StatsRefresher
 from admin.storage.admin_repository import AdminRepository
-from payments.pay import create_payment, create_charity_payment
+from admin.storage.broadcast_repository import BroadcastRepository
+from payments.pay import PaymentService, PendingPaymentLimitError, check_payment_status
+from payments.poller import PaymentPoller
+from payments.webhook import YOOKASSA_NETWORKS, YooKassaNotificationHandler, create_payment_webhook_blueprint
 from service.repository import (
     UserRepository,
     UserDataRepository,
     LevelRepository,
     TaskRepository,
     ReferralRepository,
-    DonationRepository
+    DonationRepository,
+    MediaCacheRepository
 )
+from service.level_catalog import LevelCatalog
+from service.level_images import LevelImageIndex
+from service.logging_setup import get_logging_stats, parse_sample_rates, setup_logging
+from service.media_cache import TelegramFileCache
+from service.outbound import OutboundScheduler
+from service.router import Router
+from service.state_store import WriteBehindStateStore
 from service.states import BotStates
-from settings import BOT_TOKEN
+from service.time_tasks import TimeTaskScheduler
+from service.http_server import HttpServer
+from service.keyboards import KeyboardFactory
+from service.update_intake import UpdateIntake, create_telegram_webhook_blueprint
+from service.user_context import UserContextManager
+from settings import (
+    BOT_TOKEN,
+    DB_POOL_MIN_SIZE,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_MAX_LIFETIME,
+    DB_POOL_WAIT_TIMEOUT,
+    LEVEL_IMAGES_DIR,
+    PAYMENT_POLL_WORKERS,
+    PAYMENT_POLL_INTERVAL,
+    PAYMENT_POLL_TTL_HOURS,
+    HTTP_HOST,
+    HTTP_PORT,
+    HTTP_TRUST_PROXY,
+    PAYMENT_WEBHOOK_ENABLED,
+    PAYMENT_WEBHOOK_PATH,
+    PAYMENT_WEBHOOK_VERIFY_API,
+    YOOKASSA_TRUSTED_NETWORKS,
+    PAYMENT_RECONCILE_DELAY,
+    PAYMENT_REUSE_TTL,
+    PAYMENT_MAX_PENDING_PER_USER,
+    BOT_UPDATE_MODE,
+    TELEGRAM_WEBHOOK_URL,
+    TELEGRAM_WEBHOOK_PATH,
+    TELEGRAM_WEBHOOK_SECRET,
+    UPDATE_LANES,
+    UPDATE_QUEUE_SIZE,
+    UPDATE_ENQUEUE_TIMEOUT,
+    USER_DATA_COALESCE_INTERVAL,
+    STATE_WRITE_BEHIND_WINDOW,
+    STATE_WRITE_BEHIND_MAX_DIRTY,
+    LOG_LEVEL,
+    LOG_FORMAT,
+    LOG_SAMPLE_RATES,
+    LOG_QUEUE_SIZE,
+    ADMIN_STATS_REFRESH_INTERVAL,
+    OUTBOUND_GLOBAL_RATE,
+    OUTBOUND_CHAT_RATE,
+    OUTBOUND_CHAT_BURST,
+    OUTBOUND_WORKERS,
+    OUTBOUND_QUEUE_SIZE,
+    OUTBOUND_COALESCE,
+    BROADCAST_RATE,
+    BROADCAST_PAGE_SIZE,
+    TIME_TASK_LOOKAHEAD,
+    TIME_TASK_RELOAD_INTERVAL
+)
 from storage.migrator import Migrator
-from storage.postgres_storage import PostgresStorage
-from logging.handlers import RotatingFileHandler
-
-bot = telebot.TeleBot(BOT_TOKEN, threaded=True, num_threads=5)
-
-Path("logs").mkdir(exist_ok=True)
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        RotatingFileHandler(
-            filename='logs/bot.log',
-            maxBytes=5 * 1024 * 1024,
-            backupCount=3,
-            encoding='utf-8'
-        )
-    ]
+from storage.pooled_storage import PooledPostgresStorage
+
+# Обработчики запускаются в дорожках UpdateIntake, собственный пул потоков telebot не нужен
+bot = telebot.TeleBot(BOT_TOKEN, threaded=False)
+
+# Исходящие сообщения: обработчики ставят их в очередь, отправка - с учетом лимитов Telegram
+outbound = OutboundScheduler(
+    bot,
+    global_rate=OUTBOUND_GLOBAL_RATE,
+    chat_rate=OUTBOUND_CHAT_RATE,
+    chat_burst=OUTBOUND_CHAT_BURST,
+    workers=OUTBOUND_WORKERS,
+    max_queue=OUTBOUND_QUEUE_SIZE,
+    coalesce=OUTBOUND_COALESCE,
+    bulk_rate=BROADCAST_RATE
+)
+
+# Запись логов на диск и в консоль идет в фоновом потоке, см. service/logging_setup.py
+setup_logging(
+    log_file='logs/bot.log',
+    level=getattr(logging, LOG_LEVEL, logging.INFO),
+    json_format=LOG_FORMAT == 'json',
+    sample_rates=parse_sample_rates(LOG_SAMPLE_RATES),
+    queue_size=LOG_QUEUE_SIZE
 )
 
 logger = logging.getLogger(__name__)
 
-storage = PostgresStorage(
+storage = PooledPostgresStorage(
     dbname='probuzhdenie',
     user='postgres',
     password='5g',
     host='localhost',
-    port='5433'
+    port='5433',
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=DB_POOL_MAX_SIZE,
+    max_lifetime=DB_POOL_MAX_LIFETIME,
+    wait_timeout=DB_POOL_WAIT_TIMEOUT
 )
 
 migrator = Migrator(storage)
 migrator.migrate()
 
-user_repo = UserRepository(storage)
-user_data_repo = UserDataRepository(storage)
+state_store = (
+    WriteBehindStateStore(storage, window=STATE_WRITE_BEHIND_WINDOW, max_dirty=STATE_WRITE_BEHIND_MAX_DIRTY)
+    if STATE_WRITE_BEHIND_WINDOW > 0 else None
+)
+user_repo = UserRepository(storage, state_store=state_store)
+user_data_repo = UserDataRepository(storage, coalesce_interval=USER_DATA_COALESCE_INTERVAL)
 level_repo = LevelRepository(storage)
 task_repo = TaskRepository(storage)
 referral_repo = ReferralRepository(storage)
 donation_repo = DonationRepository(storage)
+payment_service = PaymentService(
+    donation_repo,
+    reuse_ttl=PAYMENT_REUSE_TTL,
+    max_pending=PAYMENT_MAX_PENDING_PER_USER,
+    pending_ttl=PAYMENT_POLL_TTL_HOURS * 3600
+)
 admin_repo = AdminRepository(storage)
+export_runner = ExportRunner(AdminExporter(storage), outbound, bot)
+broadcaster = Broadcaster(BroadcastRepository(storage), outbound, bot, page_size=BROADCAST_PAGE_SIZE)
+user_context = UserContextManager(user_repo, user_data_repo)
+router = Router(state_getter=user_context.get_state)
+level_catalog = LevelCatalog(level_repo, storage)
+level_catalog.load()
+photo_cache = TelegramFileCache(bot, MediaCacheRepository(storage))
+level_images = LevelImageIndex(LEVEL_IMAGES_DIR)
+level_images.reload()
 TASK_DURATION = timedelta(hours=24)
+PENDING_PAYMENTS_LIMIT_TEXT = (
+    "⏳ У вас уже есть неоплаченные платежи. Оплатите один из них или дождитесь, "
+    "пока они истекут, и нажмите 'Проверить статус'."
+)
+
+
+keyboards = KeyboardFactory()
 
 
 def create_main_menu_keyboard():
-    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    keyboard.add(types.KeyboardButton("Правила игры"))
-    keyboard.add(types.KeyboardButton("О боте"))
-    return keyboard
+    return keyboards.main_menu
 
 
 def create_back_keyboard():
-    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    keyboard.add(types.KeyboardButton("Назад"))
-    return keyboard
+    return keyboards.back
 
 
 def create_level_navigation_keyboard(current_level, user_id=None, task_repo=None):
-    """Создает клавиатуру для навигации по уровням с кнопкой 'Далее'"""
-    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    logger.info(f"[Keyboard] Creating navigation for level {current_level}")
-
-    if current_level > 1:
-        keyboard.add(types.KeyboardButton(f"{current_level - 1} уровень"))
-        logger.info(f"[Keyboard] Added previous level button: {current_level - 1}")
-
-    if current_level == 1:
-        keyboard.add(types.KeyboardButton("Далее"))
-        logger.info("[Keyboard] Added simple 'Далее' button for level 1")
-
-    elif current_level >= 21:
-        keyboard.add(types.KeyboardButton("Далее"))
-        logger.info("[Keyboard] Added special 'Далее' button for final level")
-
-    else:
-        if task_repo is not None and user_id is not None:
-            is_completed = task_repo.is_task_completed(user_id, current_level)
-            logger.info(f"[Keyboard] Task completion check: {is_completed}")
+    """Клавиатура навигации по уровням с кнопкой 'Далее' (готовая, из KeyboardFactory)"""
+    completed = False
+    # Кнопка следующего уровня зависит от выполнения задания только на уровнях 2..20
+    if task_repo is not None and user_id is not None and 1 < current_level < MAX_LEVEL:
+        completed = task_repo.is_task_completed(user_id, current_level)
+    return keyboards.level_navigation(current_level, completed)
 
-            if is_completed:
-                if current_level <= 20:
-                    keyboard.add(types.KeyboardButton(f"{current_level + 1} уровень"))
-                    logger.info(f"[Keyboard] Added next level button: {current_level + 1}")
 
-        keyboard.add(types.KeyboardButton("Далее, перейти к следующему уровню."))
-        logger.info("[Keyboard] Added main 'Далее' button with text")
+def send_level_image(chat_id, level_number, level_rules, keyboard):
+    """Отправляет изображение уровня, если в правилах указано image:<имя>"""
+    if not level_rules or not level_rules.startswith("image:"):
+        return False
 
-    if 2 <= current_level <= 21:
-        keyboard.add(types.KeyboardButton("Правила игры для уровня игры:3-21"))
-        logger.info("[Keyboard] Added special rules button")
+    image_path = level_images.resolve(level_rules)
+    if not image_path:
+        logger.error(f"[Level {level_number}] Image not found in index: {level_rules}")
+        return False
 
-    return keyboard
+    try:
+        outbound.submit(chat_id, photo_cache.send_photo, chat_id, image_path, reply_markup=keyboard)
+        logger.info(f"[Level {level_number}] Image queued: {image_path}")
+        return True
+    except Exception as e:
+        logger.error(f"[Level {level_number}] Error sending image: {str(e)}")
+        return False
 
 
-@bot.message_handler(func=lambda message: message.text == "Далее")
+@router.message_handler(text="Далее")
 def handle_next_button(message):
     """Обработчик кнопки 'Далее' с учетом просматриваемого уровня"""
     try:
         user_id = message.from_user.id
-        user = user_repo.get_user(user_id)
-        current_level = user.get('current_level', 1)
-        viewed_level = user_data_repo.get_viewed_level(user_id)
+        user = user_context.get_snapshot(message)
+        current_level = user.level
+        viewed_level = user.viewed_level
 
         logger.info(f"[Next Button] User {user_id} pressed 'Далее'. Current: {current_level}, Viewed: {viewed_level}")
 
@@ -155,38 +240,34 @@ def handle_next_button(message):
 
         if not user_repo.update_user_level(user_id, next_level):
             logger.error("[Next Button] Failed to update user level")
-            return bot.reply_to(message, "Ошибка обновления уровня")
+            return outbound.reply_to(message, "Ошибка обновления уровня")
 
         show_level_content(message, next_level)
 
     except Exception as e:
         logger.error(f"[Next Button] Error: {str(e)}", exc_info=True)
-        bot.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+        outbound.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 
-@bot.message_handler(func=lambda message: message.text == "Ссылка на сообщество" and
-                                          user_repo.get_user_state(message.from_user.id) == BotStates.FINAL_LEVEL)
+@router.message_handler(text="Ссылка на сообщество", states=BotStates.FINAL_LEVEL)
 def handle_community_link(message):
     try:
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             "Нажмите на ссылку, чтобы присоединиться к нашему сообществу:\n"
             "https://t.me/your_community_link",  # необходимо прописать настоящую ссылку
             disable_web_page_preview=True
         )
 
-        back_keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        back_keyboard.add(types.KeyboardButton("Назад"))
-
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             "После вступления вы можете вернуться в меню",
-            reply_markup=back_keyboard
+            reply_markup=keyboards.back
         )
 
     except Exception as e:
         logger.error(f"Error in handle_community_link: {e}")
-        bot.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+        outbound.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 
 def show_final_level_message(message):
@@ -200,12 +281,9 @@ def show_final_level_message(message):
             "Спасибо за ваше участие и преданность практике!"
         )
 
-        keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        keyboard.add(types.KeyboardButton("Ссылка на сообщество"),
-                     types.KeyboardButton("Благотворительность")
-                     )
+        keyboard = keyboards.reply(("Ссылка на сообщество", "Благотворительность"))
 
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             final_text,
             reply_markup=keyboard
@@ -214,7 +292,7 @@ def show_final_level_message(message):
 
     except Exception as e:
         logger.error(f"Error in show_final_level_message: {e}")
-        bot.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+        outbound.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 
 def show_level_content(message, level_number):
@@ -222,31 +300,26 @@ def show_level_content(message, level_number):
     try:
         user_id = message.from_user.id
         user_data_repo.set_viewed_level(user_id, level_number)
-        user = user_repo.get_user(user_id)
+        user = user_context.get_snapshot(message)
 
-        if user and user.get('current_level') < level_number:
+        if user and user.level < level_number:
             logger.warning(
-                f"User {user_id} trying to view level {level_number} beyond current {user.get('current_level')}")
-            level_number = user.get('current_level')
+                f"User {user_id} trying to view level {level_number} beyond current {user.level}")
+            level_number = user.level
 
-        level_content = level_repo.get_level_content(level_number)
-        level_rules = level_repo.get_level_rules(level_number)
+        level_content, level_rules = level_catalog.content_and_rules(level_number)
 
         logger.info(f"[Level {level_number}] Content length: {len(level_content) if level_content else 0}")
         logger.info(f"[Level {level_number}] Rules content: {level_rules[:50] + '...' if level_rules else 'None'}")
 
         if not level_content:
             logger.warning(f"[Level {level_number}] No content found")
-            bot.send_message(message.chat.id, "Контент для этого уровня пока недоступен.")
+            outbound.send_message(message.chat.id, "Контент для этого уровня пока недоступен.")
             return
 
 
         if level_number == 1:
-            keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-            keyboard.add(
-                types.KeyboardButton("Ответы на вопросы"),
-                types.KeyboardButton("Далее")
-            )
+            keyboard = keyboards.reply(("Ответы на вопросы", "Далее"))
         else:
             keyboard = create_level_navigation_keyboard(
                 level_number,
@@ -254,87 +327,16 @@ def show_level_content(message, level_number):
                 task_repo=task_repo
             )
 
-        bot.send_message(message.chat.id, level_content, reply_markup=keyboard)
+        outbound.send_message(message.chat.id, level_content, reply_markup=keyboard)
 
-        if level_rules and level_rules.startswith("image:"):
-            try:
-                import os
-                from pathlib import Path
-
-                image_relative = level_rules.replace("image:", "").strip()
-
-                possible_paths = [
-                    Path(r"C:\projects\1bot_probuzhdenie\static\levels"),
-                    Path(r"C:\1bot_probuzhdenie\static\levels"),
-                    Path(r"C:\static\levels"),
-                    Path(r"C:\app\static\levels"),
-
-                    Path("/var/www/1bot_probuzhdenie/static/levels"),
-                    Path("/app/static/levels"),
-
-                    Path(__file__).resolve().parent.parent.parent / "1bot_probuzhdenie" / "static" / "levels",
-                    Path(__file__).resolve().parent.parent / "static" / "levels",
-                ]
-
-                checked_paths = []
-                for path in possible_paths:
-                    try:
-                        path = path.resolve()
-                        if path not in checked_paths and path.exists():
-                            checked_paths.append(path)
-                    except Exception:
-                        continue
-
-                logger.info(f"[Level {level_number}] Checking image paths:\n" +
-                            "\n".join(f" - {p}" for p in checked_paths))
-
-                static_levels_dir = None
-                for path in checked_paths:
-                    if (path / image_relative).exists() or any(path.glob(image_relative + ".*")):
-                        static_levels_dir = path
-                        break
-
-                if not static_levels_dir:
-                    logger.error(f"[Level {level_number}] No valid images directory found")
-                    logger.info(f"[Level {level_number}] Checked paths:\n" +
-                                "\n".join(f" - {p}" for p in checked_paths))
-                    raise FileNotFoundError("No valid images directory found")
-
-                logger.info(f"[Level {level_number}] Using images dir: {static_levels_dir}")
-
-                image_path = None
-                extensions = ['', '.jpg', '.jpeg', '.png', '.gif']
-
-                for ext in extensions:
-                    test_path = static_levels_dir / f"{image_relative}{ext}"
-                    if test_path.exists():
-                        image_path = test_path
-                        break
-
-                if not image_path:
-                    logger.error(
-                        f"[Level {level_number}] Image not found. Tried: {image_relative} with extensions {extensions}")
-                    logger.info(f"[Level {level_number}] Available files:\n" +
-                                "\n".join(f" - {f.name}" for f in static_levels_dir.glob('*')))
-                    raise FileNotFoundError("Image file not found")
-
-                with open(image_path, 'rb') as photo:
-                    bot.send_photo(
-                        message.chat.id,
-                        photo,
-                        reply_markup=keyboard
-                    )
-                    logger.info(f"[Level {level_number}] Image successfully sent: {image_path}")
-
-            except Exception as e:
-                logger.error(f"[Level {level_number}] Error processing image: {str(e)}")
+        send_level_image(message.chat.id, level_number, level_rules, keyboard)
 
         user_repo.set_user_state(user_id, BotStates.LEVEL_CONTENT)
         logger.info(f"[Level {level_number}] User state set to LEVEL_CONTENT")
 
     except Exception as e:
         logger.error(f"[Level {level_number}] Error in show_level_content: {str(e)}", exc_info=True)
-        bot.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+        outbound.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 
 @bot.message_handler(commands=['admin'])
@@ -344,17 +346,23 @@ def handle_admin_command(message):
         logger.info(f"Admin command received from {user_id}")
 
         if not admin_repo.is_admin(user_id):
-            bot.reply_to(message, "⛔ У вас нет прав администратора")
+            outbound.reply_to(message, "⛔ У вас нет прав администратора")
             return
 
-        active_users = admin_repo.get_active_users_count()
-        good_deeds = admin_repo.get_completed_good_deeds_count()
-        level_stats = admin_repo.get_level_statistics()
-        donation_stats = admin_repo.get_donation_statistics()
-        referral_stats = admin_repo.get_referral_statistics()
+        # "/admin refresh" пересчитывает статистику перед ответом
+        if message.text.split()[1:2] == ['refresh']:
+            admin_repo.refresh_statistics()
+
+        stats = admin_repo.get_statistics() or admin_repo.get_live_statistics()
+        active_users = stats['active_users']
+        good_deeds = stats['good_deeds']
+        level_stats = stats['level_stats']
+        donation_stats = stats['donation_stats']
+        referral_stats = stats['referral_stats']
 
         stats_message = (
-            "📊 Статистика бота:\n\n"
+            "📊 Статистика бота:\n"
+            f"🕒 Данные на {stats['refreshed_at']:%d.%m.%Y %H:%M:%S}\n\n"
             f"👥 Активных пользователей: {active_users}\n"
             f"🔄 Выполнено добрых дел: {good_deeds}\n\n"
             "📈 Статистика по уровням:\n"
@@ -372,15 +380,200 @@ def handle_admin_command(message):
             f"  • В процессе: {referral_stats['pending_referrals']}"
         )
 
-        bot.reply_to(message, stats_message)
+        pool_stats = storage.get_stats()
+        stats_message += (
+            f"\n\n🗄 Пул БД: занято {pool_stats['in_use']}/{pool_stats['max_size']}, "
+            f"свободно {pool_stats['idle']}, ожиданий {pool_stats['waits']} "
+            f"({pool_stats['wait_time_total']:.2f} с)"
+        )
+
+        context_stats = user_context.get_stats()
+        stats_message += (
+            f"\n⚙️ Запросов к БД на обновление: {context_stats['db_queries_per_update']} "
+            f"(макс. {context_stats['max_db_queries_per_update']}), "
+            f"из них снимков пользователя: {context_stats['snapshot_queries_per_update']}"
+        )
+
+        poller_stats = payment_poller.get_stats()
+        if poller_stats:
+            stats_message += (
+                f"\n💳 Сверка платежей: в очереди {poller_stats['pending']}, "
+                f"проверено за цикл {poller_stats['checked']}, "
+                f"длительность {poller_stats['duration']:.1f} с"
+            )
+
+        if state_store:
+            store_stats = state_store.get_stats()
+            stats_message += (
+                f"\n📝 Состояния: в памяти {store_stats['dirty']}, "
+                f"записей {store_stats['sets']} → {store_stats['flushes']} пакетов в БД"
+            )
+
+        time_stats = time_task_scheduler.get_stats()
+        stats_message += (
+            f"\n⏰ Задания на время: в очереди {time_stats['scheduled']}, "
+            f"уведомлено {time_stats['notified']}"
+        )
+
+        log_stats = get_logging_stats()
+        stats_message += (
+            f"\n🧾 Логи: в очереди {log_stats['queue_depth']}, "
+            f"пропущено сэмплированием {log_stats['sampled_out']}, потеряно {log_stats['queue_dropped']}"
+        )
+
+        intake_stats = update_intake.get_stats()
+        stats_message += (
+            f"\n📥 Очередь обновлений: {intake_stats['depth']}/{intake_stats['capacity']} "
+            f"в {intake_stats['lanes']} дорожках (макс. в дорожке {intake_stats['max_depth']}), "
+            f"отклонено {intake_stats['rejected']}, ожидание макс. {intake_stats['queue_wait_max']:.2f} с"
+        )
+
+        outbound_stats = outbound.get_stats()
+        stats_message += (
+            f"\n📤 Исходящие: в очереди {outbound_stats['depth']}, отправлено {outbound_stats['sent']} "
+            f"(склеено {outbound_stats['coalesced']}), 429: {outbound_stats['throttled']}, "
+            f"потеряно {outbound_stats['dropped'] + outbound_stats['failed']}, "
+            f"ожидание макс. {outbound_stats['queue_wait_max']:.2f} с"
+        )
+
+        outbound.reply_to(message, stats_message)
 
     except Exception as e:
         logger.error(f"Error in admin command: {e}")
-        bot.reply_to(message, "⚠️ Произошла ошибка при получении статистики")
+        outbound.reply_to(message, "⚠️ Произошла ошибка при получении статистики")
+
+
+@bot.message_handler(commands=['reload_images'])
+def handle_reload_images(message):
+    try:
+        if not admin_repo.is_admin(message.from_user.id):
+            outbound.reply_to(message, "⛔ У вас нет прав администратора")
+            return
+
+        count = level_images.reload()
+        outbound.reply_to(message, f"🖼 Изображения уровней перечитаны: {count}")
+    except Exception as e:
+        logger.error(f"Error in reload_images command: {e}")
+        outbound.reply_to(message, "⚠️ Не удалось перечитать изображения")
+
+
+@bot.message_handler(commands=['rebuild_referrals'])
+def handle_rebuild_referrals(message):
+    try:
+        if not admin_repo.is_admin(message.from_user.id):
+            outbound.reply_to(message, "⛔ У вас нет прав администратора")
+            return
+
+        rows = referral_repo.rebuild_counters()
+        if rows is None:
+            outbound.reply_to(message, "⚠️ Не удалось пересчитать счетчики рефералов")
+            return
+        outbound.reply_to(message, f"👥 Счетчики рефералов пересчитаны: {rows}")
+    except Exception as e:
+        logger.error(f"Error in rebuild_referrals command: {e}")
+        outbound.reply_to(message, "⚠️ Не удалось пересчитать счетчики рефералов")
 
 
-@bot.message_handler(func=lambda message: message.text == "Правила игры для уровня игры:3-21" and
-                                          user_repo.get_user_state(message.from_user.id) == BotStates.LEVEL_CONTENT)
+@bot.message_handler(commands=['broadcast'])
+def handle_broadcast(message):
+    """/broadcast [level=N] [registered|unregistered] текст - рассылка пользователям"""
+    try:
+        if not admin_repo.is_admin(message.from_user.id):
+            outbound.reply_to(message, "⛔ У вас нет прав администратора")
+            return
+
+        text, level, registered = parse_broadcast_command(message.text)
+        broadcast_id = broadcaster.start_broadcast(message.from_user.id, text, level, registered)
+        if broadcast_id is None:
+            outbound.reply_to(message, "⚠️ Не удалось создать рассылку")
+            return
+
+        audience = []
+        if level is not None:
+            audience.append(f"уровень {level}")
+        if registered is not None:
+            audience.append("зарегистрированные" if registered else "без регистрации")
+        outbound.reply_to(
+            message,
+            f"📣 Рассылка #{broadcast_id} запущена ({', '.join(audience) or 'все пользователи'}).\n"
+            f"Прогресс: /broadcast_status, отмена: /broadcast_cancel {broadcast_id}"
+        )
+    except ValueError as e:
+        outbound.reply_to(message, f"⚠️ {e}\nФормат: /broadcast [level=N] [registered|unregistered] текст")
+    except Exception as e:
+        logger.error(f"Error in broadcast command: {e}")
+        outbound.reply_to(message, "⚠️ Не удалось создать рассылку")
+
+
+@bot.message_handler(commands=['broadcast_status'])
+def handle_broadcast_status(message):
+    try:
+        if not admin_repo.is_admin(message.from_user.id):
+            outbound.reply_to(message, "⛔ У вас нет прав администратора")
+            return
+
+        broadcasts = broadcaster.repo.get_recent()
+        if not broadcasts:
+            outbound.reply_to(message, "Рассылок еще не было")
+            return
+
+        current = broadcaster.get_current()
+        lines = ["📣 Последние рассылки:"]
+        for item in broadcasts:
+            line = (f"#{item['id']} {item['created_at']:%d.%m %H:%M} - {item['status']}: "
+                    f"доставлено {item['sent']}, не доставлено {item['failed']}")
+            if current and current['id'] == item['id']:
+                line += f", {current['rate']} сообщ./с"
+            lines.append(line)
+        outbound.reply_to(message, "\n".join(lines))
+    except Exception as e:
+        logger.error(f"Error in broadcast_status command: {e}")
+        outbound.reply_to(message, "⚠️ Не удалось получить статус рассылок")
+
+
+@bot.message_handler(commands=['broadcast_cancel'])
+def handle_broadcast_cancel(message):
+    try:
+        if not admin_repo.is_admin(message.from_user.id):
+            outbound.reply_to(message, "⛔ У вас нет прав администратора")
+            return
+
+        args = message.text.split()[1:]
+        if not args or not args[0].isdigit():
+            outbound.reply_to(message, "Формат: /broadcast_cancel <номер рассылки>")
+            return
+        if broadcaster.cancel(int(args[0])):
+            outbound.reply_to(message, f"⏹ Рассылка #{args[0]} будет остановлена после текущей страницы")
+        else:
+            outbound.reply_to(message, f"Рассылка #{args[0]} не найдена или уже завершена")
+    except Exception as e:
+        logger.error(f"Error in broadcast_cancel command: {e}")
+        outbound.reply_to(message, "⚠️ Не удалось отменить рассылку")
+
+
+@bot.message_handler(commands=['export'])
+def handle_export(message):
+    """/export [users tasks donations referrals user_data] - выгрузка таблиц в CSV.gz"""
+    try:
+        if not admin_repo.is_admin(message.from_user.id):
+            outbound.reply_to(message, "⛔ У вас нет прав администратора")
+            return
+
+        tables = parse_export_tables(message.text.split()[1:])
+        # Выгрузка и отправка файлов идут в фоновом потоке, дорожка обработчика свободна
+        if export_runner.request(message.chat.id, tables):
+            outbound.reply_to(message, f"⏳ Выгрузка: {', '.join(tables)}")
+        else:
+            outbound.reply_to(message, "⏳ Уже выполняются другие выгрузки, попробуйте позже")
+
+    except ValueError as e:
+        outbound.reply_to(message, f"⚠️ {e}. Доступны: {', '.join(EXPORT_TABLES)}")
+    except Exception as e:
+        logger.error(f"Error in export command: {e}", exc_info=True)
+        outbound.reply_to(message, "⚠️ Не удалось выгрузить данные")
+
+
+@router.message_handler(text="Правила игры для уровня игры:3-21", states=BotStates.LEVEL_CONTENT)
 def handle_level_rules(message):
     try:
         rules_text = (
@@ -389,14 +582,14 @@ def handle_level_rules(message):
             "тем самым Вселенная соблюдает баланс, который состоит из противостояния духа и материального."
         )
 
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             rules_text,
             reply_markup=create_back_keyboard()
         )
     except Exception as e:
         logger.error(f"Error in handle_level_rules: {e}")
-        bot.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+        outbound.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 
 def validate_name(name):
@@ -438,15 +631,15 @@ def handle_start(message):
                 if referrer_id == user_id:
                     logger.warning("Пользователь попытался пригласить себя")
                 else:
-                    existing_user = user_repo.get_user(user_id)
-                    if existing_user and existing_user.get('registration_complete'):
+                    existing_user = user_context.get_snapshot(message)
+                    if existing_user and existing_user.registration_complete:
                         logger.info(f"Пользователь {user_id} уже зарегистрирован")
                     else:
                         referrer = user_repo.get_user(referrer_id)
                         if referrer and level > referrer.get('current_level', 1):
                             logger.warning(
                                 f"Уровень {level} превышает уровень реферера {referrer.get('current_level', 1)}")
-                            bot.send_message(user_id, "❌ Уровень в ссылке недействителен")
+                            outbound.send_message(user_id, "❌ Уровень в ссылке недействителен")
                             return
                         else:
                             user_repo.create_user(user_id)
@@ -457,27 +650,23 @@ def handle_start(message):
                 logger.error(f"Ошибка обработки реферальной ссылки: {e}")
 
         user_repo.create_user(user_id)
-        user = user_repo.get_user(user_id)
+        user = user_context.get_snapshot(message)
 
-        if user and user.get('registration_complete'):
+        if user and user.registration_complete:
             show_main_menu(message)
         else:
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 "Выберите язык:",
-                reply_markup=types.ReplyKeyboardMarkup(
-                    resize_keyboard=True,
-                    one_time_keyboard=True
-                ).add(types.KeyboardButton("Русский"))
+                reply_markup=keyboards.reply("Русский", one_time=True)
             )
             user_repo.set_user_state(user_id, BotStates.LANGUAGE_SELECTION)
     except Exception as e:
         logger.error(f"Error in handle_start: {e}", exc_info=True)
-        bot.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+        outbound.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 
-@bot.message_handler(func=lambda message:
-user_repo.get_user_state(message.from_user.id) == BotStates.LANGUAGE_SELECTION)
+@router.message_handler(states=BotStates.LANGUAGE_SELECTION)
 def handle_language_selection(message):
     try:
         user_id = message.from_user.id
@@ -492,7 +681,7 @@ def handle_language_selection(message):
 
             logger.info(f"Language saved for {user_id}")
 
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 "Добро пожаловать в бота 'Пробуждение'!",
                 reply_markup=create_main_menu_keyboard()
@@ -501,17 +690,16 @@ def handle_language_selection(message):
             logger.info(f"User {user_id} state set to MAIN_MENU")
 
         else:
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 "Пожалуйста, выберите язык из предложенных вариантов."
             )
     except Exception as e:
         logger.error(f"Error in handle_language_selection for user {message.from_user.id}: {e}")
-        bot.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+        outbound.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 
-@bot.message_handler(func=lambda message: message.text == "О боте" and
-                                          user_repo.get_user_state(message.from_user.id) == BotStates.MAIN_MENU)
+@router.message_handler(text="О боте", states=BotStates.MAIN_MENU)
 def handle_about(message):
     try:
         about_text = (
@@ -520,28 +708,23 @@ def handle_about(message):
             " в следствии чего – сделать мир лучше."
         )
 
-        keyboard = types.InlineKeyboardMarkup()
-        keyboard.add(types.InlineKeyboardButton(
-            text="Сообщество 'Создатели'",
-            url="https://example.com/community"
-        ))
+        keyboard = keyboards.inline_url("Сообщество 'Создатели'", "https://example.com/community")
 
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             about_text,
             reply_markup=keyboard
         )
     except Exception as e:
         logger.error(f"Error in handle_about: {e}")
-        bot.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+        outbound.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 
-@bot.message_handler(func=lambda message: message.text == "Правила игры" and
-                                          user_repo.get_user_state(message.from_user.id) == BotStates.MAIN_MENU)
+@router.message_handler(text="Правила игры", states=BotStates.MAIN_MENU)
 def handle_rules(message):
     logger.info(f"RAW MESSAGE CONTENT: {repr(message.text)}")
     user_id = message.from_user.id
-    db_state = user_repo.get_user_state(user_id)
+    db_state = user_context.get_state(message)
     expected_state = BotStates.MAIN_MENU
     logger.info(
         f"CRITICAL CHECK: db_state={db_state}, expected={expected_state}, types: {type(db_state)}/{type(expected_state)}")
@@ -550,7 +733,7 @@ def handle_rules(message):
         logger.error(f"STATE MISMATCH! Database returns: {db_state}")
         user = user_repo.get_user(user_id)
         logger.error(f"Full user data: {user}")
-    if str(user_repo.get_user_state(message.from_user.id)) != str(BotStates.MAIN_MENU):
+    if str(user_context.get_state(message)) != str(BotStates.MAIN_MENU):
         logger.error("State validation failed!")
         return
     try:
@@ -562,20 +745,16 @@ def handle_rules(message):
             "После каждого выполненного задания пользователь получает “добрые очки”, достижения и вдохновляющие истории"
         )
 
-        keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-
-        user = user_repo.get_user(message.from_user.id)
-        logger.info(f"User registration status: {user.get('registration_complete') if user else 'User not found'}")
+        user = user_context.get_snapshot(message)
+        logger.info(f"User registration status: {user.registration_complete if user else 'User not found'}")
 
-        if user and user.get('registration_complete'):
-            keyboard.add(types.KeyboardButton("Начать игру"))
+        if user and user.registration_complete:
+            keyboard = keyboards.reply("Начать игру", "Назад")
         else:
-            keyboard.add(types.KeyboardButton("Принять"))
-
-        keyboard.add(types.KeyboardButton("Назад"))
+            keyboard = keyboards.reply("Принять", "Назад")
 
         logger.info("Sending rules message with keyboard")
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             rules_text,
             reply_markup=keyboard
@@ -584,54 +763,52 @@ def handle_rules(message):
 
     except Exception as e:
         logger.error(f"Error in handle_rules: {str(e)}", exc_info=True)
-        bot.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+        outbound.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 
 def start_registration(message):
     try:
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             "Введите имя:",
-            reply_markup=types.ReplyKeyboardRemove()
+            reply_markup=keyboards.remove
         )
         user_repo.set_user_state(message.from_user.id, BotStates.REGISTRATION_NAME)
     except Exception as e:
         logger.error(f"Error in start_registration: {e}")
-        bot.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+        outbound.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 
-@bot.message_handler(func=lambda message: message.text == "Принять" and
-                                          user_repo.get_user_state(message.from_user.id) == BotStates.MAIN_MENU)
+@router.message_handler(text="Принять", states=BotStates.MAIN_MENU)
 def handle_accept_rules(message):
     try:
         user_id = message.from_user.id
         logger.info(f"User {user_id} accepted the rules, starting registration")
 
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             "Спасибо за принятие правил! Давайте начнем регистрацию.",
-            reply_markup=types.ReplyKeyboardRemove()
+            reply_markup=keyboards.remove
         )
 
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             "Введите ваше имя:",
-            reply_markup=types.ReplyKeyboardRemove()
+            reply_markup=keyboards.remove
         )
 
         user_repo.set_user_state(user_id, BotStates.REGISTRATION_NAME)
 
     except Exception as e:
         logger.error(f"Error in handle_accept_rules: {e}")
-        bot.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+        outbound.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 
-@bot.message_handler(func=lambda message:
-user_repo.get_user_state(message.from_user.id) == BotStates.REGISTRATION_NAME)
+@router.message_handler(states=BotStates.REGISTRATION_NAME)
 def process_name_step(message):
     try:
         if not validate_name(message.text):
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 "Данные некорректны. Введите ваше реальное имя:"
             )
@@ -642,22 +819,21 @@ def process_name_step(message):
             name=message.text
         )
 
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             "Введите дату рождения (в формате ДД.ММ.ГГГГ):"
         )
         user_repo.set_user_state(message.from_user.id, BotStates.REGISTRATION_BIRTHDATE)
     except Exception as e:
         logger.error(f"Error in process_name_step: {e}")
-        bot.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+        outbound.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 
-@bot.message_handler(func=lambda message:
-user_repo.get_user_state(message.from_user.id) == BotStates.REGISTRATION_BIRTHDATE)
+@router.message_handler(states=BotStates.REGISTRATION_BIRTHDATE)
 def process_birthdate_step(message):
     try:
         if not validate_birthdate(message.text):
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 "Введите корректную дату (формат ДД.ММ.ГГГГ):"
             )
@@ -668,22 +844,21 @@ def process_birthdate_step(message):
             birthdate=message.text
         )
 
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             "Введите место проживания:"
         )
         user_repo.set_user_state(message.from_user.id, BotStates.REGISTRATION_LOCATION)
     except Exception as e:
         logger.error(f"Error in process_birthdate_step: {e}")
-        bot.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+        outbound.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 
-@bot.message_handler(func=lambda message:
-user_repo.get_user_state(message.from_user.id) == BotStates.REGISTRATION_LOCATION)
+@router.message_handler(states=BotStates.REGISTRATION_LOCATION)
 def process_location_step(message):
     try:
         if not message.text or not message.text.strip():
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 "Введите корректное место проживания:"
             )
@@ -696,34 +871,30 @@ def process_location_step(message):
 
         user_repo.complete_registration(message.from_user.id)
 
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             "Регистрация завершена!",
-            reply_markup=types.ReplyKeyboardMarkup(
-                resize_keyboard=True
-            ).add(types.KeyboardButton("Начать игру")))
+            reply_markup=keyboards.reply("Начать игру"))
 
         user_repo.set_user_state(message.from_user.id, BotStates.MAIN_MENU)
     except Exception as e:
         logger.error(f"Error in process_location_step: {e}")
-        bot.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+        outbound.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 
-@bot.message_handler(func=lambda message: message.text == "Начать игру" and
-                                          user_repo.get_user_state(message.from_user.id) == BotStates.MAIN_MENU)
+@router.message_handler(text="Начать игру", states=BotStates.MAIN_MENU)
 def start_game(message):
     try:
-        user = user_repo.get_user(message.from_user.id)
-        current_level = user.get('current_level', 1)
+        user = user_context.get_snapshot(message)
+        current_level = user.level
 
         show_level_content(message, current_level)
     except Exception as e:
         logger.error(f"Error in start_game: {e}")
-        bot.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+        outbound.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 
-@bot.message_handler(func=lambda message: message.text == "Ответы на вопросы" and
-                                          user_repo.get_user_state(message.from_user.id) == BotStates.LEVEL_CONTENT)
+@router.message_handler(text="Ответы на вопросы", states=BotStates.LEVEL_CONTENT)
 def show_faq(message):
     """Обработчик раздела 'Ответы на вопросы' с возвратом на 1 уровень"""
     try:
@@ -751,10 +922,9 @@ def show_faq(message):
 """
 
         # Клавиатура только с кнопкой Назад
-        keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        keyboard.add(types.KeyboardButton("Назад"))
+        keyboard = keyboards.back
 
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             faq_text,
             parse_mode='HTML',
@@ -766,20 +936,19 @@ def show_faq(message):
 
     except Exception as e:
         logger.error(f"FAQ error for user {user_id}: {str(e)}")
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             "⚠️ Ошибка загрузки FAQ",
             reply_markup=create_back_keyboard()
         )
 
 
-@bot.message_handler(func=lambda message: message.text == "Далее, перейти к следующему уровню." and
-                                          user_repo.get_user_state(message.from_user.id) == BotStates.LEVEL_CONTENT)
+@router.message_handler(text="Далее, перейти к следующему уровню.", states=BotStates.LEVEL_CONTENT)
 def handle_next_level_request(message):
     try:
         user_id = message.from_user.id
-        user = user_repo.get_user(user_id)
-        current_level = user.get('current_level', 1)
+        user = user_context.get_snapshot(message)
+        current_level = user.level
 
         if current_level >= MAX_LEVEL:
             logger.info(f"User {user_id} reached max level {MAX_LEVEL}, showing final message")
@@ -793,7 +962,7 @@ def handle_next_level_request(message):
             if next_level <= MAX_LEVEL:
                 if not user_repo.update_user_level(user_id, next_level):
                     logger.error(f"Failed to update user {user_id} level to {next_level}")
-                    return bot.reply_to(message, "Ошибка обновления уровня")
+                    return outbound.reply_to(message, "Ошибка обновления уровня")
 
                 logger.info(f"Successfully updated user {user_id} to level {next_level}")
                 show_level_content(message, next_level)
@@ -805,14 +974,14 @@ def handle_next_level_request(message):
 
     except Exception as e:
         logger.error(f"[Next Level] Error in handle_next_level_request: {str(e)}", exc_info=True)
-        bot.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+        outbound.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 
 def show_task_selection(message):
     try:
         user_id = message.from_user.id
-        user = user_repo.get_user(user_id)
-        current_level = user.get('current_level', 1)
+        user = user_context.get_snapshot(message)
+        current_level = user.level
 
         # Добавляем проверку и здесь
         if current_level >= MAX_LEVEL:
@@ -824,16 +993,9 @@ def show_task_selection(message):
             " отдать время, пригласить друга или сделать донат»\n\n"
         )
 
-        keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        keyboard.add(
-            types.KeyboardButton("Время"),
-            types.KeyboardButton("Пригласи друга"),
-            types.KeyboardButton("Донат"),
-            types.KeyboardButton("Следующий уровень")
-        )
-        keyboard.add(types.KeyboardButton("Назад"))
+        keyboard = keyboards.reply(("Время", "Пригласи друга", "Донат", "Следующий уровень"), "Назад")
 
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             task_text,
             reply_markup=keyboard
@@ -844,15 +1006,14 @@ def show_task_selection(message):
 
     except Exception as e:
         logger.error(f"Error in show_task_selection: {e}")
-        bot.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+        outbound.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 
-@bot.message_handler(func=lambda message: message.text == "Время" and
-                                          user_repo.get_user_state(message.from_user.id) == BotStates.TASK_SELECTION)
+@router.message_handler(text="Время", states=BotStates.TASK_SELECTION)
 def handle_time_task(message):
     try:
-        user = user_repo.get_user(message.from_user.id)
-        current_level = user.get('current_level', 1)
+        user = user_context.get_snapshot(message)
+        current_level = user.level
 
         active_task = task_repo.get_active_time_task(message.from_user.id, current_level)
 
@@ -869,11 +1030,9 @@ def handle_time_task(message):
                     f"Завершится: {end_time.strftime('%d.%m.%Y %H:%M')}"
                 )
 
-                keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-                keyboard.add(types.KeyboardButton("Задание выполнено"))
-                keyboard.add(types.KeyboardButton("Назад"))
+                keyboard = keyboards.reply("Задание выполнено", "Назад")
 
-                bot.send_message(
+                outbound.send_message(
                     message.chat.id,
                     task_text,
                     reply_markup=keyboard
@@ -887,7 +1046,7 @@ def handle_time_task(message):
                     task_type='time'
                 )
 
-                bot.send_message(
+                outbound.send_message(
                     message.chat.id,
                     "Задание выполнено! Теперь вы можете перейти на следующий уровень.",
                     reply_markup=create_level_navigation_keyboard(current_level)
@@ -901,13 +1060,9 @@ def handle_time_task(message):
                 "Начать задание?"
             )
 
-            keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-            keyboard.add(
-                types.KeyboardButton("Начать задание"),
-                types.KeyboardButton("Назад")
-            )
+            keyboard = keyboards.reply(("Начать задание", "Назад"))
 
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 task_text,
                 reply_markup=keyboard
@@ -916,25 +1071,24 @@ def handle_time_task(message):
             user_repo.set_user_state(message.from_user.id, BotStates.TIME_TASK)
     except Exception as e:
         logger.error(f"Error in handle_time_task: {e}")
-        bot.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+        outbound.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 
-@bot.message_handler(func=lambda message: message.text == "Начать задание" and
-                                          user_repo.get_user_state(message.from_user.id) == BotStates.TIME_TASK)
+@router.message_handler(text="Начать задание", states=BotStates.TIME_TASK)
 def start_time_task(message):
     try:
-        user = user_repo.get_user(message.from_user.id)
-        current_level = user.get('current_level', 1)
+        user = user_context.get_snapshot(message)
+        current_level = user.level
 
-        task_repo.create_task(
+        end_time = datetime.now() + TASK_DURATION
+        if task_repo.create_task(
             user_id=message.from_user.id,
             level=current_level,
             task_type='time',
             start_time=datetime.now(),
-            end_time=datetime.now() + TASK_DURATION
-        )
-
-        end_time = datetime.now() + TASK_DURATION
+            end_time=end_time
+        ):
+            time_task_scheduler.add(message.from_user.id, current_level, end_time)
 
         task_text = (
             "Задание начато!\n\n"
@@ -942,33 +1096,30 @@ def start_time_task(message):
             f"Завершится: {end_time.strftime('%d.%m.%Y %H:%M')}"
         )
 
-        keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        keyboard.add(types.KeyboardButton("Задание выполнено"))
-        keyboard.add(types.KeyboardButton("Назад"))
+        keyboard = keyboards.reply("Задание выполнено", "Назад")
 
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             task_text,
             reply_markup=keyboard
         )
     except Exception as e:
         logger.error(f"Error in start_time_task: {e}")
-        bot.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+        outbound.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 
-@bot.message_handler(func=lambda message: message.text == "Задание выполнено" and
-                                          user_repo.get_user_state(message.from_user.id) == BotStates.TIME_TASK)
+@router.message_handler(text="Задание выполнено", states=BotStates.TIME_TASK)
 def complete_time_task(message):
     """Обработчик завершения задания на время с отображением контента и изображения уровня"""
     try:
         user_id = message.from_user.id
-        user = user_repo.get_user(user_id)
-        current_level = user.get('current_level', 1)
+        user = user_context.get_snapshot(message)
+        current_level = user.level
 
         active_task = task_repo.get_active_time_task(user_id, current_level)
 
         if not active_task:
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 "У вас нет активных заданий.",
                 reply_markup=create_back_keyboard()
@@ -982,7 +1133,7 @@ def complete_time_task(message):
             hours = int(time_left.total_seconds() // 3600)
             minutes = int((time_left.total_seconds() % 3600) // 60)
 
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 f"Время на выполнение задания ещё не вышло! Осталось: {hours} часов {minutes} минут.",
                 reply_markup=create_back_keyboard()
@@ -1002,8 +1153,7 @@ def complete_time_task(message):
             user_repo.update_user_level(user_id, next_level)
 
             # 3. Получаем данные нового уровня
-            level_content = level_repo.get_level_content(next_level)
-            level_rules = level_repo.get_level_rules(next_level)
+            level_content, level_rules = level_catalog.content_and_rules(next_level)
             keyboard = create_level_navigation_keyboard(
                 next_level,
                 user_id=user_id,
@@ -1012,48 +1162,16 @@ def complete_time_task(message):
 
             # 4. Отправляем контент уровня
             if level_content:
-                bot.send_message(
+                outbound.send_message(
                     message.chat.id,
                     level_content,
                     reply_markup=keyboard
                 )
 
-                if level_rules and level_rules.startswith("image:"):
-                    try:
-                        import os
-                        from pathlib import Path
-
-                        image_relative = level_rules.replace("image:", "").strip()
-
-                        # Проверяем все возможные пути к изображениям
-                        possible_paths = [
-                            Path(r"C:\projects\1bot_probuzhdenie\static\levels"),
-                            Path(r"C:\1bot_probuzhdenie\static\levels"),
-                            Path(r"C:\static\levels"),
-                            Path(r"C:\app\static\levels"),
-                            Path("/var/www/1bot_probuzhdenie/static/levels"),
-                            Path("/app/static/levels"),
-                            Path(__file__).resolve().parent.parent.parent / "1bot_probuzhdenie" / "static" / "levels",
-                            Path(__file__).resolve().parent.parent / "static" / "levels",
-                        ]
-
-                        # Ищем существующий файл изображения
-                        for path in possible_paths:
-                            for ext in ['', '.jpg', '.jpeg', '.png', '.gif']:
-                                image_path = path / f"{image_relative}{ext}"
-                                if image_path.exists():
-                                    with open(image_path, 'rb') as photo:
-                                        bot.send_photo(
-                                            message.chat.id,
-                                            photo,
-                                            reply_markup=keyboard
-                                        )
-                                    break
-                    except Exception as e:
-                        logger.error(f"[Level {next_level}] Error sending image: {str(e)}")
+                send_level_image(message.chat.id, next_level, level_rules, keyboard)
 
             # 6. Отправляем уведомление о выполнении
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 f"✅ Задание на время выполнено! Открыт {next_level} уровень",
                 reply_markup=keyboard
@@ -1066,16 +1184,15 @@ def complete_time_task(message):
 
     except Exception as e:
         logger.error(f"Error in complete_time_task: {e}")
-        bot.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+        outbound.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 
-@bot.message_handler(func=lambda message: message.text == "Пригласи друга" and
-                                          user_repo.get_user_state(message.from_user.id) == BotStates.TASK_SELECTION)
+@router.message_handler(text="Пригласи друга", states=BotStates.TASK_SELECTION)
 def handle_referral_task(message):
     try:
         user_id = message.from_user.id
-        user = user_repo.get_user(user_id)
-        current_level = user.get('current_level', 1)
+        user = user_context.get_snapshot(message)
+        current_level = user.level
 
         # 1. Сначала создаем запись задания (если еще не существует)
         if not task_repo.is_task_completed(user_id, current_level, 'referral'):
@@ -1093,44 +1210,37 @@ def handle_referral_task(message):
         # 2. Генерация реферальной ссылки
         referral_link = f"https://t.me/Sovmestimost_par_bot?start=ref{user_id}_{current_level}"  # Добавляем уровень в ссылку
 
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             f"Пригласите друга по ссылке:\n\n{referral_link}\n\n"
             "После регистрации друга задание будет выполнено автоматически.",
-            reply_markup=types.ReplyKeyboardMarkup(resize_keyboard=True).add(
-                types.KeyboardButton("Проверить статус задания"),
-                types.KeyboardButton("Назад")
-            )
+            reply_markup=keyboards.reply(("Проверить статус задания", "Назад"))
         )
         user_repo.set_user_state(user_id, BotStates.REFERRAL_TASK)
 
     except Exception as e:
         logger.error(f"Error in handle_referral_task: {str(e)}")
-        bot.reply_to(message, "Произошла ошибка. Попробуйте позже.")
+        outbound.reply_to(message, "Произошла ошибка. Попробуйте позже.")
 
 
-@bot.message_handler(func=lambda message: message.text.strip() == "Проверить статус задания")
+@router.message_handler(text="Проверить статус задания", strip=True)
 def handle_check_referral_status(message):
     """Улучшенный обработчик проверки статуса реферального задания"""
     try:
-        from telebot import types  # Импортируем types для создания клавиатуры
-
         user_id = message.from_user.id
         logger.info(f"Проверка реферального задания для user_id={user_id}")
 
         # Получаем данные пользователя
-        user = user_repo.get_user(user_id)
+        user = user_context.get_snapshot(message)
         if not user:
             logger.error(f"Пользователь {user_id} не найден")
-            bot.send_message(user_id, "❌ Ошибка: ваш профиль не найден")
+            outbound.send_message(user_id, "❌ Ошибка: ваш профиль не найден")
             return
 
-        current_level = user.get('current_level', 1)
+        current_level = user.level
         logger.debug(f"Текущий уровень пользователя: {current_level}")
 
-        # Создаем клавиатуру с кнопкой "Назад" прямо в обработчике
-        back_markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
-        back_markup.add(types.KeyboardButton("Назад"))
+        back_markup = keyboards.reply("Назад", one_time=True)
 
         # Проверяем выполненные реферальные задания
         try:
@@ -1160,7 +1270,7 @@ def handle_check_referral_status(message):
                 user_repo.set_user_state(user_id, BotStates.LEVEL_CONTENT)
 
                 # Отправляем сообщение об успехе
-                bot.send_message(
+                outbound.send_message(
                     user_id,
                     f"✅ Реферальное задание уровня {current_level} выполнено!\n\n"
                     f"🎉 Открыт уровень {next_level}!",
@@ -1171,7 +1281,7 @@ def handle_check_referral_status(message):
                 show_level_content(message, next_level)
             else:
                 # Показываем статус, если задание не выполнено
-                bot.send_message(
+                outbound.send_message(
                     user_id,
                     f"⏳ Задание не выполнено. Завершено {completed_refs}/{REQUIRED_REFERRALS} рефералов.",
                     reply_markup=back_markup  # Используем созданную здесь клавиатуру
@@ -1179,7 +1289,7 @@ def handle_check_referral_status(message):
 
         except Exception as e:
             logger.error(f"Ошибка проверки рефералов: {str(e)}")
-            bot.send_message(
+            outbound.send_message(
                 user_id,
                 "⚠️ Ошибка при проверке статуса задания. Попробуйте позже.",
                 reply_markup=back_markup
@@ -1187,7 +1297,7 @@ def handle_check_referral_status(message):
 
     except Exception as e:
         logger.critical(f"Критическая ошибка: {str(e)}", exc_info=True)
-        bot.send_message(
+        outbound.send_message(
             user_id,
             "⚠️ Произошла непредвиденная ошибка. Мы уже работаем над исправлением.",
             reply_markup=create_main_menu_keyboard()
@@ -1208,26 +1318,22 @@ def show_pending_referral_status(user_id, level, stats):
         чтобы 1 человек завершил регистрацию.
         """
 
-        keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        keyboard.add(types.KeyboardButton("Назад"))
-
-        bot.send_message(user_id, response, reply_markup=keyboard)
+        outbound.send_message(user_id, response, reply_markup=keyboards.back)
     except Exception as e:
         logger.error(f"Ошибка отображения статуса: {str(e)}")
         raise
 
 
-@bot.message_handler(func=lambda message: message.text == "Донат" and
-                                          user_repo.get_user_state(message.from_user.id) == BotStates.TASK_SELECTION)
+@router.message_handler(text="Донат", states=BotStates.TASK_SELECTION)
 def handle_donation_selection(message):
     try:
         user_id = message.from_user.id
-        user = user_repo.get_user(user_id)
-        current_level = user.get('current_level', 1)
+        user = user_context.get_snapshot(message)
+        current_level = user.level
 
         # Проверяем, что текущий уровень >= 2
         if current_level < 2:
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 "Первый уровень не требует выполнения заданий. Используйте кнопку 'Далее'.",
                 reply_markup=create_level_navigation_keyboard(current_level, user_id, task_repo)
@@ -1237,14 +1343,22 @@ def handle_donation_selection(message):
         user_repo.set_user_state(message.from_user.id, BotStates.DONATION_TASK)
 
         if current_level >= MAX_LEVEL:
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 "Поздравляем! Вы достигли максимального уровня.",
                 reply_markup=create_level_navigation_keyboard(MAX_LEVEL)
             )
             return
-        # Создаем донат для ТЕКУЩЕГО уровня
-        payment_url = create_payment(message.from_user.id, current_level)
+        # Создаем донат для ТЕКУЩЕГО уровня (или берем неоплаченный, созданный ранее)
+        try:
+            payment_url = payment_service.create_payment(message.from_user.id, current_level)
+        except PendingPaymentLimitError:
+            outbound.send_message(
+                message.chat.id,
+                PENDING_PAYMENTS_LIMIT_TEXT,
+                reply_markup=keyboards.reply("Проверить статус", "Назад")
+            )
+            return
 
         if payment_url:
             keyboard = types.InlineKeyboardMarkup()
@@ -1253,22 +1367,20 @@ def handle_donation_selection(message):
                 url=payment_url
             ))
 
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 f"Для перехода на следующий уровень ({current_level + 1}) сделайте донат:",
                 reply_markup=keyboard
             )
 
-            check_keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-            check_keyboard.add(types.KeyboardButton("Проверить статус"))
-            check_keyboard.add(types.KeyboardButton("Назад"))
-            bot.send_message(
+            check_keyboard = keyboards.reply("Проверить статус", "Назад")
+            outbound.send_message(
                 message.chat.id,
                 "После оплаты нажмите 'Проверить статус'",
                 reply_markup=check_keyboard
             )
         else:
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 "Ошибка при создании платежа. Попробуйте позже.",
                 reply_markup=create_back_keyboard()
@@ -1276,16 +1388,27 @@ def handle_donation_selection(message):
 
     except Exception as e:
         logger.error(f"Error in handle_donation_selection: {e}")
-        bot.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+        outbound.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 
-@bot.message_handler(func=lambda message: message.text == "Проверить статус" and
-                                          user_repo.get_user_state(message.from_user.id) == BotStates.DONATION_TASK)
+def notify_donation_already_processed(message, user_id, current_level):
+    outbound.send_message(
+        message.chat.id,
+        "ℹ️ Этот платеж уже был обработан ранее.",
+        reply_markup=create_level_navigation_keyboard(
+            current_level + 1,
+            user_id=user_id,
+            task_repo=task_repo
+        )
+    )
+
+
+@router.message_handler(text="Проверить статус", states=BotStates.DONATION_TASK)
 def check_donation_status(message):
     try:
         user_id = message.from_user.id
-        user = user_repo.get_user(user_id)
-        current_level = user.get('current_level', 1)
+        user = user_context.get_snapshot(message)
+        current_level = user.level
         logger.info(f"[Donation] Checking status for user {user_id}, level {current_level}")
 
         donation = donation_repo.get_last_donation(user_id, current_level)
@@ -1293,7 +1416,7 @@ def check_donation_status(message):
 
         if not donation:
             logger.warning(f"[Donation] No donation found for user {user_id}")
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 "❌ Донат не найден. Пожалуйста, создайте новый платеж.",
                 reply_markup=create_back_keyboard()
@@ -1303,13 +1426,19 @@ def check_donation_status(message):
         payment_id = donation.get('payment_id')
         if not payment_id:
             logger.error(f"[Donation] No payment_id in donation record for user {user_id}")
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 "❌ Ошибка: идентификатор платежа отсутствует. Создайте платеж заново.",
                 reply_markup=create_back_keyboard()
             )
             return
 
+        # Уже обработанный платеж не требует запроса к ЮKassa
+        if donation.get('processed', False):
+            logger.info(f"[Donation] Donation already processed for user {user_id}")
+            notify_donation_already_processed(message, user_id, current_level)
+            return
+
         try:
             logger.info(f"[Donation] Fetching payment info for payment_id: {payment_id}")
             payment_info = Payment.find_one(payment_id)
@@ -1317,7 +1446,7 @@ def check_donation_status(message):
 
             # Добавленная проверка статуса платежа
             if payment_info.status != 'succeeded':
-                bot.send_message(
+                outbound.send_message(
                     message.chat.id,
                     f"⚠️ Платеж еще не подтвержден. Текущий статус: {payment_info.status}",
                     reply_markup=create_back_keyboard()
@@ -1326,25 +1455,17 @@ def check_donation_status(message):
 
         except Exception as e:
             logger.error(f"[Donation] Error getting payment info: {e}")
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 "⚠️ Не удалось проверить статус платежа. Попробуйте позже.",
                 reply_markup=create_back_keyboard()
             )
             return
 
-        # Проверка на уже обработанный платеж
-        if donation.get('processed', False):
+        # Платеж уже зачислен другим путем (webhook или фоновая сверка)
+        if not donation_repo.claim_donation(donation['id']):
             logger.info(f"[Donation] Donation already processed for user {user_id}")
-            bot.send_message(
-                message.chat.id,
-                "ℹ️ Этот платеж уже был обработан ранее.",
-                reply_markup=create_level_navigation_keyboard(
-                    current_level + 1,
-                    user_id=user_id,
-                    task_repo=task_repo
-                )
-            )
+            notify_donation_already_processed(message, user_id, current_level)
             return
 
         # Обновление статуса доната
@@ -1369,7 +1490,7 @@ def check_donation_status(message):
             )
             if not task_created:
                 logger.error(f"[Donation] Failed to create task for user {user_id}")
-                bot.send_message(
+                outbound.send_message(
                     message.chat.id,
                     "❌ Ошибка при создании задания. Обратитесь в поддержку.",
                     reply_markup=create_back_keyboard()
@@ -1381,7 +1502,7 @@ def check_donation_status(message):
         if next_level <= MAX_LEVEL:
             if not user_repo.update_user_level(user_id, next_level):
                 logger.error(f"[Donation] Failed to update user level to {next_level}")
-                bot.send_message(
+                outbound.send_message(
                     message.chat.id,
                     "⚠️ Ошибка обновления уровня. Обратитесь в поддержку.",
                     reply_markup=create_back_keyboard()
@@ -1391,7 +1512,7 @@ def check_donation_status(message):
             logger.info(f"[Donation] User level updated to {next_level}")
             show_level_content(message, next_level)
 
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 f"✅ Платеж успешно завершен! Теперь доступен {next_level} уровень.",
                 reply_markup=create_level_navigation_keyboard(next_level, user_id, task_repo)
@@ -1403,23 +1524,21 @@ def check_donation_status(message):
 
     except Exception as e:
         logger.error(f"[Donation] Error in check_donation_status: {str(e)}", exc_info=True)
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             "⚠️ Произошла внутренняя ошибка. Пожалуйста, попробуйте позже или обратитесь в поддержку.",
             reply_markup=create_back_keyboard()
         )
 
 
-@bot.message_handler(func=lambda message: message.text == "Следующий уровень" and
-                                          user_repo.get_user_state(message.from_user.id)
-                                          in [BotStates.LEVEL_CONTENT, BotStates.TASK_SELECTION])
+@router.message_handler(text="Следующий уровень", states=[BotStates.LEVEL_CONTENT, BotStates.TASK_SELECTION])
 def handle_next_level_button(message):
     try:
         user_id = message.from_user.id
         logger.info(f"[Next Level] Button pressed by user {user_id}")
 
-        user = user_repo.get_user(user_id)
-        current_level = user.get('current_level', 1)
+        user = user_context.get_snapshot(message)
+        current_level = user.level
         logger.info(f"[Next Level] Current level: {current_level}")
 
         is_completed = task_repo.is_task_completed(user_id, current_level)
@@ -1436,7 +1555,7 @@ def handle_next_level_button(message):
                 if update_success:
                     show_level_content(message, next_level)
                 else:
-                    bot.reply_to(message, "Ошибка обновления уровня.")
+                    outbound.reply_to(message, "Ошибка обновления уровня.")
             else:
                 show_final_level_message(message)
         else:
@@ -1445,7 +1564,7 @@ def handle_next_level_button(message):
 
     except Exception as e:
         logger.error(f"[Next Level] Error: {str(e)}", exc_info=True)
-        bot.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+        outbound.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 
 def show_task_status_details(message, current_level):
@@ -1453,30 +1572,26 @@ def show_task_status_details(message, current_level):
         user_id = message.from_user.id
         status_messages = []
 
-        active_time_task = task_repo.get_active_time_task(user_id, current_level)
-        completed_time_task = task_repo.is_task_completed(user_id, current_level, 'time')
+        progress = task_repo.get_level_progress(user_id, current_level)
+        if progress is None:
+            outbound.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+            return
 
-        if active_time_task:
-            end_time = active_time_task['start_time'] + TASK_DURATION
+        if progress.time_task_started_at:
+            end_time = progress.time_task_started_at + TASK_DURATION
             time_left = end_time - datetime.now()
             if time_left.total_seconds() > 0:
                 hours = int(time_left.total_seconds() // 3600)
                 minutes = int((time_left.total_seconds() % 3600) // 60)
                 status_messages.append(f"⏳ Задание на время: осталось {hours}ч {minutes}мин")
-        elif not completed_time_task:
+        elif not progress.time_completed:
             status_messages.append("⏱ Задание 'Время' не выполнено")
 
-        referral_status = referral_repo.get_referral_status(user_id, current_level)
-        completed_referral_task = task_repo.is_task_completed(user_id, current_level, 'referral')
-
-        if not completed_referral_task:
-            status_messages.append(f"👥 Зарегистрировано друзей: {referral_status['completed_referrals']}/{1}")
-
-        last_donation = donation_repo.get_last_donation(user_id, current_level)
-        completed_donation_task = task_repo.is_task_completed(user_id, current_level, 'donation')
+        if not progress.referral_completed:
+            status_messages.append(f"👥 Зарегистрировано друзей: {progress.referrals_completed}/{1}")
 
-        if not completed_donation_task:
-            if last_donation and last_donation['status'] == 'pending':
+        if not progress.donation_completed:
+            if progress.last_donation_status == 'pending':
                 status_messages.append("💳 Донат: ожидает оплаты")
             else:
                 status_messages.append("💳 Донат: не выполнен")
@@ -1487,15 +1602,9 @@ def show_task_status_details(message, current_level):
                 "\n\nВыберите задание из меню ниже:"
         )
 
-        keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        keyboard.add(
-            types.KeyboardButton("Время"),
-            types.KeyboardButton("Пригласи друга"),
-            types.KeyboardButton("Донат")
-        )
-        keyboard.add(types.KeyboardButton("Назад"))
+        keyboard = keyboards.reply(("Время", "Пригласи друга", "Донат"), "Назад")
 
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             response,
             reply_markup=keyboard
@@ -1504,15 +1613,15 @@ def show_task_status_details(message, current_level):
 
     except Exception as e:
         logger.error(f"Error in show_task_status_details: {str(e)}")
-        bot.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+        outbound.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 
-@bot.message_handler(func=lambda message: message.text.strip() in ["⬅️ Назад", "Назад", "Back", "⬅️ К уровням"])
+@router.message_handler(texts=["⬅️ Назад", "Назад", "Back", "⬅️ К уровням"], strip=True)
 def handle_back(message):
     """Улучшенный обработчик кнопки 'Назад' с учетом всех состояний"""
     try:
         user_id = message.from_user.id
-        current_state = user_repo.get_user_state(user_id)
+        current_state = user_context.get_state(message)
         logger.info(f"[Back] User {user_id} pressed back. Current state: {current_state}")
 
         # Обработка специальных состояний в приоритетном порядке
@@ -1525,9 +1634,9 @@ def handle_back(message):
             return
 
         # Получаем информацию о пользователе
-        user = user_repo.get_user(user_id)
-        current_level = user.get('current_level', 1)
-        viewed_level = user_data_repo.get_viewed_level(user_id) or current_level
+        user = user_context.get_snapshot(message)
+        current_level = user.level
+        viewed_level = user.viewed_level or current_level
 
         # Обработка состояний, связанных с уровнями
         if current_state in [BotStates.LEVEL_CONTENT, BotStates.TASK_SELECTION,
@@ -1542,7 +1651,7 @@ def handle_back(message):
 
     except Exception as e:
         logger.error(f"[Back] Error: {str(e)}", exc_info=True)
-        bot.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+        outbound.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 
 def show_main_menu(message):
@@ -1550,14 +1659,11 @@ def show_main_menu(message):
         user_id = message.from_user.id
         logger.info(f"Showing main menu for user {user_id}")
 
-        # Создаем клавиатуру с проверкой
-        keyboard = create_main_menu_keyboard()
-        if not keyboard or not isinstance(keyboard, types.ReplyKeyboardMarkup):
-            logger.warning("Keyboard creation failed, using fallback")
-            keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-            keyboard.add(types.KeyboardButton("Правила игры"))
-            keyboard.add(types.KeyboardButton("О боте"))
-
+        outbound.send_message(
+            message.chat.id,
+            "Добро пожаловать! Используйте кнопки меню.",
+            reply_markup=create_main_menu_keyboard()
+        )
 
         # Обновляем состояние
         if not user_repo.set_user_state(user_id, BotStates.MAIN_MENU):
@@ -1567,31 +1673,27 @@ def show_main_menu(message):
         logger.error(f"Error in show_main_menu for user {user_id}: {str(e)}", exc_info=True)
         try:
             # Минимальный fallback
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 "Добро пожаловать! Используйте кнопки меню.",
-                reply_markup=types.ReplyKeyboardMarkup(
-                    resize_keyboard=True
-                ).add(types.KeyboardButton("Правила игры"))
+                reply_markup=keyboards.reply("Правила игры")
             )
             user_repo.set_user_state(user_id, BotStates.MAIN_MENU)
         except:
             logger.critical("Complete failure in show_main_menu fallback")
 
 
-@bot.message_handler(func=lambda message: "уровень" in message.text and
-                                          user_repo.get_user_state(message.from_user.id) == BotStates.LEVEL_CONTENT)
+@router.message_handler(contains="уровень", states=BotStates.LEVEL_CONTENT)
 def handle_level_navigation(message):
     try:
         level_number = int(message.text.split()[0])
         show_level_content(message, level_number)
     except Exception as e:
         logger.error(f"Error in handle_level_navigation: {e}")
-        bot.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+        outbound.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 
-@bot.message_handler(func=lambda message: message.text == "Сообщество 'Создатели'" and
-                                          user_repo.get_user_state(message.from_user.id) == BotStates.MAIN_MENU)
+@router.message_handler(text="Сообщество 'Создатели'", states=BotStates.MAIN_MENU)
 def handle_community_link(message):
     try:
         community_text = (
@@ -1604,47 +1706,43 @@ def handle_community_link(message):
             "Присоединяйтесь по ссылке ниже:"
         )
 
-        keyboard = types.InlineKeyboardMarkup()
-        keyboard.add(types.InlineKeyboardButton(
-            text="Присоединиться к сообществу",
-            url="https://t.me/your_community_link"  # Замените на реальную ссылку
-        ))
+        # Замените ссылку на реальную
+        keyboard = keyboards.inline_url("Присоединиться к сообществу", "https://t.me/your_community_link")
 
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             community_text,
             reply_markup=keyboard
         )
     except Exception as e:
         logger.error(f"Error in handle_community_link: {e}")
-        bot.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
+        outbound.reply_to(message, "Произошла ошибка. Пожалуйста, попробуйте позже.")
 
 
 # Состояние для ввода суммы
 CHARITY_AMOUNT_INPUT = 100
 
 
-@bot.message_handler(func=lambda message: message.text == "Благотворительность")
+@router.message_handler(text="Благотворительность")
 def handle_charity(message):
     try:
         user_id = message.from_user.id
         user_repo.set_user_state(user_id, BotStates.CHARITY_AMOUNT_INPUT)  # Устанавливаем состояние 12
 
         # Клавиатура с кнопкой возврата
-        keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        keyboard.add(types.KeyboardButton("21 уровень"))
+        keyboard = keyboards.reply("21 уровень")
 
-        msg = bot.send_message(
+        outbound.send_message(
             message.chat.id,
             "Введите сумму благотворительного пожертвования (в рублях):",
             reply_markup=keyboard
         )
 
-        bot.register_next_step_handler(msg, process_charity_amount_or_back)
+        bot.register_next_step_handler_by_chat_id(message.chat.id, process_charity_amount_or_back)
 
     except Exception as e:
         logger.error(f"Ошибка в handle_charity: {str(e)}")
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             "Произошла ошибка. Пожалуйста, попробуйте позже.",
             reply_markup=create_level_navigation_keyboard(21, message.from_user.id, task_repo)
@@ -1661,18 +1759,26 @@ def process_charity_amount(message):
             if amount <= 0:
                 raise ValueError("Сумма должна быть положительной")
         except ValueError:
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 "⚠️ Пожалуйста, введите корректную сумму в рублях (например: 100 или 100.50)",
-                reply_markup=types.ReplyKeyboardMarkup(resize_keyboard=True).add("21 уровень")
+                reply_markup=keyboards.reply("21 уровень")
             )
             return
 
-        # Создаем платеж в ЮKassa
-        payment_url = create_charity_payment(user_id, amount)
+        # Создаем платеж в ЮKassa (или берем неоплаченный на ту же сумму)
+        try:
+            payment_url = payment_service.create_charity_payment(user_id, amount)
+        except PendingPaymentLimitError:
+            outbound.send_message(
+                message.chat.id,
+                PENDING_PAYMENTS_LIMIT_TEXT,
+                reply_markup=keyboards.reply("Проверить статус пожертвования", "21 уровень")
+            )
+            return
 
         if not payment_url:
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 "❌ Не удалось создать платеж. Пожалуйста, попробуйте позже.",
                 reply_markup=create_level_navigation_keyboard(21, user_id, task_repo)
@@ -1680,7 +1786,7 @@ def process_charity_amount(message):
             return
 
         # Отправляем сообщение с кнопкой оплаты
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             f"💳 Сумма пожертвования: {amount:.2f} руб.\n\n"
             "Для оплаты нажмите кнопку ниже:",
@@ -1690,11 +1796,9 @@ def process_charity_amount(message):
         )
 
         # Клавиатура с кнопками управления
-        markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        markup.row(types.KeyboardButton("Проверить статус пожертвования"))
-        markup.row(types.KeyboardButton("21 уровень"))
+        markup = keyboards.reply("Проверить статус пожертвования", "21 уровень")
 
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             "После оплаты вы можете проверить статус пожертвования",
             reply_markup=markup
@@ -1705,7 +1809,7 @@ def process_charity_amount(message):
 
     except Exception as e:
         logger.error(f"Ошибка в process_charity_amount: {str(e)}", exc_info=True)
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             "⚠️ Произошла ошибка при обработке платежа. Пожалуйста, попробуйте позже.",
             reply_markup=create_level_navigation_keyboard(21, message.from_user.id, task_repo)
@@ -1719,7 +1823,7 @@ def process_charity_amount_or_back(message):
     process_charity_amount(message)
 
 
-@bot.message_handler(func=lambda message: message.text == "Проверить статус пожертвования")
+@router.message_handler(text="Проверить статус пожертвования")
 def check_charity_status(message):
     try:
         user_id = message.from_user.id
@@ -1730,7 +1834,7 @@ def check_charity_status(message):
 
         donation = donation_repo.get_last_donation(user_id, level=0)
         if not donation:
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 "❌ Пожертвование не найдено",
                 reply_markup=create_level_navigation_keyboard(21, user_id, task_repo)
@@ -1739,7 +1843,7 @@ def check_charity_status(message):
 
         payment_id = donation.get('payment_id')
         if not payment_id:
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 "⚠️ Ошибка: отсутствует идентификатор платежа",
                 reply_markup=create_level_navigation_keyboard(21, user_id, task_repo)
@@ -1757,25 +1861,23 @@ def check_charity_status(message):
                     processed=True
                 )
 
-                bot.send_message(
+                outbound.send_message(
                     message.chat.id,
                     "✅ Пожертвование успешно получено! Спасибо за вашу поддержку!",
                     reply_markup=create_level_navigation_keyboard(21, user_id, task_repo)
                 )
 
             elif payment.status == 'pending':
-                markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-                markup.row(types.KeyboardButton("Проверить статус пожертвования"))
-                markup.row(types.KeyboardButton("21 уровень"))
+                markup = keyboards.reply("Проверить статус пожертвования", "21 уровень")
 
-                bot.send_message(
+                outbound.send_message(
                     message.chat.id,
                     "⏳ Платеж ожидает оплаты",
                     reply_markup=markup
                 )
 
             else:
-                bot.send_message(
+                outbound.send_message(
                     message.chat.id,
                     f"ℹ️ Статус платежа: {payment.status}",
                     reply_markup=create_level_navigation_keyboard(21, user_id, task_repo)
@@ -1783,7 +1885,7 @@ def check_charity_status(message):
 
         except Exception as e:
             logger.error(f"Ошибка проверки платежа: {str(e)}")
-            bot.send_message(
+            outbound.send_message(
                 message.chat.id,
                 "⚠️ Ошибка при проверке статуса платежа",
                 reply_markup=create_level_navigation_keyboard(21, user_id, task_repo)
@@ -1791,16 +1893,16 @@ def check_charity_status(message):
 
     except Exception as e:
         logger.error(f"Ошибка в check_charity_status: {str(e)}")
-        bot.send_message(
+        outbound.send_message(
             message.chat.id,
             "⚠️ Произошла ошибка. Пожалуйста, попробуйте позже.",
             reply_markup=create_level_navigation_keyboard(21, message.from_user.id, task_repo)
         )
 
 
-@bot.message_handler(func=lambda message: True)
+@router.message_handler(func=lambda message: True)
 def debug_all_messages(message):
-    user_state = user_repo.get_user_state(message.from_user.id)
+    user_state = user_context.get_state(message)
     logger.info(f"DEBUG: Получено сообщение '{message.text}' | Текущее состояние: {user_state}")
 
     if message.text == "Правила игры":
@@ -1808,150 +1910,168 @@ def debug_all_messages(message):
         handle_rules(message)
 
 
-def payment_poller():
-    """Фоновая задача: проверяет платежи каждые 60 секунд."""
-    while True:
-        try:
-            pending_payments = donation_repo.get_pending_payments()
-            processed_users = set()
-
-            for payment in pending_payments:
-                if payment['user_id'] in processed_users:
-                    continue
-
-                if donation_repo.is_donation_processed(payment['id']):
-                    continue
-
-                try:
-                    payment_info = Payment.find_one(payment['payment_id'])
-
-                    if payment_info.status == 'succeeded':
-                        donation_repo.update_donation_status(
-                            donation_id=payment['id'],
-                            status='succeeded',
-                            payment_id=payment['payment_id'],
-                            processed=True
-                        )
-
-                        if payment['level'] == 0:  # Благотворительность
-                            try:
-                                bot.send_message(
-                                    payment['user_id'],
-                                    "✅ Пожертвование успешно получено! Спасибо за вашу поддержку!",
-                                    reply_markup=create_main_menu_keyboard()
-                                )
-                                user_repo.set_user_state(payment['user_id'], BotStates.MAIN_MENU)
-                            except Exception as e:
-                                logger.error(f"Can't notify user {payment['user_id']}: {e}")
-                            processed_users.add(payment['user_id'])
-                            continue
-
-                        # Для обычных платежей
-                        task_repo.create_task(
-                            user_id=payment['user_id'],
-                            level=payment['level'],
-                            task_type='donation',
-                            start_time=datetime.now(),
-                            end_time=datetime.now(),
-                            completed=True
-                        )
-
-                        next_level = payment['level'] + 1
-                        user_repo.update_user_level(payment['user_id'], next_level)
-                        user_repo.set_user_state(payment['user_id'], BotStates.LEVEL_CONTENT)
-
-                        # Получаем контент и правила уровня
-                        level_content = level_repo.get_level_content(next_level)
-                        level_rules = level_repo.get_level_rules(next_level)
-                        keyboard = create_level_navigation_keyboard(
-                            next_level,
-                            user_id=payment['user_id'],
-                            task_repo=task_repo
-                        )
-
-                        if level_content:
-                            # Отправка контента уровня
-                            bot.send_message(
-                                payment['user_id'],
-                                level_content,
-                                reply_markup=keyboard
-                            )
-
-                            # Отправка изображения уровня, если указано
-                            if level_rules and level_rules.startswith("image:"):
-                                try:
-                                    import os
-                                    from pathlib import Path
-
-                                    # Получаем относительный путь из БД
-                                    image_relative = level_rules.replace("image:", "").strip()
-
-                                    # Все возможные пути к папке с изображениями
-                                    possible_paths = [
-                                        Path(r"C:\projects\1bot_probuzhdenie\static\levels"),
-                                        Path(r"C:\1bot_probuzhdenie\static\levels"),
-                                        Path(r"C:\static\levels"),
-                                        Path(r"C:\app\static\levels"),
-                                        Path("/var/www/1bot_probuzhdenie/static/levels"),
-                                        Path("/app/static/levels"),
-                                        Path(
-                                            __file__).resolve().parent.parent.parent / "1bot_probuzhdenie" / "static" / "levels",
-                                        Path(__file__).resolve().parent.parent / "static" / "levels",
-                                    ]
-
-                                    # Ищем существующую папку
-                                    static_levels_dir = None
-                                    for path in possible_paths:
-                                        try:
-                                            if path.exists():
-                                                static_levels_dir = path
-                                                break
-                                        except Exception:
-                                            continue
-
-                                    if static_levels_dir:
-                                        image_path = None
-                                        extensions = ['', '.jpg', '.jpeg', '.png', '.gif']
-
-                                        for ext in extensions:
-                                            test_path = static_levels_dir / f"{image_relative}{ext}"
-                                            if test_path.exists():
-                                                image_path = test_path
-                                                break
-
-                                        if image_path:
-                                            with open(image_path, 'rb') as photo:
-                                                bot.send_photo(
-                                                    payment['user_id'],
-                                                    photo,
-                                                    reply_markup=keyboard
-                                                )
-                                                logger.info(f"[Payment Poller] Sent image for level {next_level}")
-                                except Exception as e:
-                                    logger.error(f"[Payment Poller] Error sending image: {str(e)}")
-
-                        bot.send_message(
-                            payment['user_id'],
-                            f"✅ Платеж подтвержден! Теперь доступен {next_level} уровень.",
-                            reply_markup=keyboard
-                        )
-
-                        processed_users.add(payment['user_id'])
-
-                    elif payment_info.status == 'canceled':
-                        donation_repo.update_donation_status(
-                            donation_id=payment['id'],
-                            status='canceled',
-                            payment_id=payment['payment_id']
-                        )
-
-                except Exception as e:
-                    logger.error(f"Error processing payment {payment['payment_id']}: {e}")
+# Все текстовые обработчики выше зарегистрированы в router; в telebot остается
+# один обработчик после команд /admin и /start, поэтому их приоритет сохраняется.
+bot.message_handler(func=lambda message: True)(router.dispatch)
+
+
+def process_succeeded_payment(payment):
+    """Зачисляет успешный платеж: повышает уровень и отправляет контент нового уровня.
+    Вызывается из webhook и из фоновой сверки; повторный вызов для того же доната ничего не делает."""
+    if not donation_repo.claim_donation(payment['id']):
+        logger.info(f"[Payment] Donation {payment['id']} already processed")
+        return
+
+    donation_repo.update_donation_status(
+        donation_id=payment['id'],
+        status='succeeded',
+        payment_id=payment['payment_id'],
+        processed=True
+    )
 
+    if payment['level'] == 0:  # Благотворительность
+        try:
+            outbound.send_message(
+                payment['user_id'],
+                "✅ Пожертвование успешно получено! Спасибо за вашу поддержку!",
+                reply_markup=create_main_menu_keyboard()
+            )
+            user_repo.set_user_state(payment['user_id'], BotStates.MAIN_MENU)
         except Exception as e:
-            logger.error(f"Payment poller error: {e}")
+            logger.error(f"Can't notify user {payment['user_id']}: {e}")
+        return
 
-        time.sleep(60)
+    # Для обычных платежей
+    task_repo.create_task(
+        user_id=payment['user_id'],
+        level=payment['level'],
+        task_type='donation',
+        start_time=datetime.now(),
+        end_time=datetime.now(),
+        completed=True
+    )
+
+    next_level = payment['level'] + 1
+    user_repo.update_user_level(payment['user_id'], next_level)
+    user_repo.set_user_state(payment['user_id'], BotStates.LEVEL_CONTENT)
+
+    # Получаем контент и правила уровня
+    level_content, level_rules = level_catalog.content_and_rules(next_level)
+    keyboard = create_level_navigation_keyboard(
+        next_level,
+        user_id=payment['user_id'],
+        task_repo=task_repo
+    )
+
+    if level_content:
+        # Отправка контента уровня
+        outbound.send_message(
+            payment['user_id'],
+            level_content,
+            reply_markup=keyboard
+        )
+
+        # Отправка изображения уровня, если указано
+        send_level_image(payment['user_id'], next_level, level_rules, keyboard)
+
+    outbound.send_message(
+        payment['user_id'],
+        f"✅ Платеж подтвержден! Теперь доступен {next_level} уровень.",
+        reply_markup=keyboard
+    )
+
+
+def process_canceled_payment(payment):
+    donation_repo.update_donation_status(
+        donation_id=payment['id'],
+        status='canceled',
+        payment_id=payment['payment_id']
+    )
+
+
+payment_poller = PaymentPoller(
+    donation_repo,
+    fetch_status=check_payment_status,
+    on_succeeded=process_succeeded_payment,
+    on_canceled=process_canceled_payment,
+    workers=PAYMENT_POLL_WORKERS,
+    tick_interval=PAYMENT_POLL_INTERVAL,
+    payment_ttl=timedelta(hours=PAYMENT_POLL_TTL_HOURS),
+    # При включенном webhook сверка подхватывает только платежи без уведомления
+    min_age=timedelta(seconds=PAYMENT_RECONCILE_DELAY if PAYMENT_WEBHOOK_ENABLED else 0)
+)
+stop_event = threading.Event()
+stats_refresher = StatsRefresher(admin_repo, interval=ADMIN_STATS_REFRESH_INTERVAL)
+
+
+def notify_time_task_expired(user_id, level):
+    """Сообщает, что время задания вышло и его можно завершить кнопкой "Задание выполнено" """
+    user = user_repo.get_snapshot(user_id)
+    if not user or user.level != level:
+        # Пользователь уже перешел на другой уровень другим заданием
+        return
+
+    keyboard = keyboards.reply("Задание выполнено", "Назад")
+
+    outbound.send_message(
+        user_id,
+        f"⏰ Время задания на {level} уровне вышло!\n\n"
+        "Нажмите «Задание выполнено», чтобы открыть следующий уровень.",
+        reply_markup=keyboard
+    )
+    user_repo.set_user_state(user_id, BotStates.TIME_TASK)
+    logger.info(f"[Time Tasks] User {user_id} notified, level {level}")
+
+
+time_task_scheduler = TimeTaskScheduler(
+    task_repo,
+    notify=notify_time_task_expired,
+    lookahead=TIME_TASK_LOOKAHEAD,
+    reload_interval=TIME_TASK_RELOAD_INTERVAL
+)
+
+http_server = HttpServer(HTTP_HOST, HTTP_PORT, trust_proxy=HTTP_TRUST_PROXY)
+if PAYMENT_WEBHOOK_ENABLED:
+    payment_webhook = YooKassaNotificationHandler(
+        donation_repo,
+        fetch_status=check_payment_status,
+        on_succeeded=process_succeeded_payment,
+        on_canceled=process_canceled_payment,
+        trusted_networks=YOOKASSA_TRUSTED_NETWORKS or YOOKASSA_NETWORKS,
+        verify_with_api=PAYMENT_WEBHOOK_VERIFY_API
+    )
+    http_server.register_blueprint(create_payment_webhook_blueprint(payment_webhook, PAYMENT_WEBHOOK_PATH))
+
+update_intake = UpdateIntake(
+    lambda update: bot.process_new_updates([update]),
+    lanes=UPDATE_LANES,
+    max_queue=UPDATE_QUEUE_SIZE,
+    enqueue_timeout=UPDATE_ENQUEUE_TIMEOUT
+)
+if BOT_UPDATE_MODE == 'webhook':
+    http_server.register_blueprint(
+        create_telegram_webhook_blueprint(update_intake, TELEGRAM_WEBHOOK_PATH, TELEGRAM_WEBHOOK_SECRET or None)
+    )
+
+
+def run_webhook():
+    """Принимает обновления через HTTP-сервер, пока процесс не остановят"""
+    if TELEGRAM_WEBHOOK_URL:
+        bot.set_webhook(
+            url=TELEGRAM_WEBHOOK_URL.rstrip('/') + TELEGRAM_WEBHOOK_PATH,
+            secret_token=TELEGRAM_WEBHOOK_SECRET or None,
+            max_connections=min(UPDATE_LANES, 100)
+        )
+        logger.info(f"Telegram webhook set to {TELEGRAM_WEBHOOK_URL}{TELEGRAM_WEBHOOK_PATH}")
+    else:
+        # Без публичного адреса обновления присылает только локальный service.fake_telegram
+        logger.warning("TELEGRAM_WEBHOOK_URL is empty, webhook is not registered in Telegram")
+
+    try:
+        while not stop_event.wait(60):
+            logger.info(f"Update intake stats: {update_intake.get_stats()}")
+    except KeyboardInterrupt:
+        logger.info("Bot stopped by user")
 
 
 def run_bot():
@@ -1962,26 +2082,87 @@ def run_bot():
         exit(1)
     logger.info("Database connection successful")
 
+    level_catalog.start_listener()
+    user_data_repo.start_flusher()
+    if state_store:
+        state_store.start()
+
     payment_thread = threading.Thread(
-        target=payment_poller,
+        target=payment_poller.run_forever,
+        args=(stop_event,),
         name="PaymentPoller",
         daemon=True
     )
     payment_thread.start()
     logger.info("Background payment poller started")
 
-    while True:
-        try:
-            logger.info("Starting bot polling...")
-            bot.polling(none_stop=True, timeout=60, long_polling_timeout=60)
-        except KeyboardInterrupt:
-            logger.info("Bot stopped by user")
-            break
-        except Exception as e:
-            logger.error(f"Bot crashed: {str(e)}", exc_info=True)
-            time.sleep(5)
-            continue
-        finally:
-            logger.info("Cleaning up resources...")
-            storage.close()
-            logger.info("Storage connection closed")
+    threading.Thread(
+        target=stats_refresher.run_forever,
+        args=(stop_event,),
+        name="AdminStatsRefresher",
+        daemon=True
+    ).start()
+
+    threading.Thread(
+        target=time_task_scheduler.run_forever,
+        args=(stop_event,),
+        name="TimeTaskScheduler",
+        daemon=True
+    ).start()
+
+    # Незавершенные рассылки продолжаются с последней сохраненной страницы
+    threading.Thread(
+        target=broadcaster.run_forever,
+        args=(stop_event,),
+        name="Broadcaster",
+        daemon=True
+    ).start()
+
+    threading.Thread(
+        target=export_runner.run_forever,
+        args=(stop_event,),
+        name="ExportRunner",
+        daemon=True
+    ).start()
+
+    if PAYMENT_WEBHOOK_ENABLED or BOT_UPDATE_MODE == 'webhook':
+        http_server.start()
+    if PAYMENT_WEBHOOK_ENABLED:
+        logger.info(f"YooKassa webhook enabled at {PAYMENT_WEBHOOK_PATH}")
+
+    outbound.start()
+    update_intake.start()
+
+    try:
+        if BOT_UPDATE_MODE == 'webhook':
+            logger.info("Receiving updates via webhook...")
+            run_webhook()
+            return
+
+        # Оставшийся после webhook-режима адрес не дает получать обновления через getUpdates
+        bot.remove_webhook()
+        while True:
+            try:
+                logger.info("Starting bot polling...")
+                update_intake.run_polling(bot, stop_event, long_polling_timeout=60)
+            except KeyboardInterrupt:
+                logger.info("Bot stopped by user")
+                break
+            except Exception as e:
+                logger.error(f"Bot crashed: {str(e)}", exc_info=True)
+                logger.info(f"DB pool stats: {storage.get_stats()}")
+                time.sleep(5)
+                continue
+    finally:
+        logger.info("Cleaning up resources...")
+        stop_event.set()
+        http_server.stop()
+        update_intake.stop()
+        outbound.stop()
+        user_data_repo.stop_flusher()
+        if state_store:
+            state_store.stop()
+        level_catalog.stop_listener()
+        logger.info(f"DB pool stats: {storage.get_stats()}")
+        storage.close()
+        logger.info("Storage connection closed")
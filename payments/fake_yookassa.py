@@ -0,0 +1,51 @@
+"""
+Локальная замена ЮKassa для проверки webhook без реальных платежей.
+
+Пример:
+    python -m payments.fake_yookassa http://127.0.0.1:8080/yookassa/notifications <payment_id> succeeded
+
+Бот должен быть запущен с PAYMENT_WEBHOOK_VERIFY_API=false и адресом 127.0.0.1
+в YOOKASSA_TRUSTED_NETWORKS, иначе уведомление будет отклонено.
+"""
+import sys
+import uuid
+from typing import Any, Dict, Optional
+
+import requests
+
+
+def build_notification(payment_id: str, status: str = "succeeded", amount: float = 500.00,
+                       metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Тело уведомления в формате ЮKassa (payment.succeeded / payment.canceled)"""
+    return {
+        "type": "notification",
+        "event": f"payment.{status}",
+        "object": {
+            "id": payment_id,
+            "status": status,
+            "paid": status == "succeeded",
+            "amount": {"value": f"{amount:.2f}", "currency": "RUB"},
+            "metadata": metadata or {},
+        },
+    }
+
+
+def post_notification(url: str, payment_id: str, status: str = "succeeded",
+                      amount: float = 500.00, metadata: Optional[Dict[str, Any]] = None,
+                      timeout: float = 5.0) -> requests.Response:
+    """Отправляет поддельное уведомление на webhook бота"""
+    return requests.post(url, json=build_notification(payment_id, status, amount, metadata), timeout=timeout)
+
+
+def fake_payment_id() -> str:
+    return f"fake-{uuid.uuid4()}"
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+    target_url, target_payment = sys.argv[1], sys.argv[2]
+    target_status = sys.argv[3] if len(sys.argv) > 3 else "succeeded"
+    response = post_notification(target_url, target_payment, target_status)
+    print(response.status_code, response.text)
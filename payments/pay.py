@@ -1,64 +1,131 @@
-from yookassa import Configuration, Payment
-from service.repository import DonationRepository
-from storage.postgres_storage import PostgresStorage
 import logging
-from yookassa import Payment
+import uuid
+from datetime import timedelta
+from typing import Any, Dict
+
+from requests.exceptions import RequestException
+from yookassa import Configuration, Payment
+
 from service.config import MAX_LEVEL
+from service.repository import DonationRepository
 from settings import YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY
 logger = logging.getLogger(__name__)
 
-storage = PostgresStorage(
-    dbname='probuzhdenie',
-    user='postgres',
-    password='5g',
-    host='localhost',
-    port='5433'
-)
-donation_repo = DonationRepository(storage)
-
 Configuration.account_id = YOOKASSA_SHOP_ID
 Configuration.secret_key = YOOKASSA_SECRET_KEY
 
+RETURN_URL = "https://t.me/Sovmestimost_par_bot"
 
-def create_payment(user_id: int, current_level: int, amount: float = 500.00) -> str:
-    """
-    Создает платеж для перехода на следующий уровень
-    """
-    if current_level > MAX_LEVEL:
-        raise ValueError(f"Уровень {current_level + 1} не существует (максимальный уровень: {MAX_LEVEL})")
-    try:
-        next_level = current_level + 1
-        payment = Payment.create({
+
+class PendingPaymentLimitError(RuntimeError):
+    """У пользователя уже max_pending неоплаченных платежей"""
+
+
+# Класс PaymentService
+# Создает платежи ЮKassa и записи о донатах:
+#     create_payment(user_id, current_level, amount) - донат для перехода на следующий уровень
+#     create_charity_payment(user_id, amount) - благотворительное пожертвование
+# Если у пользователя есть неоплаченный платеж на тот же уровень и сумму не старше
+# reuse_ttl, возвращается его ссылка на оплату - без запроса к ЮKassa и без новой строки
+# в donations. Новый платеж создается с ключом идемпотентности: при сетевой ошибке запрос
+# повторяется с тем же ключом, и ЮKassa не создает второй платеж. Неоплаченных платежей
+# не старше pending_ttl (их проверяет сверка) у пользователя может быть не больше
+# max_pending, сверх этого - PendingPaymentLimitError.
+class PaymentService:
+    def __init__(self, donation_repo: DonationRepository, reuse_ttl: float = 3600.0,
+                 max_pending: int = 3, pending_ttl: float = 86400.0, create_attempts: int = 2):
+        self.donation_repo = donation_repo
+        self.reuse_ttl = timedelta(seconds=reuse_ttl)
+        self.max_pending = max_pending
+        self.pending_ttl = timedelta(seconds=pending_ttl)
+        self.create_attempts = max(create_attempts, 1)
+
+    def create_payment(self, user_id: int, current_level: int, amount: float = 500.00) -> str:
+        """
+        Создает платеж для перехода на следующий уровень
+        """
+        if current_level > MAX_LEVEL:
+            raise ValueError(f"Уровень {current_level + 1} не существует (максимальный уровень: {MAX_LEVEL})")
+        try:
+            next_level = current_level + 1
+            return self._get_or_create(user_id, current_level, amount, {
+                "description": f"Донат для перехода на уровень {next_level}",
+                "metadata": {
+                    "user_id": user_id,
+                    "current_level": current_level,
+                    "target_level": next_level
+                }
+            })
+        except PendingPaymentLimitError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка создания платежа: {str(e)}")
+            raise
+
+    def create_charity_payment(self, user_id: int, amount: float) -> str:
+        try:
+            return self._get_or_create(user_id, 0, amount, {
+                "description": "Благотворительное пожертвование",
+                "metadata": {
+                    "user_id": user_id,
+                    "for_level": 0,  # 0 - признак благотворительности
+                    "is_charity": True
+                }
+            })
+        except PendingPaymentLimitError:
+            raise
+        except Exception as e:
+            logger.error(f"Charity payment error: {str(e)}")
+            raise
+
+    def _get_or_create(self, user_id: int, level: int, amount: float, details: Dict[str, Any]) -> str:
+        pending = self.donation_repo.get_reusable_payment(user_id, level, amount, self.reuse_ttl)
+        if pending:
+            logger.info(f"[Payments] Reusing payment {pending['payment_id']} for user {user_id}, level {level}")
+            return pending['confirmation_url']
+
+        if self.donation_repo.count_pending_payments(user_id, self.pending_ttl) >= self.max_pending:
+            logger.warning(f"[Payments] User {user_id} has {self.max_pending}+ pending payments, not creating more")
+            raise PendingPaymentLimitError(f"Too many pending payments for user {user_id}")
+
+        idempotence_key = str(uuid.uuid4())
+        payment = self._create_with_retry({
             "amount": {
                 "value": f"{amount:.2f}",
                 "currency": "RUB"
             },
             "confirmation": {
                 "type": "redirect",
-                "return_url": "https://t.me/Sovmestimost_par_bot"
-            },
-            "description": f"Донат для перехода на уровень {next_level}",
-            "metadata": {
-                "user_id": user_id,
-                "current_level": current_level,
-                "target_level": next_level
+                "return_url": RETURN_URL
             },
+            **details,
             "capture": True
-        })
+        }, idempotence_key)
+        confirmation_url = payment.confirmation.confirmation_url
 
-        donation_repo.create_donation(
+        self.donation_repo.create_donation(
             user_id=user_id,
-            for_level=current_level,
+            for_level=level,
             amount=amount,
             currency="RUB",
             status="pending",
-            payment_id=payment.id
+            payment_id=payment.id,
+            confirmation_url=confirmation_url,
+            idempotence_key=idempotence_key
         )
 
-        return payment.confirmation.confirmation_url
-    except Exception as e:
-        logger.error(f"Ошибка создания платежа: {str(e)}")
-        raise
+        return confirmation_url
+
+    def _create_with_retry(self, params: Dict[str, Any], idempotence_key: str):
+        """Сетевая ошибка - повтор с тем же ключом: ЮKassa вернет уже созданный платеж"""
+        for attempt in range(1, self.create_attempts + 1):
+            try:
+                return Payment.create(params, idempotence_key)
+            except RequestException as e:
+                if attempt == self.create_attempts:
+                    raise
+                logger.warning(f"[Payments] Payment.create attempt {attempt} failed, retrying "
+                               f"with key {idempotence_key}: {e}")
 
 
 def check_payment_status(payment_id: str) -> dict:
@@ -80,38 +147,3 @@ def check_payment_status(payment_id: str) -> dict:
     except Exception as e:
         logger.error(f"Payment check error: {str(e)}")
         return {'status': 'error', 'valid_for_level_up': False}
-
-
-def create_charity_payment(user_id: int, amount: float) -> str:
-    try:
-        payment = Payment.create({
-            "amount": {
-                "value": f"{amount:.2f}",
-                "currency": "RUB"
-            },
-            "confirmation": {
-                "type": "redirect",
-                "return_url": "https://t.me/Sovmestimost_par_bot"
-            },
-            "description": "Благотворительное пожертвование",
-            "metadata": {
-                "user_id": user_id,
-                "for_level": 0,  # 0 - признак благотворительности
-                "is_charity": True
-            },
-            "capture": True
-        })
-
-        donation_repo.create_donation(
-            user_id=user_id,
-            for_level=0,
-            amount=amount,
-            currency="RUB",
-            status="pending",
-            payment_id=payment.id
-        )
-
-        return payment.confirmation.confirmation_url
-    except Exception as e:
-        logger.error(f"Charity payment error: {str(e)}")
-        raise
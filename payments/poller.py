@@ -0,0 +1,157 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Any, List, Tuple
+
+from service.repository import DonationRepository
+
+logger = logging.getLogger(__name__)
+
+# (возраст платежа, интервал между проверками в секундах)
+DEFAULT_BACKOFF: Tuple[Tuple[timedelta, float], ...] = (
+    (timedelta(minutes=10), 20),
+    (timedelta(hours=1), 60),
+    (timedelta(hours=6), 300),
+)
+DEFAULT_MAX_INTERVAL = 900
+
+
+# Класс PaymentPoller
+# Фоновая сверка статусов ожидающих платежей с ЮKassa:
+#     run_forever(stop_event) - цикл с шагом tick_interval
+#     run_cycle() - один проход: выбирает платежи, которым пора на проверку, и проверяет их пулом потоков
+#     get_stats() - длительность и глубина очереди последнего цикла
+# Частота проверки зависит от возраста платежа (DEFAULT_BACKOFF), платежи старше payment_ttl
+# не выбираются из БД вовсе. Платежи одного пользователя проверяются в одном потоке по
+# очереди, и после первого успешного остальные ждут следующего цикла - как и раньше.
+# Если основной путь подтверждения - webhook, min_age откладывает первую проверку,
+# и сверка подхватывает только платежи, уведомление по которым не пришло.
+class PaymentPoller:
+    def __init__(self, donation_repo: DonationRepository,
+                 fetch_status: Callable[[str], Dict[str, Any]],
+                 on_succeeded: Callable[[Dict[str, Any]], None],
+                 on_canceled: Callable[[Dict[str, Any]], None],
+                 workers: int = 8, tick_interval: float = 15.0,
+                 payment_ttl: timedelta = timedelta(hours=24),
+                 backoff=DEFAULT_BACKOFF, max_interval: float = DEFAULT_MAX_INTERVAL,
+                 min_age: timedelta = timedelta(0)):
+        self.donation_repo = donation_repo
+        self.fetch_status = fetch_status
+        self.on_succeeded = on_succeeded
+        self.on_canceled = on_canceled
+        self.tick_interval = tick_interval
+        self.payment_ttl = payment_ttl
+        self.backoff = backoff
+        self.max_interval = max_interval
+        self.min_age = min_age
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="PaymentCheck")
+        self._next_check: Dict[int, float] = {}
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Any] = {}
+
+    def run_forever(self, stop_event: threading.Event) -> None:
+        while not stop_event.is_set():
+            started = time.monotonic()
+            try:
+                self.run_cycle()
+            except Exception as e:
+                logger.error(f"Payment poller error: {e}", exc_info=True)
+            stop_event.wait(max(0.0, self.tick_interval - (time.monotonic() - started)))
+        self._executor.shutdown(wait=False)
+
+    def run_cycle(self) -> Dict[str, Any]:
+        started = time.monotonic()
+        pending = self.donation_repo.get_pending_payments(max_age=self.payment_ttl)
+
+        now = time.monotonic()
+        with self._lock:
+            alive = {payment['id'] for payment in pending}
+            for donation_id in [d for d in self._next_check if d not in alive]:
+                del self._next_check[donation_id]
+            due = [p for p in pending
+                   if self._next_check.get(p['id'], 0) <= now and self._old_enough(p)]
+
+        by_user: Dict[int, List[Dict[str, Any]]] = OrderedDict()
+        for payment in due:
+            by_user.setdefault(payment['user_id'], []).append(payment)
+
+        results = list(self._executor.map(self._check_user_payments, by_user.values()))
+        totals = {'checked': 0, 'succeeded': 0, 'canceled': 0, 'errors': 0}
+        for result in results:
+            for key in totals:
+                totals[key] += result[key]
+
+        stats = {
+            'pending': len(pending),
+            'due': len(due),
+            'users': len(by_user),
+            **totals,
+            'duration': round(time.monotonic() - started, 3),
+            'finished_at': datetime.now().isoformat(timespec='seconds'),
+        }
+        with self._lock:
+            self._stats = stats
+
+        if due:
+            logger.info(f"[Payment Poller] Cycle: {stats}")
+        if stats['duration'] > self.tick_interval:
+            logger.warning(f"[Payment Poller] Cycle took {stats['duration']}s, longer than {self.tick_interval}s")
+        return stats
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._stats)
+
+    def _check_user_payments(self, payments: List[Dict[str, Any]]) -> Dict[str, int]:
+        result = {'checked': 0, 'succeeded': 0, 'canceled': 0, 'errors': 0}
+        for payment in payments:
+            result['checked'] += 1
+            try:
+                status = self.fetch_status(payment['payment_id']).get('status')
+
+                if status == DonationRepository.STATUS_SUCCEEDED:
+                    self._forget(payment)
+                    self.on_succeeded(payment)
+                    result['succeeded'] += 1
+                    break
+
+                if status == DonationRepository.STATUS_CANCELED:
+                    self._forget(payment)
+                    self.on_canceled(payment)
+                    result['canceled'] += 1
+                    continue
+
+                if status == 'error':
+                    result['errors'] += 1
+                self._schedule(payment)
+
+            except Exception as e:
+                result['errors'] += 1
+                self._schedule(payment)
+                logger.error(f"Error processing payment {payment['payment_id']}: {e}")
+        return result
+
+    def _schedule(self, payment: Dict[str, Any]) -> None:
+        interval = self._interval_for(payment.get('donation_date'))
+        with self._lock:
+            self._next_check[payment['id']] = time.monotonic() + interval
+
+    def _forget(self, payment: Dict[str, Any]) -> None:
+        with self._lock:
+            self._next_check.pop(payment['id'], None)
+
+    def _old_enough(self, payment: Dict[str, Any]) -> bool:
+        created_at = payment.get('donation_date')
+        return created_at is None or datetime.now() - created_at >= self.min_age
+
+    def _interval_for(self, created_at) -> float:
+        if created_at is None:
+            return self.backoff[0][1]
+        age = datetime.now() - created_at
+        for max_age, interval in self.backoff:
+            if age < max_age:
+                return interval
+        return self.max_interval
@@ -0,0 +1,109 @@
+import ipaddress
+import logging
+from typing import Any, Callable, Dict, Iterable, Tuple
+
+from flask import Blueprint, request
+
+from service.repository import DonationRepository
+
+logger = logging.getLogger(__name__)
+
+# Адреса, с которых ЮKassa отправляет HTTP-уведомления
+YOOKASSA_NETWORKS = (
+    "185.71.76.0/27",
+    "185.71.77.0/27",
+    "77.75.153.0/25",
+    "77.75.156.11/32",
+    "77.75.156.35/32",
+    "77.75.154.128/25",
+    "2a02:5180::/32",
+)
+
+EVENT_SUCCEEDED = "payment.succeeded"
+EVENT_CANCELED = "payment.canceled"
+
+
+# Класс YooKassaNotificationHandler
+# Обработка HTTP-уведомлений ЮKassa о платежах:
+#     handle(payload, remote_addr) - проверяет и обрабатывает уведомление, возвращает (HTTP-код, текст)
+# Проверка: адрес отправителя должен входить в trusted_networks, а при verify_with_api статус
+# платежа дополнительно запрашивается у ЮKassa - содержимому уведомления не доверяем.
+# Успешный платеж передается в on_succeeded (тот же поток зачисления, что у фоновой сверки),
+# повторные уведомления отсекаются через DonationRepository.claim_donation.
+# Код 5xx возвращается только при временных ошибках, чтобы ЮKassa повторила отправку.
+class YooKassaNotificationHandler:
+    def __init__(self, donation_repo: DonationRepository,
+                 fetch_status: Callable[[str], Dict[str, Any]],
+                 on_succeeded: Callable[[Dict[str, Any]], None],
+                 on_canceled: Callable[[Dict[str, Any]], None],
+                 trusted_networks: Iterable[str] = YOOKASSA_NETWORKS,
+                 verify_with_api: bool = True):
+        self.donation_repo = donation_repo
+        self.fetch_status = fetch_status
+        self.on_succeeded = on_succeeded
+        self.on_canceled = on_canceled
+        self.trusted_networks = [ipaddress.ip_network(net.strip()) for net in trusted_networks if net.strip()]
+        self.verify_with_api = verify_with_api
+
+    def handle(self, payload: Dict[str, Any], remote_addr: str) -> Tuple[int, str]:
+        if not self._is_trusted(remote_addr):
+            logger.warning(f"[Payment Webhook] Rejected notification from {remote_addr}")
+            return 403, "forbidden"
+
+        if not isinstance(payload, dict):
+            return 400, "bad request"
+
+        event = payload.get('event')
+        payment_object = payload.get('object') or {}
+        payment_id = payment_object.get('id')
+        if event not in (EVENT_SUCCEEDED, EVENT_CANCELED) or not payment_id:
+            logger.info(f"[Payment Webhook] Ignored event {event} for payment {payment_id}")
+            return 200, "ignored"
+
+        donation = self.donation_repo.get_donation_by_payment_id(payment_id)
+        if not donation:
+            logger.warning(f"[Payment Webhook] Unknown payment {payment_id}")
+            return 200, "unknown payment"
+
+        expected_status = payment_object.get('status')
+        if self.verify_with_api:
+            actual_status = self.fetch_status(payment_id).get('status')
+            if actual_status == 'error':
+                return 503, "status check failed"
+            if actual_status != expected_status:
+                logger.warning(f"[Payment Webhook] Status mismatch for {payment_id}: "
+                               f"notification={expected_status}, api={actual_status}")
+                return 400, "status mismatch"
+
+        try:
+            if event == EVENT_SUCCEEDED and expected_status == DonationRepository.STATUS_SUCCEEDED:
+                self.on_succeeded(donation)
+            elif event == EVENT_CANCELED and expected_status == DonationRepository.STATUS_CANCELED:
+                self.on_canceled(donation)
+            else:
+                return 400, "status mismatch"
+        except Exception as e:
+            logger.error(f"[Payment Webhook] Error processing {payment_id}: {e}", exc_info=True)
+            return 500, "error"
+
+        logger.info(f"[Payment Webhook] Processed {event} for payment {payment_id}")
+        return 200, "ok"
+
+    def _is_trusted(self, remote_addr: str) -> bool:
+        try:
+            address = ipaddress.ip_address(remote_addr)
+        except ValueError:
+            return False
+        return any(address in network for network in self.trusted_networks)
+
+
+def create_payment_webhook_blueprint(handler: YooKassaNotificationHandler, path: str) -> Blueprint:
+    blueprint = Blueprint("yookassa_webhook", __name__)
+
+    @blueprint.post(path)
+    def yookassa_notification():
+        payload = request.get_json(silent=True) or {}
+        status, text = handler.handle(payload, request.remote_addr)
+        return text, status
+
+    return blueprint
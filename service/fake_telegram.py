@@ -0,0 +1,66 @@
+"""
+Локальная замена Telegram для проверки webhook-режима без реального бота.
+
+Пример:
+    python -m service.fake_telegram http://127.0.0.1:8080/telegram/webhook 123456 "Главное меню" --count 50
+
+Бот должен быть запущен с BOT_UPDATE_MODE=webhook; секрет передается через
+TELEGRAM_WEBHOOK_SECRET так же, как его передает Telegram. Ответы бота уходят
+в настоящий Bot API, поэтому user_id должен быть пользователем, которому бот может писать,
+либо BOT_TOKEN - тестовым.
+"""
+import argparse
+import itertools
+import os
+import time
+from typing import Any, Dict, Optional
+
+import requests
+
+from service.update_intake import SECRET_HEADER
+
+_update_ids = itertools.count(int(time.time()))
+
+
+def build_text_update(user_id: int, text: str, update_id: Optional[int] = None,
+                      first_name: str = "Test", username: Optional[str] = None) -> Dict[str, Any]:
+    """Обновление с текстовым сообщением из личного чата, как его присылает Telegram"""
+    update_id = update_id if update_id is not None else next(_update_ids)
+    user = {"id": user_id, "is_bot": False, "first_name": first_name}
+    if username:
+        user["username"] = username
+    message = {
+        "message_id": update_id,
+        "from": user,
+        "chat": {"id": user_id, "type": "private", "first_name": first_name},
+        "date": int(time.time()),
+        "text": text,
+    }
+    if text.startswith("/"):
+        command = text.split()[0]
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return {"update_id": update_id, "message": message}
+
+
+def post_update(url: str, update: Dict[str, Any], secret_token: Optional[str] = None,
+                timeout: float = 5.0) -> requests.Response:
+    headers = {SECRET_HEADER: secret_token} if secret_token else {}
+    return requests.post(url, json=update, headers=headers, timeout=timeout)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Отправка поддельных обновлений Telegram на webhook бота")
+    parser.add_argument("url")
+    parser.add_argument("user_id", type=int)
+    parser.add_argument("text")
+    parser.add_argument("--count", type=int, default=1)
+    parser.add_argument("--secret", default=os.getenv("TELEGRAM_WEBHOOK_SECRET"))
+    args = parser.parse_args()
+
+    codes: Dict[int, int] = {}
+    started = time.monotonic()
+    for _ in range(args.count):
+        response = post_update(args.url, build_text_update(args.user_id, args.text), args.secret)
+        codes[response.status_code] = codes.get(response.status_code, 0) + 1
+    elapsed = time.monotonic() - started
+    print(f"Отправлено {args.count} обновлений за {elapsed:.2f} с, ответы: {codes}")
@@ -0,0 +1,49 @@
+import logging
+import threading
+from typing import Optional
+
+from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.serving import make_server
+
+logger = logging.getLogger(__name__)
+
+
+# Класс HttpServer
+# Встроенный HTTP-сервер для входящих уведомлений (ЮKassa, Telegram):
+#     app - Flask-приложение, к которому подключаются blueprint'ы
+#     start() - запускает сервер в фоновом потоке
+#     stop() - останавливает сервер
+class HttpServer:
+    def __init__(self, host: str, port: int, trust_proxy: bool = False):
+        self.host = host
+        self.port = port
+        self.app = Flask(__name__)
+        if trust_proxy:
+            # За nginx адрес клиента берется из X-Forwarded-For
+            self.app.wsgi_app = ProxyFix(self.app.wsgi_app, x_for=1)
+        self._server = None
+        self._thread: Optional[threading.Thread] = None
+
+        @self.app.get("/health")
+        def health():
+            return "ok", 200
+
+    def register_blueprint(self, blueprint, **options) -> None:
+        self.app.register_blueprint(blueprint, **options)
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._server = make_server(self.host, self.port, self.app, threaded=True)
+        self._thread = threading.Thread(target=self._server.serve_forever, name="HttpServer", daemon=True)
+        self._thread.start()
+        logger.info(f"HTTP server listening on {self.host}:{self.port}")
+
+    def stop(self) -> None:
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server = None
+        self._thread = None
+        logger.info("HTTP server stopped")
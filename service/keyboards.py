@@ -0,0 +1,127 @@
+import logging
+import threading
+import time
+import tracemalloc
+from typing import Dict, Tuple, Union
+
+from telebot import types
+
+from service.config import MAX_LEVEL
+
+logger = logging.getLogger(__name__)
+
+Row = Union[str, Tuple[str, ...]]
+
+
+def build_level_navigation(level: int, completed: bool = False) -> types.ReplyKeyboardMarkup:
+    """Клавиатура навигации по уровню; completed - выполнено ли задание уровня"""
+    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True)
+
+    if level > 1:
+        keyboard.add(types.KeyboardButton(f"{level - 1} уровень"))
+
+    if level == 1 or level >= MAX_LEVEL:
+        keyboard.add(types.KeyboardButton("Далее"))
+    else:
+        if completed:
+            keyboard.add(types.KeyboardButton(f"{level + 1} уровень"))
+        keyboard.add(types.KeyboardButton("Далее, перейти к следующему уровню."))
+
+    if 2 <= level <= MAX_LEVEL:
+        keyboard.add(types.KeyboardButton("Правила игры для уровня игры:3-21"))
+
+    return keyboard
+
+
+def build_reply(rows: Tuple[Row, ...], one_time: bool = False) -> types.ReplyKeyboardMarkup:
+    """Строка - одна кнопка в ряду, кортеж - кнопки, добавленные одним add()"""
+    keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=one_time)
+    for row in rows:
+        buttons = (row,) if isinstance(row, str) else row
+        keyboard.add(*[types.KeyboardButton(text) for text in buttons])
+    return keyboard
+
+
+# Класс KeyboardFactory
+# Готовые клавиатуры в виде сериализованного JSON reply_markup:
+#     level_navigation(level, completed) - навигация по уровню, все варианты строятся заранее
+#     main_menu / back / remove - постоянные клавиатуры
+#     reply(*rows, one_time=False) - клавиатура из обработчика, кэшируется по набору кнопок
+#     inline_url(text, url) - одна inline-кнопка со ссылкой
+# pyTelegramBotAPI передает строку reply_markup как есть, поэтому обработчик не создает
+# объекты кнопок и не сериализует их на каждое сообщение, а берет готовую строку.
+# Строки неизменяемы - один объект безопасно отдавать всем потокам.
+class KeyboardFactory:
+    def __init__(self, max_level: int = MAX_LEVEL):
+        self._navigation: Dict[Tuple[int, bool], str] = {
+            (level, completed): build_level_navigation(level, completed).to_json()
+            for level in range(1, max_level + 1)
+            for completed in (False, True)
+        }
+        self._custom: Dict[Tuple, str] = {}
+        self._lock = threading.Lock()
+        self.main_menu = self.reply("Правила игры", "О боте")
+        self.back = self.reply("Назад")
+        self.remove = types.ReplyKeyboardRemove().to_json()
+
+    def level_navigation(self, level: int, completed: bool = False) -> str:
+        keyboard = self._navigation.get((level, completed))
+        if keyboard is None:
+            # Уровень вне диапазона (например, после MAX_LEVEL) - строим как раньше, без кэша
+            keyboard = build_level_navigation(level, completed).to_json()
+        return keyboard
+
+    def reply(self, *rows: Row, one_time: bool = False) -> str:
+        key = ('reply', rows, one_time)
+        keyboard = self._custom.get(key)
+        if keyboard is None:
+            keyboard = build_reply(rows, one_time).to_json()
+            with self._lock:
+                self._custom[key] = keyboard
+        return keyboard
+
+    def inline_url(self, text: str, url: str) -> str:
+        key = ('inline_url', text, url)
+        keyboard = self._custom.get(key)
+        if keyboard is None:
+            markup = types.InlineKeyboardMarkup()
+            markup.add(types.InlineKeyboardButton(text=text, url=url))
+            keyboard = markup.to_json()
+            with self._lock:
+                self._custom[key] = keyboard
+        return keyboard
+
+
+def benchmark(updates: int = 10000) -> None:
+    """Память и время на клавиатуру одного обновления: построение против кэша"""
+    factory = KeyboardFactory()
+
+    def measure(make) -> Tuple[float, float]:
+        # Пик traced-памяти за вызов - сколько байт нужно, чтобы получить reply_markup
+        tracemalloc.start()
+        total_peak = 0
+        for number in range(updates):
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            make(number % MAX_LEVEL + 1)
+            total_peak += tracemalloc.get_traced_memory()[1] - current
+        tracemalloc.stop()
+
+        started = time.perf_counter()
+        for number in range(updates):
+            make(number % MAX_LEVEL + 1)
+        elapsed = time.perf_counter() - started
+        return total_peak / updates, elapsed / updates * 1e6
+
+    # Так же, как pyTelegramBotAPI перед запросом: объект клавиатуры сериализуется в JSON
+    built = measure(lambda level: build_level_navigation(level, level % 2 == 0).to_json())
+    cached = measure(lambda level: factory.level_navigation(level, level % 2 == 0))
+
+    print(f"{updates} обновлений, клавиатура навигации по уровню")
+    print(f"построение: {built[0]:.0f} Б на обновление, {built[1]:.1f} мкс")
+    print(f"кэш:        {cached[0]:.0f} Б на обновление, {cached[1]:.1f} мкс")
+
+
+if __name__ == "__main__":
+    # python -m service.keyboards
+    benchmark()
@@ -0,0 +1,115 @@
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+# Класс LaneExecutor
+# Пул потоков-"дорожек": каждая дорожка - отдельный поток со своей ограниченной очередью.
+#     submit(key, item, timeout) - кладет item в дорожку hash(key) % lanes
+#     start() / stop() - запускает и останавливает дорожки (stop дорабатывает очереди;
+#         если дорожка не успела освободиться до timeout, ее поток выходит после текущего элемента)
+#     get_stats() - глубина очередей по дорожкам, отказы и время ожидания
+# Элементы с одинаковым ключом всегда попадают в одну дорожку и обрабатываются строго
+# по очереди, элементы с разными ключами - параллельно в разных дорожках.
+class LaneExecutor:
+    def __init__(self, process: Callable[[Any], None], lanes: int = 16,
+                 max_queue_per_lane: int = 100, name: str = "Lane"):
+        self.process = process
+        self.lanes = max(1, lanes)
+        self.name = name
+        self._queues: List["queue.Queue"] = [queue.Queue(maxsize=max_queue_per_lane) for _ in range(self.lanes)]
+        self._threads: List[threading.Thread] = []
+        # Флаг на каждую дорожку: остаток очереди бросает только дорожка, не освободившаяся к сроку
+        self._aborts: List[threading.Event] = [threading.Event() for _ in range(self.lanes)]
+        self._lock = threading.Lock()
+        self._stats = {
+            'submitted': 0,
+            'processed': 0,
+            'rejected': 0,
+            'errors': 0,
+            'max_depth': 0,
+            'queue_wait_total': 0.0,
+            'queue_wait_max': 0.0,
+        }
+
+    def submit(self, key: Any, item: Any, timeout: Optional[float] = None) -> bool:
+        """Ставит item в очередь дорожки; False, если очередь не освободилась за timeout"""
+        lane = self._queues[hash(key) % self.lanes]
+        try:
+            lane.put((time.monotonic(), item), timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                self._stats['rejected'] += 1
+            return False
+
+        depth = lane.qsize()
+        with self._lock:
+            self._stats['submitted'] += 1
+            self._stats['max_depth'] = max(self._stats['max_depth'], depth)
+        return True
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        for number, lane in enumerate(self._queues):
+            self._aborts[number].clear()
+            thread = threading.Thread(target=self._worker, args=(lane, self._aborts[number]),
+                                      name=f"{self.name}-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"[{self.name}] Started {self.lanes} lanes")
+
+    def stop(self, timeout: float = 10.0) -> None:
+        deadline = time.monotonic() + timeout
+        # Срок общий: пока stop ждет одну дорожку, остальные разгружаются параллельно
+        for number, lane in enumerate(self._queues):
+            try:
+                lane.put((time.monotonic(), _STOP), timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                # Дорожка переполнена: ее остаток не дорабатываем, чтобы не зависнуть
+                self._aborts[number].set()
+                logger.warning(f"[{self.name}] Lane {number} still full after {timeout}s, "
+                               f"dropping {lane.qsize()} queued items")
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._threads = []
+        logger.info(f"[{self.name}] Stopped, stats: {self.get_stats()}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        depths = [lane.qsize() for lane in self._queues]
+        stats['lanes'] = self.lanes
+        stats['depth'] = sum(depths)
+        stats['busiest_lane_depth'] = max(depths)
+        stats['capacity'] = self._queues[0].maxsize * self.lanes
+        if stats['processed']:
+            stats['queue_wait_avg'] = round(stats['queue_wait_total'] / stats['processed'], 4)
+        stats['queue_wait_total'] = round(stats['queue_wait_total'], 3)
+        stats['queue_wait_max'] = round(stats['queue_wait_max'], 4)
+        return stats
+
+    def _worker(self, lane: "queue.Queue", abort: threading.Event) -> None:
+        while True:
+            queued_at, item = lane.get()
+            if item is _STOP:
+                return
+            waited = time.monotonic() - queued_at
+            try:
+                self.process(item)
+            except Exception as e:
+                with self._lock:
+                    self._stats['errors'] += 1
+                logger.error(f"[{self.name}] Error processing item: {e}", exc_info=True)
+            with self._lock:
+                self._stats['processed'] += 1
+                self._stats['queue_wait_total'] += waited
+                self._stats['queue_wait_max'] = max(self._stats['queue_wait_max'], waited)
+            if abort.is_set():
+                return
@@ -0,0 +1,110 @@
+import logging
+import select
+import threading
+from typing import Dict, Optional, Tuple
+
+import psycopg2
+
+from service.repository import LevelRepository
+from storage.postgres_storage import PostgresStorage
+
+logger = logging.getLogger(__name__)
+
+LEVELS_CHANNEL = 'levels_changed'
+
+
+# Класс LevelCatalog
+# Хранит все уровни в памяти процесса:
+#     load() - загружает таблицу levels одним запросом (вызывается при старте)
+#     content_and_rules(level_number) - контент и правила уровня без обращения к БД
+#     start_listener()/stop_listener() - фоновый LISTEN на канале levels_changed
+# Триггер на таблице levels (см. Migrator) отправляет NOTIFY с номером измененного уровня,
+# после чего перечитывается только этот уровень. После переподключения слушателя каталог
+# перечитывается целиком, так как уведомления за время обрыва могли потеряться.
+class LevelCatalog:
+    def __init__(self, level_repo: LevelRepository, storage: PostgresStorage,
+                 reconnect_delay: float = 5.0, poll_timeout: float = 30.0):
+        self.level_repo = level_repo
+        self.storage = storage
+        self.reconnect_delay = reconnect_delay
+        self.poll_timeout = poll_timeout
+        self._levels: Dict[int, Tuple[str, Optional[str]]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def load(self) -> None:
+        """Полностью перечитывает таблицу levels"""
+        levels = self.level_repo.get_all_levels()
+        with self._lock:
+            self._levels = levels
+        logger.info(f"[Level Catalog] Loaded {len(levels)} levels")
+
+    def reload_level(self, level_number: int) -> None:
+        level = self.level_repo.get_level(level_number)
+        with self._lock:
+            if level is None:
+                self._levels.pop(level_number, None)
+            else:
+                self._levels[level_number] = level
+        logger.info(f"[Level Catalog] Level {level_number} reloaded")
+
+    def content_and_rules(self, level_number: int) -> Tuple[Optional[str], Optional[str]]:
+        """Контент и правила уровня; при промахе уровень читается из БД и кэшируется"""
+        level = self._levels.get(level_number)
+        if level is None:
+            level = self.level_repo.get_level(level_number)
+            if level is None:
+                return None, None
+            with self._lock:
+                self._levels[level_number] = level
+        return level
+
+    def start_listener(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen_loop, name="LevelCatalogListener", daemon=True)
+        self._thread.start()
+
+    def stop_listener(self) -> None:
+        self._stop.set()
+
+    def _listen_loop(self) -> None:
+        first_connect = True
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self.storage.dedicated_connection()
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {LEVELS_CHANNEL}")
+
+                if not first_connect:
+                    self.load()
+                first_connect = False
+                logger.info(f"[Level Catalog] Listening on channel {LEVELS_CHANNEL}")
+
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], self.poll_timeout) == ([], [], []):
+                        continue
+                    conn.poll()
+                    changed = set()
+                    while conn.notifies:
+                        changed.add(conn.notifies.pop(0).payload)
+                    self._apply_notifications(changed)
+
+            except Exception as e:
+                logger.error(f"[Level Catalog] Listener error: {e}")
+                self._stop.wait(self.reconnect_delay)
+            finally:
+                if conn is not None and not conn.closed:
+                    conn.close()
+
+    def _apply_notifications(self, payloads) -> None:
+        for payload in payloads:
+            try:
+                self.reload_level(int(payload))
+            except (TypeError, ValueError):
+                self.load()
+                return
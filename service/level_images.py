@@ -0,0 +1,59 @@
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+IMAGE_PREFIX = "image:"
+
+
+# Класс LevelImageIndex
+# Индекс изображений уровней, который строится один раз при старте:
+#     reload() - пересканирует каталог (например, после добавления картинок)
+#     resolve(level_rules) - по значению "image:<имя>" из levels.rules возвращает путь к файлу
+# Имя ищется как есть, затем с расширениями .jpg, .jpeg, .png, .gif - в том же
+# порядке, что и при прежнем поиске по файловой системе, но без обращений к диску.
+class LevelImageIndex:
+    EXTENSIONS = ('', '.jpg', '.jpeg', '.png', '.gif')
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self._images: Dict[str, Path] = {}
+        self._lock = threading.Lock()
+
+    def reload(self) -> int:
+        """Строит индекс заново, возвращает количество найденных изображений"""
+        images = {}
+        ranks = {}
+
+        if not self.root.is_dir():
+            logger.error(f"[Level Images] Images directory not found: {self.root}")
+        else:
+            for path in sorted(self.root.rglob('*')):
+                if not path.is_file():
+                    continue
+                relative = path.relative_to(self.root).as_posix()
+                images[relative] = path
+                ranks[relative] = 0
+
+                suffix = path.suffix.lower()
+                if suffix in self.EXTENSIONS:
+                    stem = relative[:-len(path.suffix)]
+                    rank = self.EXTENSIONS.index(suffix)
+                    if stem not in ranks or rank < ranks[stem]:
+                        images[stem] = path
+                        ranks[stem] = rank
+
+        with self._lock:
+            self._images = images
+
+        files = len(set(images.values()))
+        logger.info(f"[Level Images] Indexed {files} images in {self.root}")
+        return files
+
+    def resolve(self, level_rules: Optional[str]) -> Optional[Path]:
+        if not level_rules or not level_rules.startswith(IMAGE_PREFIX):
+            return None
+        name = level_rules[len(IMAGE_PREFIX):].strip()
+        return self._images.get(name)
@@ -0,0 +1,61 @@
+from datetime import datetime
+from typing import Optional, Tuple
+
+
+# Класс LevelProgress
+# Прогресс пользователя по заданиям уровня одним запросом вместо get_active_time_task,
+# трех is_task_completed, get_referral_status и get_last_donation:
+#     time_task_started_at - начало незавершенного задания на время (None, если его нет)
+#     time_completed / referral_completed / donation_completed - выполнено ли задание
+#     referrals_total / referrals_completed - счетчики из referral_counters
+#     last_donation_status - статус последнего доната на уровне (None, если донатов нет)
+# Задания уровня читаются за один проход по tasks (не больше одной строки на тип).
+class LevelProgress:
+    __slots__ = ('user_id', 'level', 'time_task_started_at', 'time_completed', 'referral_completed',
+                 'donation_completed', 'referrals_total', 'referrals_completed', 'last_donation_status')
+
+    QUERY = """
+        WITH p(user_id, level) AS (VALUES (%s::bigint, %s::integer))
+        SELECT p.user_id, p.level,
+               t.time_task_started_at, t.time_completed, t.referral_completed, t.donation_completed,
+               COALESCE(rc.total, 0), COALESCE(rc.completed, 0),
+               d.status
+        FROM p
+        CROSS JOIN LATERAL (
+            SELECT MAX(start_time) FILTER (WHERE task_type = 'time' AND NOT completed) AS time_task_started_at,
+                   COALESCE(BOOL_OR(completed) FILTER (WHERE task_type = 'time'), FALSE) AS time_completed,
+                   COALESCE(BOOL_OR(completed) FILTER (WHERE task_type = 'referral'), FALSE) AS referral_completed,
+                   COALESCE(BOOL_OR(completed) FILTER (WHERE task_type = 'donation'), FALSE) AS donation_completed
+            FROM tasks
+            WHERE user_id = p.user_id AND level = p.level
+        ) t
+        LEFT JOIN referral_counters rc ON rc.referrer_id = p.user_id AND rc.level = p.level
+        LEFT JOIN LATERAL (
+            SELECT status FROM donations
+            WHERE user_id = p.user_id AND level = p.level
+            ORDER BY donation_date DESC LIMIT 1
+        ) d ON TRUE
+    """
+
+    def __init__(self, user_id: int, level: int, time_task_started_at: Optional[datetime] = None,
+                 time_completed: bool = False, referral_completed: bool = False,
+                 donation_completed: bool = False, referrals_total: int = 0, referrals_completed: int = 0,
+                 last_donation_status: Optional[str] = None):
+        self.user_id = user_id
+        self.level = level
+        self.time_task_started_at = time_task_started_at
+        self.time_completed = time_completed
+        self.referral_completed = referral_completed
+        self.donation_completed = donation_completed
+        self.referrals_total = referrals_total
+        self.referrals_completed = referrals_completed
+        self.last_donation_status = last_donation_status
+
+    @classmethod
+    def from_row(cls, row: Tuple) -> "LevelProgress":
+        return cls(*row)
+
+    def __repr__(self) -> str:
+        return (f"LevelProgress(user_id={self.user_id}, level={self.level}, "
+                f"time={self.time_completed}, referral={self.referral_completed}, "
+                f"donation={self.donation_completed}, referrals={self.referrals_completed}/{self.referrals_total})")
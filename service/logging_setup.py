@@ -0,0 +1,163 @@
+import atexit
+import copy
+import json
+import logging
+import queue
+import threading
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOGGER_PREFIX = "logger:"
+
+
+def parse_sample_rates(value: str) -> Dict[str, float]:
+    """Разбирает строку вида "[Keyboard]=0.05;logger:telebot=0.5" в словарь правил"""
+    rates = {}
+    for item in value.split(';'):
+        key, sep, rate = item.rpartition('=')
+        if not sep or not key.strip():
+            continue
+        rates[key.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+# Класс SamplingFilter
+# Пропускает только часть однотипных сообщений уровня INFO и ниже:
+#     rules - {префикс сообщения: доля} или {"logger:<имя>": доля} для логгера и его потомков
+# Доля 0.1 означает каждое десятое сообщение (счетчик, а не случайный выбор), 0 - ни одного.
+# WARNING и выше не отбрасываются никогда.
+class SamplingFilter(logging.Filter):
+    def __init__(self, rules: Dict[str, float]):
+        super().__init__()
+        self._message_rules: List[Tuple[str, int]] = []
+        self._logger_rules: List[Tuple[str, int]] = []
+        for key, rate in rules.items():
+            every = round(1 / rate) if rate > 0 else 0
+            if key.startswith(LOGGER_PREFIX):
+                self._logger_rules.append((key[len(LOGGER_PREFIX):], every))
+            else:
+                self._message_rules.append((key, every))
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+
+        rule = self._match(record)
+        if rule is None:
+            return True
+
+        key, every = rule
+        with self._lock:
+            count = self._counters.get(key, 0)
+            self._counters[key] = count + 1
+            keep = every > 0 and count % every == 0
+            if not keep:
+                self.dropped += 1
+        return keep
+
+    def _match(self, record: logging.LogRecord) -> Optional[Tuple[str, int]]:
+        for name, every in self._logger_rules:
+            if record.name == name or record.name.startswith(name + '.'):
+                return LOGGER_PREFIX + name, every
+        if self._message_rules:
+            message = record.msg if isinstance(record.msg, str) else str(record.msg)
+            for prefix, every in self._message_rules:
+                if message.startswith(prefix):
+                    return prefix, every
+        return None
+
+
+# Класс JsonFormatter
+# Одна запись - одна строка JSON: время, уровень, логгер, поток, сообщение и трассировка.
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+# Класс NonBlockingQueueHandler
+# QueueHandler, который никогда не ждет: при заполненной очереди запись отбрасывается
+# и учитывается в dropped. Форматирование остается писателю в фоновом потоке.
+class NonBlockingQueueHandler(QueueHandler):
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Аргументы подставляем сразу (объекты могут измениться), остальное форматирует писатель
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(log_file: str = 'logs/bot.log', level: int = logging.INFO, json_format: bool = False,
+                  sample_rates: Optional[Dict[str, float]] = None, queue_size: int = 10000) -> QueueListener:
+    """
+    Настраивает корневой логгер: потоки обработчиков только кладут запись в очередь,
+    а запись на диск и в консоль выполняет фоновый QueueListener.
+    Возвращает listener; он останавливается при выходе из процесса (остаток очереди дописывается).
+    """
+    Path(log_file).parent.mkdir(parents=True, exist_ok=True)
+    formatter = JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT)
+
+    stream_handler = logging.StreamHandler()
+    file_handler = RotatingFileHandler(
+        filename=log_file,
+        maxBytes=5 * 1024 * 1024,
+        backupCount=3,
+        encoding='utf-8'
+    )
+    for handler in (stream_handler, file_handler):
+        handler.setFormatter(formatter)
+
+    log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    if sample_rates:
+        queue_handler.addFilter(SamplingFilter(sample_rates))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, stream_handler, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def get_logging_stats() -> Dict[str, int]:
+    """Сколько записей отброшено сэмплированием и из-за переполнения очереди"""
+    stats = {'sampled_out': 0, 'queue_dropped': 0, 'queue_depth': 0}
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, NonBlockingQueueHandler):
+            stats['queue_dropped'] += handler.dropped
+            stats['queue_depth'] += handler.queue.qsize()
+            for log_filter in handler.filters:
+                if isinstance(log_filter, SamplingFilter):
+                    stats['sampled_out'] += log_filter.dropped
+    return stats
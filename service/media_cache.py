@@ -0,0 +1,100 @@
+import hashlib
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from telebot.apihelper import ApiTelegramException
+
+from service.repository import MediaCacheRepository
+
+logger = logging.getLogger(__name__)
+
+
+# Класс TelegramFileCache
+# Отправляет изображения через file_id, полученный при первой загрузке:
+#     send_photo(chat_id, image_path, **kwargs) - отправка фото с повторным использованием file_id
+#     forget(image_path) - сброс кэша для файла (например, после замены картинки)
+# Ключ кэша - имя файла и sha256 его содержимого, поэтому измененный файл загружается заново.
+# Соответствия хранятся в таблице telegram_file_cache и переживают перезапуск,
+# а также общие для всех экземпляров бота. Хэш файла пересчитывается только при
+# изменении mtime/размера.
+class TelegramFileCache:
+    def __init__(self, bot, media_repo: MediaCacheRepository):
+        self.bot = bot
+        self.media_repo = media_repo
+        self._file_ids: Dict[Tuple[str, str], str] = {}
+        self._hashes: Dict[str, Tuple[int, int, str]] = {}
+        self._lock = threading.Lock()
+
+    def send_photo(self, chat_id, image_path, **kwargs):
+        image_path = Path(image_path)
+        key = self._cache_key(image_path)
+        file_id = self._get_file_id(key)
+
+        if file_id:
+            try:
+                return self.bot.send_photo(chat_id, file_id, **kwargs)
+            except ApiTelegramException as e:
+                if e.error_code != 400:
+                    raise
+                logger.warning(f"[File Cache] file_id for {image_path.name} rejected, re-uploading: {e}")
+                self._drop(key)
+
+        with open(image_path, 'rb') as photo:
+            message = self.bot.send_photo(chat_id, photo, **kwargs)
+
+        file_id = self._extract_file_id(message)
+        if file_id:
+            with self._lock:
+                self._file_ids[key] = file_id
+            self.media_repo.save_file_id(key[0], key[1], file_id)
+            logger.info(f"[File Cache] Cached file_id for {image_path.name}")
+        return message
+
+    def forget(self, image_path) -> None:
+        image_path = Path(image_path)
+        with self._lock:
+            self._hashes.pop(str(image_path), None)
+            for key in [k for k in self._file_ids if k[0] == image_path.name]:
+                self._file_ids.pop(key, None)
+
+    def _get_file_id(self, key: Tuple[str, str]) -> Optional[str]:
+        file_id = self._file_ids.get(key)
+        if file_id:
+            return file_id
+        file_id = self.media_repo.get_file_id(key[0], key[1])
+        if file_id:
+            with self._lock:
+                self._file_ids[key] = file_id
+        return file_id
+
+    def _drop(self, key: Tuple[str, str]) -> None:
+        with self._lock:
+            self._file_ids.pop(key, None)
+        self.media_repo.delete_file_id(key[0], key[1])
+
+    def _cache_key(self, image_path: Path) -> Tuple[str, str]:
+        stat = os.stat(image_path)
+        cached = self._hashes.get(str(image_path))
+        if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            return image_path.name, cached[2]
+
+        digest = hashlib.sha256()
+        with open(image_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                digest.update(chunk)
+        content_hash = digest.hexdigest()
+
+        with self._lock:
+            self._hashes[str(image_path)] = (stat.st_mtime_ns, stat.st_size, content_hash)
+        return image_path.name, content_hash
+
+    @staticmethod
+    def _extract_file_id(message) -> Optional[str]:
+        photos = getattr(message, 'photo', None)
+        if not photos:
+            return None
+        # Telegram возвращает несколько размеров, последний - самый большой
+        return photos[-1].file_id
@@ -0,0 +1,378 @@
+import heapq
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from requests.exceptions import ConnectionError as RequestsConnectionError
+from telebot.apihelper import ApiTelegramException
+
+logger = logging.getLogger(__name__)
+
+# Ограничение Bot API на длину текста одного сообщения
+MESSAGE_TEXT_LIMIT = 4096
+
+
+# Класс TokenBucket
+# Ведро токенов: rate токенов в секунду, не больше burst подряд.
+#     delay(now) - сколько секунд ждать до следующего токена (0 - токен есть)
+#     take(now) - забрать токен (вызывается после delay(now) == 0)
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def delay(self, now: float) -> float:
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+
+class OutboundMessage:
+    """Отложенный вызов Bot API: send(*args, **kwargs) для чата chat_id"""
+    __slots__ = ('chat_id', 'send', 'args', 'kwargs', 'queued_at', 'attempts', 'merged', 'bulk', 'done')
+
+    def __init__(self, chat_id: int, send: Callable, args: Tuple, kwargs: Dict[str, Any],
+                 bulk: bool = False, done: Optional[Callable[[bool], None]] = None):
+        self.chat_id = chat_id
+        self.send = send
+        self.args = args
+        self.kwargs = kwargs
+        self.queued_at = time.monotonic()
+        self.attempts = 0
+        self.merged = 1
+        self.bulk = bulk
+        self.done = done
+
+
+# Класс OutboundScheduler
+# Очередь исходящих сообщений Telegram: обработчики только ставят отправку в очередь
+# и сразу возвращаются, а отправляют фоновые потоки с учетом лимитов Bot API.
+#     submit(chat_id, send, *args, **kwargs) - поставить вызов send(*args, **kwargs) в очередь чата
+#     send_message(chat_id, text, **kwargs) / reply_to(message, text, **kwargs) - то же для текста
+#     submit_bulk(chat_id, done, send, *args, **kwargs) - массовая отправка (рассылка);
+#         done(delivered) вызывается после отправки или окончательной ошибки
+#     bulk_pending() - сколько массовых отправок еще не завершено
+#     start() / stop() - фоновые потоки; stop дожидается отправки остатка очереди
+#     get_stats() - глубина очереди, задержка в очереди, отказы, ответы 429
+# Лимиты - два ведра токенов: общее (global_rate в секунду) и свое у каждого чата
+# (chat_rate в секунду, до chat_burst подряд). Сообщения одного чата уходят строго
+# по порядку и по одному; разные чаты отправляются параллельно в workers потоках.
+# Ответ 429 откладывает чат на retry_after секунд, сообщение остается первым в очереди.
+# Повтор (до max_attempts) - только при ошибке соединения: запрос не дошел до Telegram.
+# Таймаут чтения и прочие ошибки не повторяются - сообщение могло быть уже доставлено.
+# Если несколько текстов одного чата ждут в очереди, они склеиваются в одно сообщение
+# (coalesce): текст без клавиатуры объединяется со следующим текстом с теми же параметрами.
+# Массовые отправки дополнительно ограничены ведром bulk_rate (меньше global_rate),
+# поэтому рассылка не забирает весь общий лимит и ответы пользователям уходят без задержки.
+class OutboundScheduler:
+    BUCKET_SWEEP_INTERVAL = 60.0
+
+    def __init__(self, bot, global_rate: float = 30.0, chat_rate: float = 1.0, chat_burst: float = 3.0,
+                 workers: int = 4, max_queue: int = 10000, coalesce: bool = True, max_attempts: int = 3,
+                 bulk_rate: float = 20.0):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.coalesce = coalesce
+        self.max_attempts = max_attempts
+        self._global = TokenBucket(global_rate, global_rate)
+        self._bulk = TokenBucket(bulk_rate, bulk_rate)
+        self._bulk_pending = 0
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._queues: Dict[int, Deque[OutboundMessage]] = {}
+        # Чаты, ожидающие отправки: (время готовности, порядковый номер, chat_id)
+        self._ready: List[Tuple[float, int, int]] = []
+        self._scheduled: Set[int] = set()
+        self._busy: Set[int] = set()
+        self._sequence = 0
+        self._size = 0
+        self._last_sweep = time.monotonic()
+        self._cond = threading.Condition()
+        self._closing = False
+        self._abort = False
+        self._threads: List[threading.Thread] = []
+        self._stats = {
+            'submitted': 0,
+            'sent': 0,
+            'coalesced': 0,
+            'dropped': 0,
+            'failed': 0,
+            'throttled': 0,
+            'retries': 0,
+            'max_depth': 0,
+            'queue_wait_total': 0.0,
+            'queue_wait_max': 0.0,
+            'last_retry_after': 0,
+        }
+
+    def submit(self, chat_id: int, send: Callable, *args, **kwargs) -> bool:
+        """Ставит отправку в очередь чата; False, если очередь переполнена или остановлена"""
+        return self._enqueue(OutboundMessage(chat_id, send, args, kwargs))
+
+    def submit_bulk(self, chat_id: int, done: Optional[Callable[[bool], None]], send: Callable,
+                    *args, **kwargs) -> bool:
+        """Ставит в очередь отправку рассылки; done не вызывается, если вернулось False"""
+        return self._enqueue(OutboundMessage(chat_id, send, args, kwargs, bulk=True, done=done))
+
+    def bulk_pending(self) -> int:
+        with self._cond:
+            return self._bulk_pending
+
+    def _enqueue(self, item: OutboundMessage) -> bool:
+        chat_id = item.chat_id
+        with self._cond:
+            if self._closing or self._size >= self.max_queue:
+                self._stats['dropped'] += 1
+                logger.warning(f"[Outbound] Queue full or stopped, message to {chat_id} dropped")
+                return False
+
+            self._queues.setdefault(chat_id, deque()).append(item)
+            self._size += 1
+            if item.bulk:
+                self._bulk_pending += 1
+            self._stats['submitted'] += 1
+            self._stats['max_depth'] = max(self._stats['max_depth'], self._size)
+            if chat_id not in self._busy and chat_id not in self._scheduled:
+                self._schedule(chat_id, item.queued_at)
+            self._cond.notify()
+        return True
+
+    def send_message(self, chat_id: int, text: str, **kwargs) -> bool:
+        return self.submit(chat_id, self.bot.send_message, chat_id, text, **kwargs)
+
+    def reply_to(self, message, text: str, **kwargs) -> bool:
+        return self.submit(message.chat.id, self.bot.reply_to, message, text, **kwargs)
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        with self._cond:
+            self._closing = False
+            self._abort = False
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"Outbound-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"[Outbound] Started {self.workers} senders, "
+                    f"global {self._global.rate}/s, per chat {self.chat_rate}/s")
+
+    def stop(self, timeout: float = 10.0) -> None:
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+        with self._cond:
+            lost = self._size
+            self._abort = True
+            self._cond.notify_all()
+        self._threads = []
+        if lost:
+            logger.warning(f"[Outbound] Stopped with {lost} unsent messages")
+        logger.info(f"[Outbound] Stopped, stats: {self.get_stats()}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            stats = dict(self._stats)
+            stats['depth'] = self._size
+            stats['chats_waiting'] = len(self._queues)
+            stats['bulk_pending'] = self._bulk_pending
+        if stats['sent']:
+            stats['queue_wait_avg'] = round(stats['queue_wait_total'] / stats['sent'], 4)
+        stats['queue_wait_total'] = round(stats['queue_wait_total'], 3)
+        stats['queue_wait_max'] = round(stats['queue_wait_max'], 4)
+        return stats
+
+    def _schedule(self, chat_id: int, ready_at: float) -> None:
+        self._sequence += 1
+        heapq.heappush(self._ready, (ready_at, self._sequence, chat_id))
+        self._scheduled.add(chat_id)
+
+    def _next_item(self) -> Optional[OutboundMessage]:
+        """Ждет чат, которому можно отправить сообщение; None - пора завершаться"""
+        with self._cond:
+            while True:
+                if self._abort or (self._closing and self._size == 0):
+                    return None
+
+                now = time.monotonic()
+                self._sweep_buckets(now)
+                if not self._ready:
+                    self._cond.wait()
+                    continue
+
+                ready_at = self._ready[0][0]
+                wait = ready_at - now if ready_at > now else self._global.delay(now)
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+
+                _, _, chat_id = heapq.heappop(self._ready)
+                self._scheduled.discard(chat_id)
+                bucket = self._chat_buckets.get(chat_id)
+                if bucket is None:
+                    bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+                chat_wait = bucket.delay(now)
+                if chat_wait > 0:
+                    self._schedule(chat_id, now + chat_wait)
+                    continue
+
+                queue = self._queues[chat_id]
+                if queue[0].bulk:
+                    bulk_wait = self._bulk.delay(now)
+                    if bulk_wait > 0:
+                        self._schedule(chat_id, now + bulk_wait)
+                        continue
+                    self._bulk.take(now)
+
+                bucket.take(now)
+                self._global.take(now)
+                item = queue.popleft()
+                self._size -= 1
+                if self.coalesce:
+                    item = self._coalesce(item, queue)
+                self._busy.add(chat_id)
+                return item
+
+    def _coalesce(self, item: OutboundMessage, queue: Deque[OutboundMessage]) -> OutboundMessage:
+        """Склеивает подряд идущие тексты чата; клавиатура допустима только у последнего"""
+        while queue and self._can_merge(item, queue[0]):
+            following = queue.popleft()
+            self._size -= 1
+            text = f"{item.args[1]}\n\n{following.args[1]}"
+            following.args = (following.args[0], text) + following.args[2:]
+            following.queued_at = item.queued_at
+            following.merged += item.merged
+            item = following
+            self._stats['coalesced'] += 1
+        return item
+
+    def _can_merge(self, item: OutboundMessage, following: OutboundMessage) -> bool:
+        if item.send != self.bot.send_message or following.send != self.bot.send_message:
+            return False
+        if item.bulk or following.bulk:
+            return False
+        if len(item.args) != 2 or len(following.args) != 2 or item.kwargs.get('reply_markup') is not None:
+            return False
+        if len(item.args[1]) + len(following.args[1]) + 2 > MESSAGE_TEXT_LIMIT:
+            return False
+        return self._without_markup(item.kwargs) == self._without_markup(following.kwargs)
+
+    @staticmethod
+    def _without_markup(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        return {key: value for key, value in kwargs.items() if key != 'reply_markup'}
+
+    def _sweep_buckets(self, now: float) -> None:
+        """Удаляет ведра чатов без очереди, которые успели наполниться"""
+        if now - self._last_sweep < self.BUCKET_SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        for chat_id in [chat_id for chat_id, bucket in self._chat_buckets.items()
+                        if chat_id not in self._queues and bucket.full(now)]:
+            del self._chat_buckets[chat_id]
+
+    def _worker(self) -> None:
+        while True:
+            item = self._next_item()
+            if item is None:
+                return
+            retry_in = self._deliver(item)
+            self._finish(item, retry_in)
+
+    def _deliver(self, item: OutboundMessage) -> Optional[float]:
+        """Отправляет сообщение; возвращает задержку перед повтором или None"""
+        started = time.monotonic()
+        waited = started - item.queued_at
+        try:
+            item.send(*item.args, **item.kwargs)
+        except ApiTelegramException as e:
+            if e.error_code == 429:
+                retry_after = self._retry_after(e)
+                with self._cond:
+                    self._stats['throttled'] += 1
+                    self._stats['last_retry_after'] = retry_after
+                logger.warning(f"[Outbound] 429 for chat {item.chat_id}, retry after {retry_after}s")
+                return float(retry_after)
+            self._fail(item, e)
+            return None
+        except RequestsConnectionError as e:
+            item.attempts += 1
+            if item.attempts < self.max_attempts:
+                with self._cond:
+                    self._stats['retries'] += 1
+                logger.warning(f"[Outbound] Send to {item.chat_id} failed (attempt {item.attempts}): {e}")
+                return float(2 ** item.attempts)
+            self._fail(item, e)
+            return None
+        except Exception as e:
+            self._fail(item, e)
+            return None
+
+        with self._cond:
+            self._stats['sent'] += item.merged
+            self._stats['queue_wait_total'] += waited * item.merged
+            self._stats['queue_wait_max'] = max(self._stats['queue_wait_max'], waited)
+        self._complete(item, True)
+        return None
+
+    def _fail(self, item: OutboundMessage, error: Exception) -> None:
+        with self._cond:
+            self._stats['failed'] += item.merged
+        # Недоставка рассылки (пользователь заблокировал бота и т.п.) - штатная ситуация
+        log = logger.info if item.bulk else logger.error
+        log(f"[Outbound] Message to {item.chat_id} not delivered: {error}")
+        self._complete(item, False)
+
+    def _complete(self, item: OutboundMessage, delivered: bool) -> None:
+        if not item.bulk:
+            return
+        with self._cond:
+            self._bulk_pending -= 1
+        if item.done is not None:
+            try:
+                item.done(delivered)
+            except Exception as e:
+                logger.error(f"[Outbound] Delivery callback error: {e}")
+
+    def _finish(self, item: OutboundMessage, retry_in: Optional[float]) -> None:
+        chat_id = item.chat_id
+        with self._cond:
+            self._busy.discard(chat_id)
+            queue = self._queues.get(chat_id)
+            if retry_in is not None:
+                queue.appendleft(item)
+                self._size += 1
+            if queue:
+                self._schedule(chat_id, time.monotonic() + (retry_in or 0.0))
+            else:
+                del self._queues[chat_id]
+            self._cond.notify()
+
+    @staticmethod
+    def _retry_after(error: ApiTelegramException) -> int:
+        parameters = (getattr(error, 'result_json', None) or {}).get('parameters') or {}
+        return int(parameters.get('retry_after', 1))
@@ -1,9 +1,16 @@
 import json
 import logging
-from datetime import datetime
-from typing import Dict, Any, Optional, List, Union
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, List, Tuple, Union
+from psycopg2.extras import execute_values
 from service.config import MAX_LEVEL
+from service.level_progress import LevelProgress
+from service.state_store import WriteBehindStateStore
 from service.states import BotStates
+from service.user_snapshot import UserSnapshot
+from storage.migrator import REBUILD_REFERRAL_COUNTERS
 from storage.postgres_storage import PostgresStorage
 
 logger = logging.getLogger(__name__)
@@ -13,9 +20,22 @@ logger = logging.getLogger(__name__)
 # Базовый класс для всех репозиториев, содержащий общую логику:
 # Принимает экземпляр PostgresStorage для работы с базой данных
 # Предоставляет доступ к соединению через self.storage.connection().
+# add_change_listener(callback) - подписка на изменения данных пользователя
+# (callback(user_id, changes), changes=None означает, что новые значения неизвестны).
 class BaseRepository:
     def __init__(self, storage: PostgresStorage):
         self.storage = storage
+        self._change_listeners = []
+
+    def add_change_listener(self, callback) -> None:
+        self._change_listeners.append(callback)
+
+    def _notify_changed(self, user_id: int, changes: Optional[Dict[str, Any]]) -> None:
+        for callback in self._change_listeners:
+            try:
+                callback(user_id, changes)
+            except Exception as e:
+                logger.error(f"Change listener error for user {user_id}: {e}")
 
 
 # Класс UserRepository
@@ -27,7 +47,49 @@ class BaseRepository:
 # get_user_state(user_id) - получает текущее состояние пользователя
 # complete_registration(user_id) - отмечает регистрацию пользователя как завершенную
 # update_user_level(user_id, level) - обновляет текущий уровень пользователя
+# get_snapshot(user_id) - уровень, состояние и данные пользователя одним запросом (UserSnapshot)
+# Если передан state_store, set_user_state только запоминает состояние в памяти,
+# а чтения берут его оттуда, пока фоновый поток не запишет пакет в БД. Как и UPDATE,
+# он возвращает False для несуществующего пользователя: id, уже прочитанные из users
+# (get_user, get_snapshot, create_user), помнятся в KNOWN_USERS_LIMIT последних,
+# для остальных перед записью в буфер выполняется проверка SELECT 1.
 class UserRepository(BaseRepository):
+    KNOWN_USERS_LIMIT = 100000
+
+    def __init__(self, storage: PostgresStorage, state_store: Optional[WriteBehindStateStore] = None):
+        super().__init__(storage)
+        self.state_store = state_store
+        self._known_users: "OrderedDict[int, None]" = OrderedDict()
+        self._known_lock = threading.Lock()
+
+    def _remember_user(self, user_id: int) -> None:
+        if self.state_store is None:
+            return
+        with self._known_lock:
+            self._known_users[user_id] = None
+            self._known_users.move_to_end(user_id)
+            if len(self._known_users) > self.KNOWN_USERS_LIMIT:
+                self._known_users.popitem(last=False)
+
+    def _user_exists(self, user_id: int) -> bool:
+        with self._known_lock:
+            if user_id in self._known_users:
+                return True
+        with self.storage.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT 1 FROM users WHERE id = %s", (user_id,))
+                exists = cursor.fetchone() is not None
+            except Exception as e:
+                logger.error(f"Error checking user {user_id}: {e}")
+                return False
+        if exists:
+            self._remember_user(user_id)
+        return exists
+
+    def _buffered_state(self, user_id: int) -> Optional[int]:
+        return self.state_store.get(user_id) if self.state_store else None
+
     def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
         """Получить пользователя по ID"""
         with self.storage.connection() as conn:
@@ -40,12 +102,36 @@ class UserRepository(BaseRepository):
                 result = cursor.fetchone()
                 if result:
                     columns = [desc[0] for desc in cursor.description]
-                    return dict(zip(columns, result))
+                    user = dict(zip(columns, result))
+                    self._remember_user(user_id)
+                    buffered = self._buffered_state(user_id)
+                    if buffered is not None:
+                        user['current_state'] = buffered
+                    return user
                 return None
             except Exception as e:
                 logger.error(f"Error getting user {user_id}: {e}")
                 return None
 
+    def get_snapshot(self, user_id: int) -> Optional[UserSnapshot]:
+        """Получить уровень, состояние и данные пользователя одним запросом"""
+        with self.storage.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(UserSnapshot.QUERY, (user_id,))
+                row = cursor.fetchone()
+                if not row:
+                    return None
+                snapshot = UserSnapshot.from_row(row)
+                self._remember_user(user_id)
+                buffered = self._buffered_state(user_id)
+                if buffered is not None:
+                    snapshot.state = buffered
+                return snapshot
+            except Exception as e:
+                logger.error(f"Error getting snapshot for user {user_id}: {e}")
+                return None
+
     def create_user(self, user_id: int) -> bool:
         """Создать нового пользователя"""
         with self.storage.connection() as conn:
@@ -58,7 +144,11 @@ class UserRepository(BaseRepository):
                     (user_id,)
                 )
                 conn.commit()
-                return cursor.rowcount > 0
+                created = cursor.rowcount > 0
+                self._remember_user(user_id)
+                if created:
+                    self._notify_changed(user_id, None)
+                return created
             except Exception as e:
                 logger.error(f"Error creating user {user_id}: {e}")
                 conn.rollback()
@@ -66,6 +156,14 @@ class UserRepository(BaseRepository):
 
     def set_user_state(self, user_id: int, state: int) -> bool:
         """Установить состояние пользователя"""
+        if self.state_store is not None:
+            if not self._user_exists(user_id):
+                logger.warning(f"Not setting state for unknown user {user_id}")
+                return False
+            self.state_store.set(user_id, state)
+            self._notify_changed(user_id, {'state': state})
+            return True
+
         with self.storage.connection() as conn:
             cursor = conn.cursor()
             try:
@@ -75,14 +173,21 @@ class UserRepository(BaseRepository):
                     (state, user_id)
                 )
                 conn.commit()
-                return cursor.rowcount > 0
+                updated = cursor.rowcount > 0
+                self._notify_changed(user_id, {'state': state} if updated else None)
+                return updated
             except Exception as e:
                 logger.error(f"Error setting state for user {user_id}: {e}")
                 conn.rollback()
+                self._notify_changed(user_id, None)
                 return False
 
     def get_user_state(self, user_id: int) -> Optional[int]:
         """Получить текущее состояние пользователя"""
+        buffered = self._buffered_state(user_id)
+        if buffered is not None:
+            return buffered
+
         with self.storage.connection() as conn:
             cursor = conn.cursor()
             try:
@@ -99,6 +204,10 @@ class UserRepository(BaseRepository):
 
     def complete_registration(self, user_id: int) -> bool:
         """Завершение регистрации с обработкой рефералов"""
+        if self.state_store is not None:
+            # Состояние пишется этим запросом, отложенное значение не должно его перезаписать
+            self.state_store.discard(user_id)
+
         with self.storage.connection() as conn:
             cursor = conn.cursor()
             try:
@@ -148,6 +257,7 @@ class UserRepository(BaseRepository):
                     logger.info(f"Реферал обработан: {referrer_id}->{user_id} уровень {level}")
 
                 conn.commit()
+                self._notify_changed(user_id, {'state': BotStates.MAIN_MENU, 'registration_complete': True})
                 return True
 
             except Exception as e:
@@ -182,49 +292,75 @@ class UserRepository(BaseRepository):
                     (min(level, MAX_LEVEL), user_id)  # Гарантируем, что уровень не превысит MAX_LEVEL
                 )
                 conn.commit()
-                return cursor.rowcount > 0
+                updated = cursor.rowcount > 0
+                if updated:
+                    self._notify_changed(user_id, {'level': min(level, MAX_LEVEL)})
+                return updated
             except Exception as e:
                 logger.error(f"Error updating level for user {user_id}: {e}")
                 conn.rollback()
+                self._notify_changed(user_id, None)
                 return False
 
 
 # Класс UserDataRepository
 # Работает с дополнительными данными пользователей (user_data):
 # Основные методы:
-# save_user_data(user_id, **kwargs) - сохраняет или обновляет данные пользователя
+# save_user_data(user_id, **kwargs) - сохраняет или обновляет данные пользователя (один UPSERT)
 # get_user_data(user_id) - получает все дополнительные данные пользователя
-
+# set_viewed_level(user_id, level) - при coalesce_interval > 0 копит запись в памяти,
+#     и фоновый поток (start_flusher/stop_flusher) пишет последние значения одним запросом
+# pending_changes(user_id) - еще не записанные в БД значения (для чтения поверх БД)
 class UserDataRepository(BaseRepository):
+    COLUMNS = ('name', 'birthdate', 'location', 'language', 'viewed_level')
+
+    def __init__(self, storage: PostgresStorage, coalesce_interval: float = 0.0):
+        super().__init__(storage)
+        self.coalesce_interval = coalesce_interval
+        self._upsert_templates: Dict[Tuple[str, ...], str] = {}
+        self._pending_viewed: Dict[int, int] = {}
+        self._pending_lock = threading.Lock()
+        self._flusher_stop = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+
+    def _upsert_sql(self, columns: Tuple[str, ...]) -> str:
+        """Шаблон INSERT ... ON CONFLICT для набора колонок, строится один раз на набор"""
+        sql = self._upsert_templates.get(columns)
+        if sql is None:
+            sql = (
+                f"INSERT INTO user_data (user_id, {', '.join(columns)}) "
+                f"VALUES (%s{', %s' * len(columns)}) "
+                f"ON CONFLICT (user_id) DO UPDATE SET "
+                f"{', '.join(f'{column} = EXCLUDED.{column}' for column in columns)}"
+            )
+            self._upsert_templates[columns] = sql
+        return sql
+
     def save_user_data(self, user_id: int, **kwargs) -> bool:
         """Сохранить данные пользователя"""
+        unknown = [key for key in kwargs if key not in self.COLUMNS]
+        if unknown or not kwargs:
+            logger.error(f"Error saving user data for {user_id}: unknown columns {unknown}")
+            return False
+
+        columns = tuple(sorted(kwargs))
         with self.storage.connection() as conn:
             cursor = conn.cursor()
             try:
-                cursor.execute("SELECT 1 FROM user_data WHERE user_id = %s", (user_id,))
-                exists = cursor.fetchone()
-
-                if exists:
-                    set_clause = ", ".join([f"{k} = %s" for k in kwargs.keys()])
-                    values = list(kwargs.values()) + [user_id]
-                    cursor.execute(
-                        f"UPDATE user_data SET {set_clause} WHERE user_id = %s",
-                        values
-                    )
-                else:
-                    columns = ["user_id"] + list(kwargs.keys())
-                    placeholders = ["%s"] * len(columns)
-                    values = [user_id] + list(kwargs.values())
-                    cursor.execute(
-                        f"INSERT INTO user_data ({', '.join(columns)}) VALUES ({', '.join(placeholders)})",
-                        values
-                    )
-
+                cursor.execute(
+                    self._upsert_sql(columns),
+                    [user_id] + [kwargs[column] for column in columns]
+                )
                 conn.commit()
+                if 'viewed_level' in kwargs:
+                    with self._pending_lock:
+                        self._pending_viewed.pop(user_id, None)
+                self._notify_changed(user_id, dict(kwargs))
                 return True
             except Exception as e:
                 logger.error(f"Error saving user data for {user_id}: {e}")
                 conn.rollback()
+                self._notify_changed(user_id, None)
                 return False
 
     def get_user_data(self, user_id: int) -> Dict[str, Any]:
@@ -237,30 +373,133 @@ class UserDataRepository(BaseRepository):
                     (user_id,)
                 )
                 result = cursor.fetchone()
+                data = {}
                 if result:
                     columns = [desc[0] for desc in cursor.description]
-                    return dict(zip(columns, result))
-                return {}
+                    data = dict(zip(columns, result))
+                data.update(self.pending_changes(user_id))
+                return data
             except Exception as e:
                 logger.error(f"Error getting user data for {user_id}: {e}")
                 return {}
 
     def set_viewed_level(self, user_id: int, level: int) -> bool:
         """Устанавливает уровень, который пользователь сейчас просматривает"""
-        return self.save_user_data(user_id=user_id, viewed_level=level)
+        if self.coalesce_interval <= 0:
+            return self.save_user_data(user_id=user_id, viewed_level=level)
+
+        with self._pending_lock:
+            self._pending_viewed[user_id] = level
+        self._notify_changed(user_id, {'viewed_level': level})
+        return True
 
     def get_viewed_level(self, user_id: int) -> int:
         """Получает уровень, который пользователь сейчас просматривает"""
         data = self.get_user_data(user_id)
         return data.get('viewed_level', 1)
 
+    def pending_changes(self, user_id: int) -> Dict[str, Any]:
+        with self._pending_lock:
+            if user_id in self._pending_viewed:
+                return {'viewed_level': self._pending_viewed[user_id]}
+        return {}
+
+    def flush(self) -> int:
+        """Записывает накопленные viewed_level одним запросом, возвращает число строк"""
+        with self._pending_lock:
+            pending, self._pending_viewed = self._pending_viewed, {}
+        if not pending:
+            return 0
+
+        try:
+            with self.storage.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    execute_values(
+                        cursor,
+                        """INSERT INTO user_data (user_id, viewed_level) VALUES %s
+                        ON CONFLICT (user_id) DO UPDATE SET viewed_level = EXCLUDED.viewed_level""",
+                        list(pending.items())
+                    )
+                    conn.commit()
+                    return len(pending)
+                except Exception as e:
+                    logger.error(f"Error flushing viewed levels ({len(pending)} users), writing one by one: {e}")
+                    conn.rollback()
+
+                # Одна ошибочная строка не должна блокировать запись остальных
+                written = 0
+                for user_id, level in pending.items():
+                    try:
+                        cursor.execute(self._upsert_sql(('viewed_level',)), (user_id, level))
+                        conn.commit()
+                        written += 1
+                    except Exception as e:
+                        logger.error(f"Error saving viewed level for {user_id}: {e}")
+                        conn.rollback()
+                return written
+        except Exception as e:
+            # Соединение не получено (пул занят или закрыт): значения вернутся в очередь,
+            # более свежие, пришедшие за это время, не затираются
+            with self._pending_lock:
+                for user_id, level in pending.items():
+                    self._pending_viewed.setdefault(user_id, level)
+            logger.error(f"Error flushing viewed levels ({len(pending)} users), will retry: {e}")
+            return 0
+
+    def start_flusher(self) -> None:
+        if self.coalesce_interval <= 0 or self._flusher is not None:
+            return
+        self._flusher_stop.clear()
+        self._flusher = threading.Thread(target=self._flush_loop, name="UserDataFlusher", daemon=True)
+        self._flusher.start()
+
+    def stop_flusher(self) -> None:
+        """Останавливает фоновую запись и сбрасывает остаток в БД"""
+        if self._flusher is not None:
+            self._flusher_stop.set()
+            self._flusher.join(timeout=self.coalesce_interval + 5)
+            self._flusher = None
+        self.flush()
+
+    def _flush_loop(self) -> None:
+        while not self._flusher_stop.wait(self.coalesce_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"User data flusher error: {e}")
+
 
 # Класс LevelRepository
 # Работает с уровнями (levels):
 # Основные методы:
 # get_level_content(level_number) - получает контент для указанного уровня
 # get_level_rules(level_number) - получает правила для указанного уровня
+# get_level(level_number) - получает контент и правила одним запросом
+# get_all_levels() - загружает все уровни (для LevelCatalog)
 class LevelRepository(BaseRepository):
+    def get_level(self, level_number: int) -> Optional[Tuple[str, Optional[str]]]:
+        """Получить контент и правила уровня одним запросом"""
+        with self.storage.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    "SELECT content, rules FROM levels WHERE level_number = %s",
+                    (level_number,)
+                )
+                result = cursor.fetchone()
+                return (result[0], result[1]) if result else None
+            except Exception as e:
+                logger.error(f"Error getting level {level_number}: {e}")
+                return None
+
+    def get_all_levels(self) -> Dict[int, Tuple[str, Optional[str]]]:
+        """Получить все уровни: {номер: (контент, правила)}"""
+        with self.storage.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT level_number, content, rules FROM levels ORDER BY level_number")
+            return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
     def get_level_content(self, level_number: int) -> Optional[str]:
         """Получить контент для указанного уровня"""
         with self.storage.connection() as conn:
@@ -299,6 +538,9 @@ class LevelRepository(BaseRepository):
 # get_active_time_task(user_id, level) - получает активное задание на время
 # complete_task(user_id, level, task_type) - отмечает задание как выполненное
 # is_task_completed(user_id, level, task_type) - проверяет выполнение задания
+# get_level_progress(user_id, level) - все задания, рефералы и донат уровня одним запросом
+# get_pending_time_tasks(after, until) - незавершенные задания на время, истекающие в интервале
+# claim_time_task_expiry(user_id, level, now) - отметить отправку уведомления об окончании задания
 #
 class TaskRepository(BaseRepository):
     def create_task(self, user_id: int, level: int, task_type: str,
@@ -375,6 +617,56 @@ class TaskRepository(BaseRepository):
                 logger.error(f"Error getting active time task for user {user_id}: {e}")
                 return None
 
+    def get_level_progress(self, user_id: int, level: int) -> Optional[LevelProgress]:
+        """Получить прогресс по всем заданиям уровня одним запросом"""
+        with self.storage.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(LevelProgress.QUERY, (user_id, level))
+                return LevelProgress.from_row(cursor.fetchone())
+            except Exception as e:
+                logger.error(f"Error getting level progress for user {user_id}: {e}")
+                return None
+
+    def get_pending_time_tasks(self, after: Optional[datetime],
+                               until: datetime) -> List[Tuple[datetime, int, int]]:
+        """(end_time, user_id, level) заданий на время без уведомления, истекающих в (after, until]"""
+        query = """SELECT end_time, user_id, level FROM tasks
+                WHERE task_type = 'time' AND completed = FALSE
+                AND expiry_notified_at IS NULL AND end_time <= %s"""
+        params: List[Any] = [until]
+        if after is not None:
+            query += " AND end_time > %s"
+            params.append(after)
+
+        with self.storage.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(query + " ORDER BY end_time", params)
+                return cursor.fetchall()
+            except Exception as e:
+                logger.error(f"Error loading pending time tasks: {e}")
+                return []
+
+    def claim_time_task_expiry(self, user_id: int, level: int, now: datetime) -> bool:
+        """Отметить уведомление об окончании задания; False - уже отмечено или задание не истекло"""
+        with self.storage.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    """UPDATE tasks SET expiry_notified_at = NOW()
+                    WHERE user_id = %s AND level = %s AND task_type = 'time'
+                    AND completed = FALSE AND expiry_notified_at IS NULL
+                    AND end_time <= %s""",
+                    (user_id, level, now)
+                )
+                conn.commit()
+                return cursor.rowcount > 0
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Error claiming time task expiry: {e}")
+                return False
+
     def complete_donation_task(self, user_id: int, donation_level: int) -> bool:
         """Отметить донатное задание как выполненное для текущего уровня"""
         with self.storage.connection() as conn:
@@ -478,7 +770,14 @@ def is_task_completed_for_level(self, user_id: int, level: int) -> bool:
 # Основные методы:
 # create_referral(referrer_id, referee_id) - создает реферальную связь
 # get_referral_status(user_id, level) - получает статус рефералов пользователя
+# rebuild_counters() - пересчитывает referral_counters с нуля
+# Количество рефералов читается из referral_counters, которые ведут триггеры БД (миграция 5).
 class ReferralRepository(BaseRepository):
+    COUNTERS_SQL = """
+        SELECT total, completed FROM referral_counters
+        WHERE referrer_id = %s AND level = %s
+    """
+
     def create_referral(self, referrer_id: int, referee_id: int, level: int) -> bool:
         """Создание реферальной связи с гарантированной записью"""
         try:
@@ -521,18 +820,13 @@ class ReferralRepository(BaseRepository):
             return False
 
     def get_completed_referrals_count(self, referrer_id: int, level: int) -> int:
-        """Новый метод: Получить количество завершенных рефералов для уровня"""
+        """Получить количество завершенных рефералов для уровня"""
         with self.storage.connection() as conn:
             cursor = conn.cursor()
             try:
-                cursor.execute("""
-                    SELECT COUNT(*) FROM referrals r
-                    JOIN users u ON r.referee_id = u.id
-                    WHERE r.referrer_id = %s 
-                    AND r.level = %s
-                    AND u.registration_complete = TRUE
-                """, (referrer_id, level))
-                return cursor.fetchone()[0]
+                cursor.execute(self.COUNTERS_SQL, (referrer_id, level))
+                row = cursor.fetchone()
+                return row[1] if row else 0
             except Exception as e:
                 logger.error(f"Ошибка подсчета рефералов: {str(e)}")
                 return 0
@@ -575,17 +869,12 @@ class ReferralRepository(BaseRepository):
                 return False
 
     def get_referral_status(self, user_id: int, level: int) -> dict:
-        """Получить статус рефералов с использованием нового метода"""
+        """Получить статус рефералов одним запросом к referral_counters"""
         try:
-            completed = self.get_completed_referrals_count(user_id, level)
-
             with self.storage.connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute("""
-                    SELECT COUNT(*) FROM referrals
-                    WHERE referrer_id = %s AND level = %s
-                """, (user_id, level))
-                total = cursor.fetchone()[0]
+                cursor.execute(self.COUNTERS_SQL, (user_id, level))
+                total, completed = cursor.fetchone() or (0, 0)
 
             return {
                 'total_referrals': total,
@@ -603,6 +892,22 @@ class ReferralRepository(BaseRepository):
                 'error': str(e)
             }
 
+    def rebuild_counters(self) -> Optional[int]:
+        """Пересчитать referral_counters по referrals и users, вернуть число строк счетчиков"""
+        with self.storage.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(REBUILD_REFERRAL_COUNTERS)
+                cursor.execute("SELECT COUNT(*) FROM referral_counters")
+                rows = cursor.fetchone()[0]
+                conn.commit()
+                logger.info(f"[Referrals] Counters rebuilt: {rows} rows")
+                return rows
+            except Exception as e:
+                conn.rollback()
+                logger.error(f"Ошибка пересчета счетчиков рефералов: {str(e)}", exc_info=True)
+                return None
+
 # Класс DonationRepository
 # Работает с донатами (donations):
 # Константы статусов:
@@ -613,11 +918,14 @@ class ReferralRepository(BaseRepository):
 #
 # Основные методы:
 #     create_donation(user_id, level, amount, currency, status, payment_id) - создает запись о донате
+#     get_reusable_payment(user_id, level, amount, max_age) - неоплаченный платеж со ссылкой на оплату
+#     count_pending_payments(user_id, max_age) - число неоплаченных платежей пользователя
 #     get_last_donation(user_id, level) - получает последний донат пользователя
 #     update_donation_status(donation_id, status, payment_id) - обновляет статус доната
 #     get_donation_by_payment_id- ищет донаты по payment_id для корректного обновления
-#     get_pending_payments-получение необработанных платежей
-#     get_charity_donations-получение всеx благотворительные пожертвования пользователя"""
+#     get_pending_payments-получение необработанных платежей (с ограничением по возрасту)
+#     get_charity_donations-получение всеx благотворительные пожертвования пользователя
+#     claim_donation-атомарная отметка об обработке (защита от повторного зачисления)"""
 class DonationRepository(BaseRepository):
     STATUS_PENDING = 'pending'
     STATUS_WAITING_FOR_CAPTURE = 'waiting_for_capture'
@@ -625,16 +933,19 @@ class DonationRepository(BaseRepository):
     STATUS_CANCELED = 'canceled'
 
     def create_donation(self, user_id: int, for_level: int, amount: float,
-                        currency: str, status: str, payment_id: str = None) -> bool:
+                        currency: str, status: str, payment_id: str = None,
+                        confirmation_url: str = None, idempotence_key: str = None) -> bool:
         """Создать запись о донате для перехода на указанный уровень"""
         with self.storage.connection() as conn:
             cursor = conn.cursor()
             try:
                 cursor.execute(
                     """INSERT INTO donations 
-                    (user_id, level, amount, currency, status, donation_date, payment_id) 
-                    VALUES (%s, %s, %s, %s, %s, NOW(), %s)""",
-                    (user_id, for_level, amount, currency, status, payment_id)
+                    (user_id, level, amount, currency, status, donation_date, payment_id,
+                     confirmation_url, idempotence_key) 
+                    VALUES (%s, %s, %s, %s, %s, NOW(), %s, %s, %s)""",
+                    (user_id, for_level, amount, currency, status, payment_id,
+                     confirmation_url, idempotence_key)
                 )
                 conn.commit()
                 return cursor.rowcount > 0
@@ -643,6 +954,49 @@ class DonationRepository(BaseRepository):
                 conn.rollback()
                 return False
 
+    def get_reusable_payment(self, user_id: int, level: int, amount: float,
+                             max_age: timedelta) -> Optional[dict]:
+        """
+        Последний неоплаченный платеж пользователя для уровня на ту же сумму,
+        созданный не раньше max_age назад и со ссылкой на оплату
+        """
+        with self.storage.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    """SELECT id, payment_id, confirmation_url, donation_date FROM donations
+                    WHERE user_id = %s AND level = %s AND amount = %s
+                    AND status = 'pending' AND processed IS NOT TRUE
+                    AND payment_id IS NOT NULL AND confirmation_url IS NOT NULL
+                    AND donation_date > NOW() - %s
+                    ORDER BY donation_date DESC LIMIT 1""",
+                    (user_id, level, amount, max_age)
+                )
+                result = cursor.fetchone()
+                if result:
+                    columns = [desc[0] for desc in cursor.description]
+                    return dict(zip(columns, result))
+                return None
+            except Exception as e:
+                logger.error(f"Ошибка при поиске неоплаченного платежа пользователя {user_id}: {e}")
+                return None
+
+    def count_pending_payments(self, user_id: int, max_age: timedelta) -> int:
+        """Число неоплаченных платежей пользователя не старше max_age (их проверяет сверка)"""
+        with self.storage.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    """SELECT COUNT(*) FROM donations
+                    WHERE user_id = %s AND status = 'pending' AND processed IS NOT TRUE
+                    AND donation_date > NOW() - %s""",
+                    (user_id, max_age)
+                )
+                return cursor.fetchone()[0]
+            except Exception as e:
+                logger.error(f"Ошибка при подсчете платежей пользователя {user_id}: {e}")
+                return 0
+
     def has_level_records(self, user_id: int, level: int) -> bool:
         """Проверяет, есть ли записи для указанного уровня"""
         with self.storage.connection() as conn:
@@ -786,16 +1140,25 @@ class DonationRepository(BaseRepository):
                     return dict(zip(columns, result))
                 return None
 
-    def get_pending_payments(self) -> list[dict]:
-        """Возвращает список платежей со статусом 'pending'."""
+    def get_pending_payments(self, max_age: Optional[timedelta] = None) -> list[dict]:
+        """
+        Возвращает необработанные платежи со статусом 'pending'.
+        max_age - не возвращать платежи старше указанного возраста (брошенные)
+        """
         with self.storage.connection() as conn:
             cursor = conn.cursor()
             try:
-                cursor.execute("""
-                    SELECT id, user_id, level, payment_id 
+                query = """
+                    SELECT id, user_id, level, payment_id, donation_date 
                     FROM donations 
                     WHERE status = 'pending'
-                """)
+                    AND processed IS NOT TRUE
+                    AND payment_id IS NOT NULL"""
+                params = []
+                if max_age is not None:
+                    query += " AND donation_date > NOW() - %s"
+                    params.append(max_age)
+                cursor.execute(query + " ORDER BY donation_date", params)
                 columns = [desc[0] for desc in cursor.description]
                 return [dict(zip(columns, row)) for row in cursor.fetchall()]
             except Exception as e:
@@ -817,6 +1180,27 @@ class DonationRepository(BaseRepository):
                 logger.error(f"Error checking donation processed status: {e}")
                 return False
 
+    def claim_donation(self, donation_id: int) -> bool:
+        """
+        Атомарно помечает донат как обработанный.
+        Возвращает True только одному из конкурирующих обработчиков
+        (webhook, фоновая сверка, кнопка 'Проверить статус').
+        """
+        with self.storage.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    """UPDATE donations SET processed = TRUE 
+                    WHERE id = %s AND processed IS NOT TRUE""",
+                    (donation_id,)
+                )
+                conn.commit()
+                return cursor.rowcount > 0
+            except Exception as e:
+                logger.error(f"Error claiming donation {donation_id}: {e}")
+                conn.rollback()
+                return False
+
     def mark_as_processed(self, donation_id: int) -> bool:
         """Пометить донат как обработанный"""
         with self.storage.connection() as conn:
@@ -845,3 +1229,62 @@ class DonationRepository(BaseRepository):
                 )
                 columns = [desc[0] for desc in cursor.description]
                 return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+# Класс MediaCacheRepository
+# Хранит file_id загруженных в Telegram файлов (telegram_file_cache):
+# Основные методы:
+# get_file_id(path, content_hash) - получает сохраненный file_id
+# save_file_id(path, content_hash, file_id) - сохраняет или обновляет file_id
+# delete_file_id(path, content_hash) - удаляет file_id, который Telegram больше не принимает
+class MediaCacheRepository(BaseRepository):
+    def get_file_id(self, path: str, content_hash: str) -> Optional[str]:
+        """Получить file_id для файла с указанным содержимым"""
+        with self.storage.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    """SELECT file_id FROM telegram_file_cache 
+                    WHERE path = %s AND content_hash = %s""",
+                    (path, content_hash)
+                )
+                result = cursor.fetchone()
+                return result[0] if result else None
+            except Exception as e:
+                logger.error(f"Error getting file_id for {path}: {e}")
+                return None
+
+    def save_file_id(self, path: str, content_hash: str, file_id: str) -> bool:
+        """Сохранить file_id для файла"""
+        with self.storage.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    """INSERT INTO telegram_file_cache (path, content_hash, file_id) 
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (path, content_hash) 
+                    DO UPDATE SET file_id = EXCLUDED.file_id, created_at = NOW()""",
+                    (path, content_hash, file_id)
+                )
+                conn.commit()
+                return cursor.rowcount > 0
+            except Exception as e:
+                logger.error(f"Error saving file_id for {path}: {e}")
+                conn.rollback()
+                return False
+
+    def delete_file_id(self, path: str, content_hash: str) -> bool:
+        """Удалить file_id для файла"""
+        with self.storage.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    "DELETE FROM telegram_file_cache WHERE path = %s AND content_hash = %s",
+                    (path, content_hash)
+                )
+                conn.commit()
+                return cursor.rowcount > 0
+            except Exception as e:
+                logger.error(f"Error deleting file_id for {path}: {e}")
+                conn.rollback()
+                return False
@@ -0,0 +1,263 @@
+import logging
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ANY_STATE = object()
+
+
+class Rule:
+    __slots__ = ('handler', 'priority', 'states', 'contains', 'prefix', 'func')
+
+    def __init__(self, handler, priority, states=None, contains=None, prefix=None, func=None):
+        self.handler = handler
+        self.priority = priority
+        self.states = states
+        self.contains = contains
+        self.prefix = prefix
+        self.func = func
+
+    def matches_fallback(self, text: str, state_getter: Callable[[], Optional[int]]) -> bool:
+        if self.contains is not None and self.contains not in text:
+            return False
+        if self.prefix is not None and not text.startswith(self.prefix):
+            return False
+        if self.states is not None and state_getter() not in self.states:
+            return False
+        return True
+
+
+# Класс Router
+# Маршрутизатор текстовых сообщений вместо цепочки фильтров telebot:
+#     message_handler(...) - декоратор регистрации обработчика (аналог bot.message_handler)
+#     dispatch(message) - выбирает обработчик и вызывает его
+# Точные совпадения (состояние, текст) и обработчики "любой текст в состоянии" хранятся
+# в словарях, поэтому их поиск не зависит от числа кнопок и уровней. Правила с contains,
+# prefix и func проверяются по порядку, но только пока их приоритет выше уже найденного.
+# Как и в telebot, при нескольких подходящих правилах побеждает зарегистрированное раньше.
+# Состояние пользователя запрашивается лениво - только если от него зависит выбор.
+class Router:
+    def __init__(self, state_getter: Callable):
+        self.state_getter = state_getter
+        self._exact: Dict[Tuple[object, str], Rule] = {}
+        self._stripped: Dict[Tuple[object, str], Rule] = {}
+        self._state_any_text: Dict[int, Rule] = {}
+        self._fallbacks: List[Rule] = []
+        self._min_state_priority = None
+        self._count = 0
+
+    def message_handler(self, text: Optional[str] = None, texts: Optional[Iterable[str]] = None,
+                        states=None, contains: Optional[str] = None, prefix: Optional[str] = None,
+                        func: Optional[Callable] = None, strip: bool = False):
+        """
+        Регистрирует обработчик.
+
+        Args:
+            text/texts: точный текст кнопки (или несколько вариантов)
+            states: состояние BotStates или список состояний; None - любое
+            contains/prefix: правило-подстрока для текстов вида "5 уровень"
+            func: произвольный предикат, проверяется последним
+            strip: сравнивать текст без пробелов по краям
+        """
+        def decorator(handler):
+            self.add_rule(handler, text=text, texts=texts, states=states,
+                          contains=contains, prefix=prefix, func=func, strip=strip)
+            return handler
+
+        return decorator
+
+    def add_rule(self, handler, text=None, texts=None, states=None,
+                 contains=None, prefix=None, func=None, strip=False) -> None:
+        priority = self._count
+        self._count += 1
+
+        if states is not None and not isinstance(states, (list, tuple, set, frozenset)):
+            states = (states,)
+        state_set = frozenset(states) if states is not None else None
+        if state_set is not None:
+            if self._min_state_priority is None:
+                self._min_state_priority = priority
+
+        all_texts = list(texts or [])
+        if text is not None:
+            all_texts.append(text)
+
+        if all_texts and contains is None and prefix is None and func is None:
+            table = self._stripped if strip else self._exact
+            keys = state_set if state_set is not None else (ANY_STATE,)
+            rule = Rule(handler, priority, state_set)
+            for value in all_texts:
+                value = value.strip() if strip else value
+                for key in keys:
+                    table.setdefault((key, value), rule)
+            return
+
+        if not all_texts and state_set is not None and contains is None and prefix is None and func is None:
+            rule = Rule(handler, priority, state_set)
+            for state in state_set:
+                self._state_any_text.setdefault(state, rule)
+            return
+
+        if all_texts:
+            expected = frozenset(t.strip() if strip else t for t in all_texts)
+            base_func = func
+
+            def func(message, _expected=expected, _base=base_func):
+                value = message.text.strip() if strip else message.text
+                return value in _expected and (_base is None or _base(message))
+
+        self._fallbacks.append(Rule(handler, priority, state_set, contains, prefix, func))
+
+    def resolve(self, message) -> Optional[Callable]:
+        """Находит обработчик для сообщения, не вызывая его"""
+        text = message.text
+        if text is None:
+            return None
+        stripped = text.strip()
+
+        best = self._better(None, self._exact.get((ANY_STATE, text)))
+        best = self._better(best, self._stripped.get((ANY_STATE, stripped)))
+
+        state_loaded = False
+        state = None
+
+        def get_state():
+            nonlocal state_loaded, state
+            if not state_loaded:
+                state = self.state_getter(message)
+                state_loaded = True
+            return state
+
+        if self._min_state_priority is not None and (best is None or self._min_state_priority < best.priority):
+            current = get_state()
+            best = self._better(best, self._exact.get((current, text)))
+            best = self._better(best, self._stripped.get((current, stripped)))
+            best = self._better(best, self._state_any_text.get(current))
+
+        for rule in self._fallbacks:
+            if best is not None and rule.priority > best.priority:
+                break
+            if not rule.matches_fallback(text, get_state):
+                continue
+            if rule.func is not None and not rule.func(message):
+                continue
+            best = rule
+            break
+
+        return best.handler if best is not None else None
+
+    def dispatch(self, message) -> bool:
+        handler = self.resolve(message)
+        if handler is None:
+            logger.warning(f"[Router] No handler for message {message.text!r}")
+            return False
+        handler(message)
+        return True
+
+    @staticmethod
+    def _better(current: Optional[Rule], candidate: Optional[Rule]) -> Optional[Rule]:
+        if candidate is None:
+            return current
+        if current is None or candidate.priority < current.priority:
+            return candidate
+        return current
+
+
+def _benchmark(iterations: int = 20000) -> None:
+    """
+    Сравнение с цепочкой фильтров telebot: тот же набор правил, что в main.py,
+    плюс N дополнительных кнопок, чтобы увидеть рост стоимости маршрутизации.
+    Обращение к состоянию имитируется счетчиком, как запрос к БД без кэша.
+    """
+    import time
+    from types import SimpleNamespace
+    from service.states import BotStates
+
+    base_rules = [
+        ("Далее", None),
+        ("Ссылка на сообщество", BotStates.FINAL_LEVEL),
+        ("Правила игры для уровня игры:3-21", BotStates.LEVEL_CONTENT),
+        (None, BotStates.LANGUAGE_SELECTION),
+        ("О боте", BotStates.MAIN_MENU),
+        ("Правила игры", BotStates.MAIN_MENU),
+        ("Принять", BotStates.MAIN_MENU),
+        (None, BotStates.REGISTRATION_NAME),
+        (None, BotStates.REGISTRATION_BIRTHDATE),
+        (None, BotStates.REGISTRATION_LOCATION),
+        ("Начать игру", BotStates.MAIN_MENU),
+        ("Ответы на вопросы", BotStates.LEVEL_CONTENT),
+        ("Далее, перейти к следующему уровню.", BotStates.LEVEL_CONTENT),
+        ("Время", BotStates.TASK_SELECTION),
+        ("Начать задание", BotStates.TIME_TASK),
+        ("Задание выполнено", BotStates.TIME_TASK),
+        ("Пригласи друга", BotStates.TASK_SELECTION),
+        ("Проверить статус задания", None),
+        ("Донат", BotStates.TASK_SELECTION),
+        ("Проверить статус", BotStates.DONATION_TASK),
+        ("Следующий уровень", BotStates.LEVEL_CONTENT),
+        ("Назад", None),
+    ]
+
+    def build(extra_buttons: int):
+        rules = base_rules + [(f"Кнопка {i}", BotStates.LEVEL_CONTENT) for i in range(extra_buttons)]
+        lookups = {'count': 0}
+        states = {1: BotStates.LEVEL_CONTENT}
+
+        def get_state(message):
+            lookups['count'] += 1
+            return states[message.from_user.id]
+
+        chain = []
+        router = Router(state_getter=get_state)
+        for text, state in rules:
+            handler = (lambda m: None)
+            if text is None:
+                chain.append((lambda m, s=state: get_state(m) == s, handler))
+            elif state is None:
+                chain.append((lambda m, t=text: m.text == t, handler))
+            else:
+                chain.append((lambda m, t=text, s=state: m.text == t and get_state(m) == s, handler))
+            router.add_rule(handler, text=text, states=state)
+
+        contains_rule = lambda m: "уровень" in m.text and get_state(m) == BotStates.LEVEL_CONTENT
+        chain.append((contains_rule, lambda m: None))
+        router.add_rule(lambda m: None, contains="уровень", states=BotStates.LEVEL_CONTENT)
+        chain.append((lambda m: True, lambda m: None))
+        router.add_rule(lambda m: None, func=lambda m: True)
+        return chain, router, lookups
+
+    def linear_dispatch(chain, message):
+        for predicate, handler in chain:
+            if predicate(message):
+                return handler(message)
+
+    messages = [SimpleNamespace(text=text, from_user=SimpleNamespace(id=1))
+                for text in ("Далее", "Следующий уровень", "5 уровень", "произвольный текст")]
+
+    print(f"{'правил':>8} {'цепочка, мкс':>14} {'роутер, мкс':>13} {'состояний/сообщ. (цепочка/роутер)':>36}")
+    for extra in (0, 100, 1000):
+        chain, router, lookups = build(extra)
+
+        lookups['count'] = 0
+        started = time.perf_counter()
+        for _ in range(iterations):
+            for message in messages:
+                linear_dispatch(chain, message)
+        chain_time = time.perf_counter() - started
+        chain_lookups = lookups['count']
+
+        lookups['count'] = 0
+        started = time.perf_counter()
+        for _ in range(iterations):
+            for message in messages:
+                router.dispatch(message)
+        router_time = time.perf_counter() - started
+        router_lookups = lookups['count']
+
+        total = iterations * len(messages)
+        print(f"{len(chain):>8} {chain_time / total * 1e6:>14.2f} {router_time / total * 1e6:>13.2f} "
+              f"{chain_lookups / total:>17.2f} / {router_lookups / total:.2f}")
+
+
+if __name__ == "__main__":
+    _benchmark()
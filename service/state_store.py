@@ -0,0 +1,134 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from psycopg2.extras import execute_values
+
+from storage.postgres_storage import PostgresStorage
+
+logger = logging.getLogger(__name__)
+
+
+# Класс WriteBehindStateStore
+# Отложенная запись состояний пользователей (users.current_state):
+#     set(user_id, state) - запоминает состояние в памяти, в БД ничего не пишет
+#     get(user_id) - состояние, еще не записанное в БД, или None
+#     discard(user_id) - забывает состояние перед тем, как его запишут в БД другим запросом;
+#         дожидается идущей записи пакета, чтобы старое значение не легло поверх нового
+#     flush() - пишет все накопленные состояния одним UPDATE ... FROM (VALUES ...)
+#     start() / stop() - фоновая запись раз в window секунд; stop дописывает остаток
+# window - окно надежности: столько секунд последнее состояние может жить только в памяти
+# и потеряется при падении процесса. Если накопилось max_dirty состояний, запись
+# начинается раньше. Буфер свой у каждого процесса: другой процесс увидит состояние
+# только после записи, поэтому по умолчанию отложенная запись выключена
+# (STATE_WRITE_BEHIND_WINDOW=0) и включается только для бота из одного процесса.
+class WriteBehindStateStore:
+    FLUSH_SQL = """
+        UPDATE users AS u SET current_state = v.state
+        FROM (VALUES %s) AS v(id, state)
+        WHERE u.id = v.id
+    """
+
+    def __init__(self, storage: PostgresStorage, window: float = 1.0, max_dirty: int = 1000):
+        self.storage = storage
+        self.window = window
+        self.max_dirty = max_dirty
+        self._dirty: Dict[int, int] = {}
+        # Пакет, который сейчас пишется в БД: до коммита читать состояние нужно отсюда
+        self._in_flight: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {'sets': 0, 'flushes': 0, 'flushed_rows': 0, 'errors': 0, 'last_flush_duration': 0.0}
+
+    def set(self, user_id: int, state: int) -> None:
+        with self._lock:
+            self._dirty[user_id] = state
+            self._stats['sets'] += 1
+            overflow = len(self._dirty) >= self.max_dirty
+        if overflow:
+            self._wakeup.set()
+
+    def get(self, user_id: int) -> Optional[int]:
+        with self._lock:
+            state = self._dirty.get(user_id)
+            return state if state is not None else self._in_flight.get(user_id)
+
+    def discard(self, user_id: int) -> None:
+        with self._flush_lock, self._lock:
+            self._dirty.pop(user_id, None)
+
+    def flush(self) -> int:
+        """Записывает накопленные состояния, возвращает число строк в пакете"""
+        with self._flush_lock:
+            return self._flush_batch()
+
+    def _flush_batch(self) -> int:
+        with self._lock:
+            batch, self._dirty = self._dirty, {}
+            self._in_flight = batch
+        if not batch:
+            return 0
+
+        started = time.monotonic()
+        try:
+            with self.storage.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    execute_values(cursor, self.FLUSH_SQL, list(batch.items()), page_size=len(batch))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+        except Exception as e:
+            # Ошибка записи или получения соединения из пула: пакет возвращается в _dirty
+            with self._lock:
+                # Более свежие состояния, пришедшие во время записи, не затираем
+                for user_id, state in batch.items():
+                    self._dirty.setdefault(user_id, state)
+                self._in_flight = {}
+                self._stats['errors'] += 1
+            logger.error(f"[State Store] Error flushing {len(batch)} states: {e}")
+            return 0
+
+        with self._lock:
+            self._in_flight = {}
+            self._stats['flushes'] += 1
+            self._stats['flushed_rows'] += len(batch)
+            self._stats['last_flush_duration'] = round(time.monotonic() - started, 4)
+        return len(batch)
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._flush_loop, name="StateFlusher", daemon=True)
+        self._thread.start()
+        logger.info(f"[State Store] Write-behind enabled, window {self.window}s")
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._wakeup.set()
+            self._thread.join(timeout=self.window + 5)
+            self._thread = None
+        flushed = self.flush()
+        logger.info(f"[State Store] Stopped, flushed {flushed} states on shutdown")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['dirty'] = len(self._dirty)
+        return stats
+
+    def _flush_loop(self) -> None:
+        while not self._stop.is_set():
+            self._wakeup.wait(self.window)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"[State Store] Flusher error: {e}")
@@ -0,0 +1,111 @@
+import heapq
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from service.repository import TaskRepository
+
+logger = logging.getLogger(__name__)
+
+
+# Класс TimeTaskScheduler
+# Уведомляет пользователя, когда истекает его задание на время:
+#     add(user_id, level, end_time) - запланировать только что начатое задание
+#     run_forever(stop_event) - цикл фонового потока
+#     get_stats() - размер кучи, уведомления, время следующего срабатывания
+# В памяти (куча по end_time) держатся только задания, истекающие в ближайшие lookahead
+# секунд. Раз в reload_interval догружаются следующие - только диапазон end_time после
+# уже загруженного (частичный индекс idx_tasks_time_pending), без повторного чтения таблицы.
+# При старте загружаются и просроченные задания, но не старше max_overdue: давно
+# брошенные задания не будят пользователя. Перед уведомлением задание отмечается
+# в БД (claim_time_task_expiry), поэтому при нескольких экземплярах бота и повторной
+# загрузке уведомление уходит один раз.
+class TimeTaskScheduler:
+    def __init__(self, task_repo: TaskRepository, notify: Callable[[int, int], None],
+                 lookahead: float = 3600.0, reload_interval: float = 300.0, max_overdue: float = 2 * 86400.0):
+        self.task_repo = task_repo
+        self.notify = notify
+        self.lookahead = timedelta(seconds=max(lookahead, reload_interval))
+        self.reload_interval = timedelta(seconds=reload_interval)
+        self.max_overdue = timedelta(seconds=max_overdue)
+        self._heap: List[Tuple[datetime, int, int]] = []
+        self._loaded_until: Optional[datetime] = None
+        self._next_reload = datetime.min
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stats = {'loaded': 0, 'notified': 0, 'skipped': 0, 'errors': 0}
+
+    def add(self, user_id: int, level: int, end_time: datetime) -> None:
+        """Задание, истекающее в пределах lookahead, сразу попадает в кучу (дубликат
+        из догрузки безопасен - уведомление отмечается в БД один раз)"""
+        if end_time > datetime.now() + self.lookahead:
+            return  # будет загружено из БД при одной из следующих догрузок
+        with self._lock:
+            heapq.heappush(self._heap, (end_time, user_id, level))
+        self._wakeup.set()
+
+    def run_forever(self, stop_event: threading.Event) -> None:
+        while not stop_event.is_set():
+            now = datetime.now()
+            try:
+                if now >= self._next_reload:
+                    self._reload(now)
+                for user_id, level in self._pop_due(now):
+                    self._fire(user_id, level, now)
+            except Exception as e:
+                self._stats['errors'] += 1
+                logger.error(f"[Time Tasks] Scheduler error: {e}", exc_info=True)
+
+            self._wakeup.wait(self._seconds_to_next_event())
+            self._wakeup.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['scheduled'] = len(self._heap)
+            stats['next_expiry'] = self._heap[0][0] if self._heap else None
+            stats['loaded_until'] = self._loaded_until
+        return stats
+
+    def _reload(self, now: datetime) -> None:
+        until = now + self.lookahead
+        with self._lock:
+            after = self._loaded_until if self._loaded_until is not None else now - self.max_overdue
+        tasks = self.task_repo.get_pending_time_tasks(after, until)
+        with self._lock:
+            for task in tasks:
+                heapq.heappush(self._heap, task)
+            self._loaded_until = until
+            self._stats['loaded'] += len(tasks)
+        self._next_reload = now + self.reload_interval
+        if tasks:
+            logger.info(f"[Time Tasks] Loaded {len(tasks)} tasks expiring until {until:%d.%m %H:%M}")
+
+    def _pop_due(self, now: datetime) -> List[Tuple[int, int]]:
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, user_id, level = heapq.heappop(self._heap)
+                due.append((user_id, level))
+        return due
+
+    def _fire(self, user_id: int, level: int, now: datetime) -> None:
+        # Задание могли выполнить или уже уведомить (другой экземпляр, повторная загрузка)
+        if not self.task_repo.claim_time_task_expiry(user_id, level, now):
+            self._stats['skipped'] += 1
+            return
+        try:
+            self.notify(user_id, level)
+            self._stats['notified'] += 1
+        except Exception as e:
+            self._stats['errors'] += 1
+            logger.error(f"[Time Tasks] Error notifying user {user_id}: {e}")
+
+    def _seconds_to_next_event(self) -> float:
+        now = datetime.now()
+        next_event = self._next_reload
+        with self._lock:
+            if self._heap and self._heap[0][0] < next_event:
+                next_event = self._heap[0][0]
+        return min(max((next_event - now).total_seconds(), 0.05), 60.0)
@@ -0,0 +1,109 @@
+import hmac
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from flask import Blueprint, request
+from telebot import types
+
+from service.lane_executor import LaneExecutor
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Поля Update, в которых есть отправитель (from_user)
+_USER_FIELDS = (
+    'message', 'edited_message', 'callback_query', 'inline_query',
+    'chosen_inline_result', 'shipping_query', 'pre_checkout_query',
+    'poll_answer', 'my_chat_member', 'chat_member', 'chat_join_request',
+)
+
+
+def update_user_key(update: types.Update) -> Any:
+    """Ключ упорядочивания: id пользователя, а для обновлений без отправителя - update_id"""
+    for field in _USER_FIELDS:
+        event = getattr(update, field, None)
+        if event is None:
+            continue
+        user = getattr(event, 'from_user', None) or getattr(event, 'user', None)
+        if user is not None:
+            return user.id
+    return update.update_id
+
+
+# Класс UpdateIntake
+# Прием обновлений Telegram и их обработка в LaneExecutor, общий для polling и webhook:
+#     submit(update) - кладет обновление в дорожку пользователя, ждет не дольше enqueue_timeout
+#     run_polling(bot, stop_event) - собственный цикл getUpdates вместо bot.polling
+#     start() / stop() - запускает и останавливает дорожки (stop дорабатывает очереди)
+#     get_stats() - глубина очередей, отказы и время ожидания в очереди
+# Обновления одного пользователя обрабатываются строго по порядку (двойное нажатие
+# "Проверить статус" не выполняется параллельно), разных пользователей - параллельно.
+# В webhook-режиме ответ Telegram отправляется сразу после постановки в очередь; если дорожка
+# заполнена, возвращается 503, и Telegram повторит доставку позже - это и есть backpressure.
+# В polling-режиме заполненная дорожка просто задерживает следующий getUpdates.
+class UpdateIntake:
+    def __init__(self, process_update: Callable[[types.Update], None],
+                 lanes: int = 16, max_queue: int = 1000, enqueue_timeout: float = 1.0):
+        self.enqueue_timeout = enqueue_timeout
+        self._executor = LaneExecutor(
+            process_update,
+            lanes=lanes,
+            max_queue_per_lane=max(1, max_queue // max(1, lanes)),
+            name="UpdateLane"
+        )
+        self._offset: Optional[int] = None
+
+    def submit(self, update: types.Update) -> bool:
+        if self._executor.submit(update_user_key(update), update, timeout=self.enqueue_timeout):
+            return True
+        logger.warning(f"[Update Intake] Lane is full, update {update.update_id} rejected")
+        return False
+
+    def run_polling(self, bot, stop_event: threading.Event, long_polling_timeout: int = 60) -> None:
+        """Получает обновления через getUpdates и раскладывает их по дорожкам"""
+        while not stop_event.is_set():
+            updates = bot.get_updates(
+                offset=self._offset,
+                timeout=long_polling_timeout + 10,
+                long_polling_timeout=long_polling_timeout
+            )
+            for update in updates:
+                self._offset = update.update_id + 1
+                self._executor.submit(update_user_key(update), update, timeout=None)
+
+    def start(self) -> None:
+        self._executor.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._executor.stop(timeout)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return self._executor.get_stats()
+
+
+def create_telegram_webhook_blueprint(intake: UpdateIntake, path: str,
+                                      secret_token: Optional[str] = None) -> Blueprint:
+    blueprint = Blueprint("telegram_webhook", __name__)
+
+    @blueprint.post(path)
+    def telegram_update():
+        if secret_token and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret_token):
+            logger.warning(f"[Update Intake] Rejected update with wrong secret from {request.remote_addr}")
+            return "forbidden", 403
+
+        payload = request.get_data(as_text=True)
+        try:
+            update = types.Update.de_json(payload)
+        except Exception as e:
+            logger.warning(f"[Update Intake] Bad update payload: {e}")
+            return "bad request", 400
+
+        if update is None:
+            return "bad request", 400
+        if not intake.submit(update):
+            return "busy", 503
+        return "ok", 200
+
+    return blueprint
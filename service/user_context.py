@@ -0,0 +1,115 @@
+import logging
+import threading
+from typing import Optional, Dict, Any
+
+from service.repository import UserRepository, UserDataRepository
+from service.user_snapshot import UserSnapshot
+
+logger = logging.getLogger(__name__)
+
+
+class UserContext:
+    """Данные пользователя, загруженные один раз на входящее обновление"""
+    __slots__ = ('user_id', 'snapshot', 'loaded', 'snapshot_queries', 'queries_at_start')
+
+    def __init__(self, user_id: int, queries_at_start: int):
+        self.user_id = user_id
+        self.snapshot: Optional[UserSnapshot] = None
+        self.loaded = False
+        self.snapshot_queries = 0
+        self.queries_at_start = queries_at_start
+
+
+# Класс UserContextManager
+# Кэширует данные пользователя (UserSnapshot) на время обработки одного обновления:
+#     get_snapshot(message) - снимок из контекста; в БД идет только первый вызов на сообщение
+#     get_state(message) - состояние из того же снимка
+#     for_message(message) - контекст, привязанный к объекту сообщения
+#     get_stats() - сколько обращений к БД приходится на одно обработанное обновление
+# Контекст хранится прямо на объекте message, поэтому его видят все фильтры
+# обработчиков и сам выбранный обработчик. После записи через UserRepository или
+# UserDataRepository репозиторий уведомляет менеджер, и снимок текущего потока обновляется.
+class UserContextManager:
+    LOG_EVERY_UPDATES = 100
+
+    def __init__(self, user_repo: UserRepository, user_data_repo: UserDataRepository):
+        self.user_repo = user_repo
+        self.user_data_repo = user_data_repo
+        self.storage = user_repo.storage
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._updates = 0
+        self._finished_updates = 0
+        self._snapshot_queries = 0
+        self._db_queries = 0
+        self._max_db_queries = 0
+        user_repo.add_change_listener(self._on_user_changed)
+        user_data_repo.add_change_listener(self._on_user_changed)
+
+    def for_message(self, message) -> UserContext:
+        ctx = getattr(message, '_user_context', None)
+        if ctx is not None:
+            return ctx
+
+        self._finish_current()
+        ctx = UserContext(message.from_user.id, self.storage.thread_query_count())
+        message._user_context = ctx
+        self._local.current = ctx
+
+        with self._lock:
+            self._updates += 1
+        return ctx
+
+    def get_snapshot(self, message) -> Optional[UserSnapshot]:
+        ctx = self.for_message(message)
+        if not ctx.loaded:
+            ctx.snapshot = self.user_repo.get_snapshot(ctx.user_id)
+            if ctx.snapshot is not None:
+                # viewed_level, еще не записанный фоновым потоком, важнее значения из БД
+                ctx.snapshot.apply(self.user_data_repo.pending_changes(ctx.user_id))
+            ctx.loaded = True
+            ctx.snapshot_queries += 1
+            with self._lock:
+                self._snapshot_queries += 1
+        return ctx.snapshot
+
+    def get_state(self, message) -> Optional[int]:
+        snapshot = self.get_snapshot(message)
+        return snapshot.state if snapshot else None
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            finished = self._finished_updates
+            return {
+                'updates': self._updates,
+                'snapshot_queries': self._snapshot_queries,
+                'snapshot_queries_per_update': round(self._snapshot_queries / self._updates, 2) if self._updates else 0.0,
+                'db_queries_per_update': round(self._db_queries / finished, 2) if finished else 0.0,
+                'max_db_queries_per_update': self._max_db_queries,
+            }
+
+    def _finish_current(self) -> None:
+        """Подводит итог предыдущего обновления, обработанного этим потоком"""
+        prev = getattr(self._local, 'current', None)
+        if prev is None:
+            return
+        self._local.current = None
+        db_queries = self.storage.thread_query_count() - prev.queries_at_start
+
+        with self._lock:
+            self._finished_updates += 1
+            self._db_queries += db_queries
+            self._max_db_queries = max(self._max_db_queries, db_queries)
+            should_log = self._finished_updates % self.LOG_EVERY_UPDATES == 0
+
+        if should_log:
+            logger.info(f"[User Context] {self.get_stats()}")
+
+    def _on_user_changed(self, user_id: int, changes: Optional[Dict[str, Any]]) -> None:
+        ctx = getattr(self._local, 'current', None)
+        if ctx is None or ctx.user_id != user_id or not ctx.loaded:
+            return
+        if changes is None or ctx.snapshot is None:
+            ctx.loaded = False
+        else:
+            ctx.snapshot.apply(changes)
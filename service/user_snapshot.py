@@ -0,0 +1,42 @@
+from typing import Any, Dict, Optional, Tuple
+
+
+# Класс UserSnapshot
+# Данные пользователя, нужные почти каждому обработчику, из одного запроса
+# users LEFT JOIN user_data вместо отдельных get_user, get_user_state и get_viewed_level.
+# Объект живет одно обновление (см. UserContextManager.get_snapshot); после записи через
+# репозитории контекст применяет изменения к снимку через apply(), чтобы он не устаревал.
+class UserSnapshot:
+    __slots__ = ('user_id', 'level', 'state', 'registration_complete', 'viewed_level', 'language', 'name')
+
+    QUERY = """
+        SELECT u.id, u.current_level, u.current_state, u.registration_complete,
+               COALESCE(d.viewed_level, 1), COALESCE(d.language, 'ru'), d.name
+        FROM users u
+        LEFT JOIN user_data d ON d.user_id = u.id
+        WHERE u.id = %s
+    """
+
+    def __init__(self, user_id: int, level: int, state: int, registration_complete: bool,
+                 viewed_level: int = 1, language: str = 'ru', name: Optional[str] = None):
+        self.user_id = user_id
+        self.level = level
+        self.state = state
+        self.registration_complete = registration_complete
+        self.viewed_level = viewed_level
+        self.language = language
+        self.name = name
+
+    @classmethod
+    def from_row(cls, row: Tuple) -> "UserSnapshot":
+        return cls(*row)
+
+    def apply(self, changes: Dict[str, Any]) -> None:
+        """Применяет изменения, записанные репозиториями; поля вне снимка пропускаются"""
+        for field, value in changes.items():
+            if field in self.__slots__:
+                setattr(self, field, value)
+
+    def __repr__(self) -> str:
+        return (f"UserSnapshot(user_id={self.user_id}, level={self.level}, state={self.state}, "
+                f"registration_complete={self.registration_complete}, viewed_level={self.viewed_level})")
@@ -10,4 +10,85 @@ YOOKASSA_SECRET_KEY = os.getenv("YOOKASSA_SECRET_KEY")
 
 # Безопасная обработка ADMIN_IDS
 admin_ids_str = os.getenv("ADMIN_IDS", "")
-ADMIN_IDS = {int(id.strip()) for id in admin_ids_str.split(",") if id.strip()}
\ No newline at end of file
+ADMIN_IDS = {int(id.strip()) for id in admin_ids_str.split(",") if id.strip()}
+
+# Пул соединений с PostgreSQL
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))
+DB_POOL_WAIT_TIMEOUT = float(os.getenv("DB_POOL_WAIT_TIMEOUT", "10"))
+
+# Каталог с изображениями уровней (значения image:<имя> из levels.rules)
+LEVEL_IMAGES_DIR = os.getenv(
+    "LEVEL_IMAGES_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "levels")
+)
+
+# Фоновая сверка платежей с ЮKassa
+PAYMENT_POLL_WORKERS = int(os.getenv("PAYMENT_POLL_WORKERS", "4"))
+PAYMENT_POLL_INTERVAL = float(os.getenv("PAYMENT_POLL_INTERVAL", "15"))
+PAYMENT_POLL_TTL_HOURS = float(os.getenv("PAYMENT_POLL_TTL_HOURS", "24"))
+
+# Встроенный HTTP-сервер для уведомлений
+HTTP_HOST = os.getenv("HTTP_HOST", "0.0.0.0")
+HTTP_PORT = int(os.getenv("HTTP_PORT", "8080"))
+HTTP_TRUST_PROXY = os.getenv("HTTP_TRUST_PROXY", "false").lower() == "true"
+
+# Уведомления ЮKassa (основной путь подтверждения платежей)
+PAYMENT_WEBHOOK_ENABLED = os.getenv("PAYMENT_WEBHOOK_ENABLED", "false").lower() == "true"
+PAYMENT_WEBHOOK_PATH = os.getenv("PAYMENT_WEBHOOK_PATH", "/yookassa/notifications")
+PAYMENT_WEBHOOK_VERIFY_API = os.getenv("PAYMENT_WEBHOOK_VERIFY_API", "true").lower() == "true"
+# Пусто - официальные адреса ЮKassa; для локальной проверки: 127.0.0.1/32
+YOOKASSA_TRUSTED_NETWORKS = [net for net in os.getenv("YOOKASSA_TRUSTED_NETWORKS", "").split(",") if net.strip()]
+# Через сколько секунд сверка проверяет платеж, если уведомление не пришло
+PAYMENT_RECONCILE_DELAY = float(os.getenv("PAYMENT_RECONCILE_DELAY", "300"))
+# Повторная выдача неоплаченного платежа вместо нового (с) и лимит неоплаченных платежей пользователя
+PAYMENT_REUSE_TTL = float(os.getenv("PAYMENT_REUSE_TTL", "3600"))
+PAYMENT_MAX_PENDING_PER_USER = int(os.getenv("PAYMENT_MAX_PENDING_PER_USER", "3"))
+
+# Получение обновлений Telegram: polling (long polling) или webhook (через HTTP-сервер)
+BOT_UPDATE_MODE = os.getenv("BOT_UPDATE_MODE", "polling").lower()
+# Публичный адрес, на который Telegram шлет обновления, например https://bot.example.com
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL", "")
+TELEGRAM_WEBHOOK_PATH = os.getenv("TELEGRAM_WEBHOOK_PATH", "/telegram/webhook")
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET", "")
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+UPDATE_ENQUEUE_TIMEOUT = float(os.getenv("UPDATE_ENQUEUE_TIMEOUT", "1"))
+
+# Обработка обновлений: дорожки по id пользователя (обновления одного пользователя - по порядку)
+UPDATE_LANES = int(os.getenv("UPDATE_LANES", "16"))
+
+# Запись просматриваемого уровня: 0 - сразу, иначе раз в N секунд одним запросом
+USER_DATA_COALESCE_INTERVAL = float(os.getenv("USER_DATA_COALESCE_INTERVAL", "0"))
+
+# Отложенная запись состояний: сколько секунд состояние может жить только в памяти (0 - писать сразу)
+# Буфер свой у каждого процесса: включать, только если бот работает одним процессом
+STATE_WRITE_BEHIND_WINDOW = float(os.getenv("STATE_WRITE_BEHIND_WINDOW", "0"))
+STATE_WRITE_BEHIND_MAX_DIRTY = int(os.getenv("STATE_WRITE_BEHIND_MAX_DIRTY", "1000"))
+
+# Логирование: уровень, формат (text/json) и доля пропускаемых частых сообщений.
+# LOG_SAMPLE_RATES: "<префикс сообщения>=<доля>;logger:<имя логгера>=<доля>", доля 0.1 - каждое десятое
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "[Keyboard]=0.05;[Task Check]=0.05;DEBUG:=0.1;DB Query -=0.1")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# Пересчет сводной статистики /admin (материализованное представление admin_stats), с
+ADMIN_STATS_REFRESH_INTERVAL = float(os.getenv("ADMIN_STATS_REFRESH_INTERVAL", "300"))
+
+# Исходящие сообщения: лимиты Telegram (около 30 сообщений/с всего и 1/с в один чат)
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+OUTBOUND_CHAT_BURST = float(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", "4"))
+OUTBOUND_QUEUE_SIZE = int(os.getenv("OUTBOUND_QUEUE_SIZE", "10000"))
+# Склеивать подряд идущие тексты одного чата, ожидающие отправки
+OUTBOUND_COALESCE = os.getenv("OUTBOUND_COALESCE", "true").lower() == "true"
+
+# Рассылки: сообщений в секунду (часть общего лимита OUTBOUND_GLOBAL_RATE) и размер страницы получателей
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "20"))
+BROADCAST_PAGE_SIZE = int(os.getenv("BROADCAST_PAGE_SIZE", "200"))
+
+# Уведомления об окончании заданий на время: окно заданий в памяти и шаг догрузки из БД, с
+TIME_TASK_LOOKAHEAD = float(os.getenv("TIME_TASK_LOOKAHEAD", "3600"))
+TIME_TASK_RELOAD_INTERVAL = float(os.getenv("TIME_TASK_RELOAD_INTERVAL", "300"))
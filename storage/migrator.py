@@ -1,259 +1,814 @@
-from storage.postgres_storage import PostgresStorage
 import logging
+import re
+import sys
+import time
+from typing import Any, List, Optional, Sequence, Set, Tuple, Union
+
+from psycopg2 import errors
+
+from storage.postgres_storage import PostgresStorage
 
 logger = logging.getLogger(__name__)
 
+# Ключ pg_advisory_lock: одновременно миграции применяет только один экземпляр бота
+MIGRATION_LOCK_ID = 7245001
+# Пауза между попытками взять lock, пока миграции применяет другой экземпляр, с
+MIGRATION_LOCK_POLL_INTERVAL = 2.0
+
+SCHEMA_MIGRATIONS_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+    )
+"""
+
+# Очистка дубликатов в базах, созданных до ограничений tasks_unique и referrals_unique
+CLEAN_DUPLICATE_TASKS = """
+    DELETE FROM tasks 
+    WHERE ctid NOT IN (
+        SELECT min(ctid) 
+        FROM tasks 
+        GROUP BY user_id, level, task_type
+    )
+"""
+
+CLEAN_DUPLICATE_REFERRALS = """
+    DELETE FROM referrals 
+    WHERE ctid NOT IN (
+        SELECT min(ctid) 
+        FROM referrals 
+        GROUP BY referrer_id, referee_id, level
+    )
+"""
+
+BASELINE_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id BIGINT PRIMARY KEY,
+        registration_complete BOOLEAN NOT NULL DEFAULT FALSE,
+        current_level INTEGER NOT NULL DEFAULT 1 
+            CHECK (current_level >= 1 AND current_level <= 21),
+        current_state INTEGER NOT NULL DEFAULT 0,
+        registration_date TIMESTAMP DEFAULT NOW()
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_data (
+        user_id BIGINT PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+        name TEXT,
+        birthdate TEXT,
+        location TEXT,
+        language TEXT DEFAULT 'ru',
+        viewed_level INTEGER DEFAULT 1 
+            CHECK (viewed_level >= 1 AND viewed_level <= 21)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS levels (
+        level_number INTEGER PRIMARY KEY 
+            CHECK (level_number >= 1 AND level_number <= 21),
+        content TEXT NOT NULL,
+        rules TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS tasks (
+        id SERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        level INTEGER NOT NULL 
+            CHECK (level >= 1 AND level <= 21),
+        task_type TEXT NOT NULL 
+            CHECK (task_type IN ('time', 'referral', 'donation', 'auto')),
+        start_time TIMESTAMP NOT NULL,
+        end_time TIMESTAMP NOT NULL,
+        completed BOOLEAN NOT NULL DEFAULT FALSE,
+        completion_time TIMESTAMP,
+        CONSTRAINT tasks_unique UNIQUE (user_id, level, task_type),
+        CONSTRAINT valid_task_times CHECK (end_time >= start_time)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS referrals (
+        id SERIAL PRIMARY KEY,
+        referrer_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        referee_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        level INTEGER NOT NULL 
+            CHECK (level >= 1 AND level <= 21),
+        referral_date TIMESTAMP DEFAULT NOW(),
+        registration_date TIMESTAMP,
+        CONSTRAINT referrals_unique UNIQUE (referrer_id, referee_id, level),
+        CONSTRAINT no_self_referral CHECK (referrer_id != referee_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS donations (
+        id SERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        level INTEGER NOT NULL 
+            CHECK (level >= 1 AND level <= 21),
+        amount DECIMAL(10, 2) NOT NULL 
+            CHECK (amount > 0),
+        currency TEXT NOT NULL,
+        status TEXT NOT NULL,
+        donation_date TIMESTAMP NOT NULL,
+        payment_id TEXT,
+        processed BOOLEAN DEFAULT FALSE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS telegram_file_cache (
+        path TEXT NOT NULL,
+        content_hash TEXT NOT NULL,
+        file_id TEXT NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (path, content_hash)
+    )
+    """
+]
+
+# Индексы строятся CONCURRENTLY (миграция 2), чтобы не блокировать запись в таблицы
+ONLINE_INDEXES = [
+    ("idx_tasks_user_level", "tasks", "(user_id, level)"),
+    ("idx_referrals_referrer_level", "referrals", "(referrer_id, level)"),
+    ("idx_referrals_referee_level", "referrals", "(referee_id, level)"),
+    ("idx_referrals_level", "referrals", "(level)"),
+    ("idx_donations_user_level", "donations", "(user_id, level)"),
+    ("idx_donations_user_level_succeeded", "donations", "(user_id, level) WHERE status = 'succeeded'"),
+    ("idx_tasks_user_completed", "tasks", "(user_id, level, completed)"),
+    ("idx_tasks_completion", "tasks", "(completed, completion_time)"),
+    ("idx_user_data_viewed_level", "user_data", "(viewed_level)"),
+    ("idx_user_data_composite", "user_data", "(user_id, viewed_level)"),
+    ("idx_referrals_registration", "referrals", "(registration_date)"),
+    ("idx_users_registration", "users", "(registration_complete)"),
+    ("idx_donations_payment_id", "donations", "(payment_id) WHERE payment_id IS NOT NULL"),
+    ("idx_donations_pending", "donations", "(donation_date) WHERE status = 'pending'"),
+]
+
+REFERRAL_REGISTRATION_FUNCTION = """
+    CREATE OR REPLACE FUNCTION process_referral_registration()
+    RETURNS TRIGGER AS $$
+    DECLARE
+        updated_referrals INT;
+        inserted_tasks INT;
+    BEGIN
+        -- Обновляем реферальные записи
+        UPDATE referrals 
+        SET registration_date = NOW()
+        WHERE referee_id = NEW.id 
+        AND registration_date IS NULL;
+
+        GET DIAGNOSTICS updated_referrals = ROW_COUNT;
+
+        -- Если есть обновленные рефералы, создаем/обновляем задачи
+        IF updated_referrals > 0 THEN
+            -- Вставка или обновление существующих задач
+            INSERT INTO tasks (
+                user_id, level, task_type, 
+                start_time, end_time, completed,
+                completion_time
+            )
+            SELECT 
+                r.referrer_id, 
+                r.level, 
+                'referral', 
+                NOW(), 
+                NOW(), 
+                TRUE,
+                NOW()
+            FROM referrals r
+            WHERE r.referee_id = NEW.id
+            AND r.registration_date IS NOT NULL
+            ON CONFLICT (user_id, level, task_type) 
+            DO UPDATE SET
+                completed = EXCLUDED.completed,
+                completion_time = EXCLUDED.completion_time,
+                end_time = EXCLUDED.end_time;
+
+            GET DIAGNOSTICS inserted_tasks = ROW_COUNT;
+
+            -- Логирование в системную таблицу
+            INSERT INTO audit_log (event_type, user_id, message)
+            VALUES ('referral_processed', NEW.id, 
+                'Processed ' || inserted_tasks || ' referral tasks');
+        END IF;
+
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+REFERRAL_REGISTRATION_TRIGGER = """
+    DROP TRIGGER IF EXISTS after_user_registration ON users;
+    CREATE TRIGGER after_user_registration
+    AFTER UPDATE OF registration_complete ON users
+    FOR EACH ROW
+    WHEN (NEW.registration_complete IS TRUE AND 
+         (OLD.registration_complete IS FALSE OR OLD.registration_complete IS NULL))
+    EXECUTE FUNCTION process_referral_registration();
+"""
+
+AUDIT_LOG = """
+    CREATE TABLE IF NOT EXISTS audit_log (
+        id SERIAL PRIMARY KEY,
+        event_time TIMESTAMP DEFAULT NOW(),
+        event_type TEXT NOT NULL,
+        user_id BIGINT,
+        message TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_audit_log_event_type ON audit_log(event_type);
+    CREATE INDEX IF NOT EXISTS idx_audit_log_user_id ON audit_log(user_id);
+"""
+
+# Уведомление LevelCatalog об изменении уровней (LISTEN levels_changed)
+LEVELS_CHANGED_TRIGGER = """
+    CREATE OR REPLACE FUNCTION notify_levels_changed()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        PERFORM pg_notify(
+            'levels_changed',
+            COALESCE(NEW.level_number, OLD.level_number)::text
+        );
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS levels_changed ON levels;
+    CREATE TRIGGER levels_changed
+    AFTER INSERT OR UPDATE OR DELETE ON levels
+    FOR EACH ROW
+    EXECUTE FUNCTION notify_levels_changed();
+"""
+
+# Отметка выполненными реферальных заданий уже зарегистрированных рефералов (миграция 3).
+# EXISTS, а не JOIN: у задания может быть несколько рефералов, и id не должен повторяться
+REFERRAL_TASKS_TO_COMPLETE = """
+    SELECT t.id
+    FROM tasks t
+    WHERE t.task_type = 'referral'
+        AND t.completed = FALSE
+        AND EXISTS (
+            SELECT 1 FROM referrals r
+            WHERE r.referrer_id = t.user_id AND r.level = t.level
+                AND r.registration_date IS NOT NULL
+        )
+"""
+
+
+# Сводная статистика для /admin одной строкой (миграция 4); обновляется по расписанию
+# через REFRESH MATERIALIZED VIEW CONCURRENTLY, для которого нужен уникальный индекс
+ADMIN_STATS_VIEW = """
+    CREATE MATERIALIZED VIEW IF NOT EXISTS admin_stats AS
+    SELECT
+        1 AS id,
+        (SELECT COUNT(*) FROM users
+            WHERE current_level > 1 OR registration_complete = TRUE) AS active_users,
+        (SELECT COUNT(*) FROM tasks
+            WHERE completed = TRUE AND task_type != 'donation') AS good_deeds,
+        (SELECT COALESCE(jsonb_object_agg(current_level, users_count), '{}'::jsonb)
+            FROM (
+                SELECT current_level, COUNT(*) AS users_count FROM users
+                WHERE registration_complete = TRUE
+                GROUP BY current_level
+            ) levels) AS level_stats,
+        (SELECT COUNT(*) FROM donations WHERE status = 'succeeded') AS donations_count,
+        (SELECT COALESCE(SUM(amount), 0) FROM donations WHERE status = 'succeeded') AS donations_amount,
+        (SELECT COUNT(*) FROM referrals) AS referrals_total,
+        (SELECT COUNT(*) FROM referrals WHERE registration_date IS NOT NULL) AS referrals_completed,
+        NOW() AS refreshed_at;
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_admin_stats_id ON admin_stats(id);
+"""
+
+# Счетчики рефералов (миграция 5): total - всего приглашенных на уровне,
+# completed - из них завершивших регистрацию. Проверка статуса реферального задания
+# читает одну строку по первичному ключу вместо JOIN referrals/users и COUNT(*).
+# Счетчики ведут триггеры в той же транзакции, что и изменение данных:
+#     referrals INSERT/DELETE - total (и completed, если реферал уже зарегистрирован)
+#     users после завершения регистрации - completed (process_referral_registration)
+#     users BEFORE DELETE - completed для удаляемого зарегистрированного реферала; к моменту
+#         каскадного удаления его referrals строки users уже нет, и триггер referrals
+#         уменьшает только total
+# Изменение referrer_id/referee_id/level существующих строк не отслеживается:
+# после ручных правок счетчики пересчитываются REBUILD_REFERRAL_COUNTERS.
+REFERRAL_COUNTERS = """
+    CREATE TABLE IF NOT EXISTS referral_counters (
+        referrer_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        level INTEGER NOT NULL
+            CHECK (level >= 1 AND level <= 21),
+        total INTEGER NOT NULL DEFAULT 0,
+        completed INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (referrer_id, level)
+    );
+
+    CREATE OR REPLACE FUNCTION count_referral_change()
+    RETURNS TRIGGER AS $$
+    DECLARE
+        registered INT;
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            SELECT COUNT(*) INTO registered FROM users
+            WHERE id = NEW.referee_id AND registration_complete IS TRUE;
+
+            INSERT INTO referral_counters AS c (referrer_id, level, total, completed)
+            VALUES (NEW.referrer_id, NEW.level, 1, registered)
+            ON CONFLICT (referrer_id, level) DO UPDATE SET
+                total = c.total + 1,
+                completed = c.completed + EXCLUDED.completed;
+        ELSE
+            SELECT COUNT(*) INTO registered FROM users
+            WHERE id = OLD.referee_id AND registration_complete IS TRUE;
+
+            UPDATE referral_counters
+            SET total = GREATEST(total - 1, 0),
+                completed = GREATEST(completed - registered, 0)
+            WHERE referrer_id = OLD.referrer_id AND level = OLD.level;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS referral_counters_change ON referrals;
+    CREATE TRIGGER referral_counters_change
+    AFTER INSERT OR DELETE ON referrals
+    FOR EACH ROW
+    EXECUTE FUNCTION count_referral_change();
+
+    CREATE OR REPLACE FUNCTION count_referee_deletion()
+    RETURNS TRIGGER AS $$
+    BEGIN
+        UPDATE referral_counters c
+        SET completed = GREATEST(c.completed - r.referrals_count, 0)
+        FROM (
+            SELECT referrer_id, level, COUNT(*) AS referrals_count
+            FROM referrals
+            WHERE referee_id = OLD.id
+            GROUP BY referrer_id, level
+        ) r
+        WHERE c.referrer_id = r.referrer_id AND c.level = r.level;
+        RETURN OLD;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS referral_counters_referee_deletion ON users;
+    CREATE TRIGGER referral_counters_referee_deletion
+    BEFORE DELETE ON users
+    FOR EACH ROW
+    WHEN (OLD.registration_complete IS TRUE)
+    EXECUTE FUNCTION count_referee_deletion();
+"""
+
+# process_referral_registration из миграции 1, дополненная счетчиком completed
+REFERRAL_REGISTRATION_FUNCTION_WITH_COUNTERS = """
+    CREATE OR REPLACE FUNCTION process_referral_registration()
+    RETURNS TRIGGER AS $$
+    DECLARE
+        updated_referrals INT;
+        inserted_tasks INT;
+    BEGIN
+        -- Зарегистрировавшийся пользователь засчитывается всем пригласившим его
+        UPDATE referral_counters c
+        SET completed = c.completed + r.referrals_count
+        FROM (
+            SELECT referrer_id, level, COUNT(*) AS referrals_count
+            FROM referrals
+            WHERE referee_id = NEW.id
+            GROUP BY referrer_id, level
+        ) r
+        WHERE c.referrer_id = r.referrer_id AND c.level = r.level;
+
+        -- Обновляем реферальные записи
+        UPDATE referrals 
+        SET registration_date = NOW()
+        WHERE referee_id = NEW.id 
+        AND registration_date IS NULL;
+
+        GET DIAGNOSTICS updated_referrals = ROW_COUNT;
+
+        -- Если есть обновленные рефералы, создаем/обновляем задачи
+        IF updated_referrals > 0 THEN
+            -- Вставка или обновление существующих задач
+            INSERT INTO tasks (
+                user_id, level, task_type, 
+                start_time, end_time, completed,
+                completion_time
+            )
+            SELECT 
+                r.referrer_id, 
+                r.level, 
+                'referral', 
+                NOW(), 
+                NOW(), 
+                TRUE,
+                NOW()
+            FROM referrals r
+            WHERE r.referee_id = NEW.id
+            AND r.registration_date IS NOT NULL
+            ON CONFLICT (user_id, level, task_type) 
+            DO UPDATE SET
+                completed = EXCLUDED.completed,
+                completion_time = EXCLUDED.completion_time,
+                end_time = EXCLUDED.end_time;
+
+            GET DIAGNOSTICS inserted_tasks = ROW_COUNT;
+
+            -- Логирование в системную таблицу
+            INSERT INTO audit_log (event_type, user_id, message)
+            VALUES ('referral_processed', NEW.id, 
+                'Processed ' || inserted_tasks || ' referral tasks');
+        END IF;
+
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+# Пересчет счетчиков с нуля. EXCLUSIVE-блокировка referral_counters ждет транзакции,
+# уже изменившие счетчики, и задерживает новые (триггеры) до коммита пересчета,
+# поэтому ни одно изменение не теряется. Чтение счетчиков не блокируется.
+REBUILD_REFERRAL_COUNTERS = """
+    LOCK TABLE referral_counters IN EXCLUSIVE MODE;
+    DELETE FROM referral_counters;
+    INSERT INTO referral_counters (referrer_id, level, total, completed)
+    SELECT r.referrer_id, r.level, COUNT(*),
+           COUNT(*) FILTER (WHERE u.registration_complete IS TRUE)
+    FROM referrals r
+    LEFT JOIN users u ON u.id = r.referee_id
+    GROUP BY r.referrer_id, r.level;
+"""
+
+# Массовые рассылки (миграция 6). last_user_id - контрольная точка keyset-обхода users:
+# после перезапуска рассылка продолжается со следующего пользователя.
+# locked_until - аренда: рассылку ведет один экземпляр бота, аренда продлевается
+# на каждой странице и освобождается сама, если процесс упал.
+BROADCASTS = """
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        id SERIAL PRIMARY KEY,
+        created_by BIGINT NOT NULL,
+        text TEXT NOT NULL,
+        level INTEGER
+            CHECK (level >= 1 AND level <= 21),
+        registered BOOLEAN,
+        status TEXT NOT NULL DEFAULT 'running'
+            CHECK (status IN ('running', 'completed', 'canceled')),
+        last_user_id BIGINT NOT NULL DEFAULT 0,
+        sent INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        locked_until TIMESTAMP,
+        created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        updated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+        finished_at TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_broadcasts_running ON broadcasts(id) WHERE status = 'running';
+"""
+
+# Уведомления об окончании заданий на время (миграция 7): expiry_notified_at отмечает
+# отправленное уведомление, частичный индекс по end_time содержит только ожидающие
+# задания, поэтому TimeTaskScheduler догружает их по диапазону end_time без скана tasks
+TIME_TASK_EXPIRY_COLUMN = "ALTER TABLE tasks ADD COLUMN IF NOT EXISTS expiry_notified_at TIMESTAMP"
+
+# Повторное использование платежей (миграция 8): ссылка на оплату и ключ идемпотентности
+# ЮKassa сохраняются вместе с донатом, чтобы неоплаченный платеж отдавать повторно;
+# частичный индекс по ожидающим платежам пользователя - для поиска и лимита таких платежей
+PAYMENT_REUSE_COLUMNS = """
+ALTER TABLE donations
+    ADD COLUMN IF NOT EXISTS confirmation_url TEXT,
+    ADD COLUMN IF NOT EXISTS idempotence_key TEXT
+"""
+
+# Класс ConcurrentIndex
+# Шаг онлайн-миграции: CREATE INDEX CONCURRENTLY без блокировки записи в таблицу.
+# Выполняется вне транзакции. Валидный индекс пропускается; невалидный, оставшийся
+# после прерванной сборки, удаляется (DROP INDEX CONCURRENTLY) и строится заново.
+class ConcurrentIndex:
+    def __init__(self, name: str, table: str, definition: str, unique: bool = False):
+        self.name = name
+        self.table = table
+        self.definition = definition
+        self.unique = unique
+
+    def run(self, cursor) -> None:
+        state = self._state(cursor)
+        if state == 'valid':
+            return
+        if state == 'invalid':
+            logger.warning(f"Индекс {self.name} невалиден (прерванная сборка), пересоздание")
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {self.name}")
 
+        started = time.monotonic()
+        unique = "UNIQUE " if self.unique else ""
+        cursor.execute(f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {self.name} ON {self.table} {self.definition}")
+        logger.info(f"Индекс {self.name} построен за {time.monotonic() - started:.1f} с")
+
+    def explain(self, cursor) -> str:
+        state = self._state(cursor)
+        if state == 'valid':
+            return f"индекс {self.name}: уже есть, пропуск"
+        rows, size = _table_estimate(cursor, self.table)
+        action = "пересоздание" if state == 'invalid' else "CREATE INDEX CONCURRENTLY"
+        return f"индекс {self.name} ({action}): {self.table} ~{rows} строк, {size}"
+
+    def _state(self, cursor) -> str:
+        cursor.execute(
+            """SELECT i.indisvalid FROM pg_class c
+            JOIN pg_index i ON i.indexrelid = c.oid
+            WHERE c.relname = %s""",
+            (self.name,)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return 'missing'
+        return 'valid' if row[0] else 'invalid'
+
+
+# Класс BatchedUpdate
+# Шаг онлайн-миграции: UPDATE пачками по batch_size строк вместо одного большого запроса.
+# Каждая пачка - отдельная короткая транзакция (блокировки держатся недолго), между
+# пачками пауза pause секунд, прогресс пишется в лог. candidates_sql выбирает id строк,
+# которые еще нужно обновить, поэтому прерванный шаг безопасно продолжается с начала.
+class BatchedUpdate:
+    def __init__(self, name: str, table: str, set_clause: str, candidates_sql: str,
+                 batch_size: int = 1000, pause: float = 0.1):
+        self.name = name
+        self.table = table
+        self.set_clause = set_clause
+        self.candidates_sql = candidates_sql
+        self.batch_size = batch_size
+        self.pause = pause
+
+    def run(self, cursor) -> None:
+        sql = (
+            f"UPDATE {self.table} SET {self.set_clause} "
+            f"WHERE id IN ({self.candidates_sql} LIMIT %s)"
+        )
+        total = 0
+        batches = 0
+        started = time.monotonic()
+        while True:
+            cursor.execute(sql, (self.batch_size,))
+            updated = cursor.rowcount
+            if updated <= 0:
+                break
+            total += updated
+            batches += 1
+            if batches % 10 == 0:
+                logger.info(f"{self.name}: обновлено {total} строк ({batches} пачек, {time.monotonic() - started:.1f} с)")
+            # Неполная пачка не значит, что строк не осталось: останавливаемся только на пустой
+            time.sleep(self.pause)
+        logger.info(f"{self.name}: готово, обновлено {total} строк за {time.monotonic() - started:.1f} с")
+
+    def explain(self, cursor) -> str:
+        cost, rows = _explain(cursor, self.candidates_sql)
+        batches = -(-rows // self.batch_size) if rows else 0
+        return (f"{self.name}: ~{rows} строк, ~{batches} пачек по {self.batch_size}, "
+                f"стоимость выборки {cost}")
+
+
+def _explain(cursor, sql: str) -> Tuple[str, int]:
+    """Оценка планировщика без выполнения: (диапазон стоимости, ожидаемое число строк)"""
+    cursor.execute(f"EXPLAIN {sql}")
+    top = cursor.fetchone()[0]
+    match = re.search(r"cost=([\d.]+\.\.[\d.]+) rows=(\d+)", top)
+    return (match.group(1), int(match.group(2))) if match else (top, 0)
+
+
+def _table_estimate(cursor, table: str) -> Tuple[int, str]:
+    cursor.execute(
+        "SELECT reltuples::bigint, pg_size_pretty(pg_total_relation_size(oid)) FROM pg_class WHERE relname = %s",
+        (table,)
+    )
+    row = cursor.fetchone()
+    return (max(row[0], 0), row[1]) if row else (0, "таблицы еще нет")
+
+
+# Класс Migration
+# Одна нумерованная миграция: версия, название и шаги. Если все шаги - SQL-строки,
+# миграция выполняется в одной транзакции вместе с записью версии в schema_migrations.
+# Если среди шагов есть ConcurrentIndex или BatchedUpdate, миграция онлайн: шаги
+# выполняются по очереди вне общей транзакции, каждый шаг идемпотентен, а версия
+# записывается в конце - прерванная онлайн-миграция при следующем запуске повторяется.
+class Migration:
+    __slots__ = ('version', 'name', 'statements')
+
+    def __init__(self, version: int, name: str, statements: Sequence[Union[str, Any]]):
+        self.version = version
+        self.name = name
+        self.statements = list(statements)
+
+    @property
+    def transactional(self) -> bool:
+        return all(isinstance(statement, str) for statement in self.statements)
+
+
+# Новые миграции добавляются в конец списка со следующим номером; примененные не меняются.
+# Версия 1 - схема, которую раньше создавал migrate() при каждом запуске (все запросы
+# идемпотентны, поэтому на существующей базе она проходит без изменений данных).
+# Индексы и досоздание реферальных заданий вынесены в онлайн-миграции 2 и 3: на базе,
+# где они уже есть, эти шаги ничего не делают.
+MIGRATIONS: List[Migration] = [
+    Migration(1, "baseline", [
+        *BASELINE_TABLES,
+        CLEAN_DUPLICATE_TASKS,
+        CLEAN_DUPLICATE_REFERRALS,
+        REFERRAL_REGISTRATION_FUNCTION,
+        REFERRAL_REGISTRATION_TRIGGER,
+        AUDIT_LOG,
+        LEVELS_CHANGED_TRIGGER,
+    ]),
+    Migration(2, "online_indexes", [
+        ConcurrentIndex(name, table, definition) for name, table, definition in ONLINE_INDEXES
+    ]),
+    Migration(3, "complete_registered_referral_tasks", [
+        BatchedUpdate(
+            "referral_tasks_backfill",
+            table="tasks",
+            set_clause="completed = TRUE, completion_time = NOW(), end_time = NOW()",
+            candidates_sql=REFERRAL_TASKS_TO_COMPLETE
+        ),
+    ]),
+    Migration(4, "admin_stats_view", [ADMIN_STATS_VIEW]),
+    Migration(5, "referral_counters", [
+        REFERRAL_COUNTERS,
+        REFERRAL_REGISTRATION_FUNCTION_WITH_COUNTERS,
+        REBUILD_REFERRAL_COUNTERS,
+    ]),
+    Migration(6, "broadcasts", [BROADCASTS]),
+    Migration(7, "time_task_expiry", [
+        TIME_TASK_EXPIRY_COLUMN,
+        ConcurrentIndex(
+            "idx_tasks_time_pending", "tasks",
+            "(end_time) WHERE task_type = 'time' AND completed = FALSE AND expiry_notified_at IS NULL"
+        ),
+    ]),
+    Migration(8, "payment_reuse", [
+        PAYMENT_REUSE_COLUMNS,
+        ConcurrentIndex(
+            "idx_donations_user_pending", "donations",
+            "(user_id, donation_date) WHERE status = 'pending' AND processed IS NOT TRUE"
+        ),
+    ]),
+]
+
+
+# Класс Migrator
+# Применяет только еще не примененные миграции из MIGRATIONS:
+#     migrate() - если схема актуальна, обходится одним запросом к schema_migrations;
+#         иначе берет advisory lock, перечитывает примененные версии и применяет остальные по порядку.
+#         Lock берется опросом pg_try_advisory_lock вне транзакции: ожидающий экземпляр не держит
+#         снимок, иначе CREATE INDEX CONCURRENTLY у владельца lock ждал бы его и не завершался
+#     migrate(dry_run=True) - только план: EXPLAIN для выборок и UPDATE, оценка размера таблиц для индексов
+#     current_version() - последняя примененная версия (0 для пустой базы)
 class Migrator:
-    def __init__(self, storage: PostgresStorage):
+    def __init__(self, storage: PostgresStorage, migrations: Optional[List[Migration]] = None):
         self.storage = storage
+        self.migrations = sorted(migrations or MIGRATIONS, key=lambda migration: migration.version)
+        self.latest_version = self.migrations[-1].version if self.migrations else 0
 
-    def migrate(self):
-        """Применяет все миграции базы данных"""
+    def migrate(self, dry_run: bool = False) -> int:
+        """Применяет недостающие миграции, возвращает их количество.
+        При dry_run ничего не меняет, а пишет в лог план с оценкой стоимости шагов."""
         try:
             with self.storage.connection() as conn:
                 cursor = conn.cursor()
 
-                # 1. Очистка дубликатов
-                self._clean_duplicates(cursor, conn)
-
-                # 2. Создание таблиц
-                base_queries = [
-                    """
-                    CREATE TABLE IF NOT EXISTS users (
-                        id BIGINT PRIMARY KEY,
-                        registration_complete BOOLEAN NOT NULL DEFAULT FALSE,
-                        current_level INTEGER NOT NULL DEFAULT 1 
-                            CHECK (current_level >= 1 AND current_level <= 21),
-                        current_state INTEGER NOT NULL DEFAULT 0,
-                        registration_date TIMESTAMP DEFAULT NOW()
-                    )
-                    """,
-                    """
-                    CREATE TABLE IF NOT EXISTS user_data (
-                        user_id BIGINT PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
-                        name TEXT,
-                        birthdate TEXT,
-                        location TEXT,
-                        language TEXT DEFAULT 'ru',
-                        viewed_level INTEGER DEFAULT 1 
-                            CHECK (viewed_level >= 1 AND viewed_level <= 21)
-                    )
-                    """,
-                    """
-                    CREATE TABLE IF NOT EXISTS levels (
-                        level_number INTEGER PRIMARY KEY 
-                            CHECK (level_number >= 1 AND level_number <= 21),
-                        content TEXT NOT NULL,
-                        rules TEXT
-                    )
-                    """,
-                    """
-                    CREATE TABLE IF NOT EXISTS tasks (
-                        id SERIAL PRIMARY KEY,
-                        user_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                        level INTEGER NOT NULL 
-                            CHECK (level >= 1 AND level <= 21),
-                        task_type TEXT NOT NULL 
-                            CHECK (task_type IN ('time', 'referral', 'donation', 'auto')),
-                        start_time TIMESTAMP NOT NULL,
-                        end_time TIMESTAMP NOT NULL,
-                        completed BOOLEAN NOT NULL DEFAULT FALSE,
-                        completion_time TIMESTAMP,
-                        CONSTRAINT tasks_unique UNIQUE (user_id, level, task_type),
-                        CONSTRAINT valid_task_times CHECK (end_time >= start_time)
-                    )
-                    """,
-                    """
-                    CREATE TABLE IF NOT EXISTS referrals (
-                        id SERIAL PRIMARY KEY,
-                        referrer_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                        referee_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                        level INTEGER NOT NULL 
-                            CHECK (level >= 1 AND level <= 21),
-                        referral_date TIMESTAMP DEFAULT NOW(),
-                        registration_date TIMESTAMP,
-                        CONSTRAINT referrals_unique UNIQUE (referrer_id, referee_id, level),
-                        CONSTRAINT no_self_referral CHECK (referrer_id != referee_id)
-                    )
-                    """,
-                    """
-                    CREATE TABLE IF NOT EXISTS donations (
-                        id SERIAL PRIMARY KEY,
-                        user_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-                        level INTEGER NOT NULL 
-                            CHECK (level >= 1 AND level <= 21),
-                        amount DECIMAL(10, 2) NOT NULL 
-                            CHECK (amount > 0),
-                        currency TEXT NOT NULL,
-                        status TEXT NOT NULL,
-                        donation_date TIMESTAMP NOT NULL,
-                        payment_id TEXT,
-                        processed BOOLEAN DEFAULT FALSE
-                    )
-                    """
-                ]
-
-                for query in base_queries:
-                    cursor.execute(query)
+                version = self._read_version(cursor, conn)
+                if version >= self.latest_version:
+                    logger.info(f"Схема БД актуальна (версия {version})")
+                    return 0
+
+                if dry_run:
+                    for line in self._plan(cursor, conn, version):
+                        logger.info(line)
+                    conn.rollback()
+                    return 0
+
+                conn.rollback()
+                self._acquire_lock(cursor, conn)
+                try:
+                    cursor.execute(SCHEMA_MIGRATIONS_TABLE)
+                    conn.commit()
+                    applied = self._applied_versions(cursor)
                     conn.commit()
 
-                # 3. Создание индексов
-                index_queries = [
-                    "CREATE INDEX IF NOT EXISTS idx_tasks_user_level ON tasks(user_id, level)",
-                    "CREATE INDEX IF NOT EXISTS idx_referrals_referrer_level ON referrals(referrer_id, level)",
-                    "CREATE INDEX IF NOT EXISTS idx_referrals_referee_level ON referrals(referee_id, level)",
-                    "CREATE INDEX IF NOT EXISTS idx_referrals_level ON referrals(level)",
-                    "CREATE INDEX IF NOT EXISTS idx_donations_user_level ON donations(user_id, level)",
-                    """CREATE INDEX IF NOT EXISTS idx_donations_user_level_succeeded 
-                       ON donations(user_id, level) WHERE status = 'succeeded'""",
-                    "CREATE INDEX IF NOT EXISTS idx_tasks_user_completed ON tasks(user_id, level, completed)",
-                    "CREATE INDEX IF NOT EXISTS idx_tasks_completion ON tasks(completed, completion_time)",
-                    "CREATE INDEX IF NOT EXISTS idx_user_data_viewed_level ON user_data(viewed_level)",
-                    "CREATE INDEX IF NOT EXISTS idx_user_data_composite ON user_data(user_id, viewed_level)",
-                    "CREATE INDEX IF NOT EXISTS idx_referrals_registration ON referrals(registration_date)",
-                    "CREATE INDEX IF NOT EXISTS idx_users_registration ON users(registration_complete)",
-                    "CREATE INDEX IF NOT EXISTS idx_donations_payment_id ON donations(payment_id) WHERE payment_id "
-                    "IS NOT NULL",
-                ]
-
-                for query in index_queries:
-                    cursor.execute(query)
+                    count = 0
+                    for migration in self.migrations:
+                        if migration.version in applied:
+                            continue
+                        if migration.transactional:
+                            self._apply(migration, cursor, conn)
+                        else:
+                            self._apply_online(migration, conn)
+                        count += 1
+                finally:
+                    conn.rollback()
+                    cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
                     conn.commit()
 
-                cursor.execute("""
-                    DROP TRIGGER IF EXISTS after_user_registration ON users
-                """)
-                conn.commit()
-
-                cursor.execute("""
-                    CREATE OR REPLACE FUNCTION process_referral_registration()
-                    RETURNS TRIGGER AS $$
-                    DECLARE
-                        updated_referrals INT;
-                        inserted_tasks INT;
-                    BEGIN
-                        -- Обновляем реферальные записи
-                        UPDATE referrals 
-                        SET registration_date = NOW()
-                        WHERE referee_id = NEW.id 
-                        AND registration_date IS NULL;
-
-                        GET DIAGNOSTICS updated_referrals = ROW_COUNT;
-
-                        -- Если есть обновленные рефералы, создаем/обновляем задачи
-                        IF updated_referrals > 0 THEN
-                            -- Вставка или обновление существующих задач
-                            INSERT INTO tasks (
-                                user_id, level, task_type, 
-                                start_time, end_time, completed,
-                                completion_time
-                            )
-                            SELECT 
-                                r.referrer_id, 
-                                r.level, 
-                                'referral', 
-                                NOW(), 
-                                NOW(), 
-                                TRUE,
-                                NOW()
-                            FROM referrals r
-                            WHERE r.referee_id = NEW.id
-                            AND r.registration_date IS NOT NULL
-                            ON CONFLICT (user_id, level, task_type) 
-                            DO UPDATE SET
-                                completed = EXCLUDED.completed,
-                                completion_time = EXCLUDED.completion_time,
-                                end_time = EXCLUDED.end_time;
-
-                            GET DIAGNOSTICS inserted_tasks = ROW_COUNT;
-
-                            -- Логирование в системную таблицу
-                            INSERT INTO audit_log (event_type, user_id, message)
-                            VALUES ('referral_processed', NEW.id, 
-                                'Processed ' || inserted_tasks || ' referral tasks');
-                        END IF;
-
-                        RETURN NEW;
-                    END;
-                    $$ LANGUAGE plpgsql;
-                """)
-                conn.commit()
-
-                cursor.execute("""
-                    CREATE TRIGGER after_user_registration
-                    AFTER UPDATE OF registration_complete ON users
-                    FOR EACH ROW
-                    WHEN (NEW.registration_complete IS TRUE AND 
-                         (OLD.registration_complete IS FALSE OR OLD.registration_complete IS NULL))
-                    EXECUTE FUNCTION process_referral_registration();
-                """)
-                conn.commit()
-
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS audit_log (
-                        id SERIAL PRIMARY KEY,
-                        event_time TIMESTAMP DEFAULT NOW(),
-                        event_type TEXT NOT NULL,
-                        user_id BIGINT,
-                        message TEXT NOT NULL
-                    );
-                    CREATE INDEX IF NOT EXISTS idx_audit_log_event_type ON audit_log(event_type);
-                    CREATE INDEX IF NOT EXISTS idx_audit_log_user_id ON audit_log(user_id);
-                """)
-                conn.commit()
-
-                cursor.execute("""
-                    UPDATE tasks t
-                    SET 
-                        completed = TRUE,
-                        completion_time = NOW(),
-                        end_time = NOW()
-                    FROM referrals r
-                    WHERE 
-                        t.user_id = r.referrer_id
-                        AND t.level = r.level
-                        AND t.task_type = 'referral'
-                        AND r.registration_date IS NOT NULL
-                        AND t.completed = FALSE;
-                """)
-                conn.commit()
-
-                logger.info("Все миграции успешно выполнены")
+                logger.info(f"Применено миграций: {count}, версия схемы {self.latest_version}")
+                return count
 
         except Exception as e:
             logger.error(f"Ошибка при выполнении миграций: {str(e)}", exc_info=True)
             raise
 
-    def _clean_duplicates(self, cursor, conn):
-        """Очистка дубликатов в основных таблицах"""
+    def _acquire_lock(self, cursor, conn) -> None:
+        """Ждет advisory lock; между попытками транзакция закрыта (lock сессионный и остается)"""
+        started = time.monotonic()
+        while True:
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+            locked = cursor.fetchone()[0]
+            conn.rollback()
+            if locked:
+                if time.monotonic() - started >= MIGRATION_LOCK_POLL_INTERVAL:
+                    logger.info(f"Lock миграций получен через {time.monotonic() - started:.1f} с")
+                return
+            if time.monotonic() - started < MIGRATION_LOCK_POLL_INTERVAL:
+                logger.info("Миграции применяет другой экземпляр, ожидание lock")
+            time.sleep(MIGRATION_LOCK_POLL_INTERVAL)
+
+    def current_version(self) -> int:
+        with self.storage.connection() as conn:
+            return self._read_version(conn.cursor(), conn)
+
+    def _read_version(self, cursor, conn) -> int:
         try:
-            logger.info("Очистка возможных дубликатов в таблице tasks...")
-            cursor.execute("""
-                DELETE FROM tasks 
-                WHERE ctid NOT IN (
-                    SELECT min(ctid) 
-                    FROM tasks 
-                    GROUP BY user_id, level, task_type
-                )
-            """)
-            conn.commit()
+            cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+            return cursor.fetchone()[0]
+        except errors.UndefinedTable:
+            conn.rollback()
+            return 0
 
-            logger.info("Очистка возможных дубликатов в таблице referrals...")
-            cursor.execute("""
-                DELETE FROM referrals 
-                WHERE ctid NOT IN (
-                    SELECT min(ctid) 
-                    FROM referrals 
-                    GROUP BY referrer_id, referee_id, level
-                )
-            """)
-            conn.commit()
+    def _applied_versions(self, cursor) -> Set[int]:
+        cursor.execute("SELECT version FROM schema_migrations")
+        return {row[0] for row in cursor.fetchall()}
 
-            logger.info("Очистка дубликатов завершена")
-        except Exception as e:
-            logger.warning(f"Не удалось очистить дубликаты: {str(e)}")
+    def _apply(self, migration: Migration, cursor, conn) -> None:
+        logger.info(f"Применение миграции {migration.version}: {migration.name}")
+        try:
+            for statement in migration.statements:
+                cursor.execute(statement)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                (migration.version, migration.name)
+            )
+            conn.commit()
+        except Exception:
             conn.rollback()
+            logger.error(f"Миграция {migration.version} ({migration.name}) не применена")
+            raise
+
+    def _apply_online(self, migration: Migration, conn) -> None:
+        logger.info(f"Применение онлайн-миграции {migration.version}: {migration.name}")
+        conn.rollback()
+        conn.autocommit = True
+        try:
+            cursor = conn.cursor()
+            for step in migration.statements:
+                if isinstance(step, str):
+                    cursor.execute(step)
+                else:
+                    step.run(cursor)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                (migration.version, migration.name)
+            )
+        except Exception:
+            logger.error(f"Миграция {migration.version} ({migration.name}) прервана, "
+                         f"выполненные шаги сохранены и будут пропущены при повторе")
+            raise
+        finally:
+            conn.autocommit = False
+
+    def _plan(self, cursor, conn, version: int) -> List[str]:
+        """План применения недостающих миграций с оценками планировщика"""
+        lines = [f"Текущая версия схемы {version}, последняя {self.latest_version}"]
+        applied = self._applied_versions(cursor) if version else set()
+        for migration in self.migrations:
+            if migration.version in applied:
+                continue
+            kind = "в транзакции" if migration.transactional else "онлайн"
+            lines.append(f"Миграция {migration.version} ({migration.name}, {kind}):")
+            for step in migration.statements:
+                try:
+                    lines.append(f"    {self._explain_step(step, cursor)}")
+                except Exception as e:
+                    conn.rollback()
+                    lines.append(f"    {self._describe(step)}: оценка недоступна ({str(e).strip()})")
+        return lines
+
+    def _explain_step(self, step, cursor) -> str:
+        if not isinstance(step, str):
+            return step.explain(cursor)
+        keyword = step.split(None, 1)[0].upper()
+        if keyword in ('UPDATE', 'DELETE', 'INSERT', 'SELECT', 'WITH'):
+            cost, rows = _explain(cursor, step)
+            return f"{self._describe(step)}: ~{rows} строк, стоимость {cost}"
+        return f"{self._describe(step)}: DDL"
+
+    @staticmethod
+    def _describe(step) -> str:
+        if not isinstance(step, str):
+            return getattr(step, 'name', type(step).__name__)
+        return " ".join(step.split())[:70]
 
     def _verify_data_integrity(self, cursor, conn):
         """Базовая проверка целостности данных"""
@@ -278,6 +833,8 @@ class Migrator:
 
 
 if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO)
+    # python -m storage.migrator [--dry-run]
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
     migrator = Migrator(PostgresStorage("probuzhdenie", "postgres", "5g", "localhost", "5433"))
-    migrator.migrate()
\ No newline at end of file
+    migrator.migrate(dry_run="--dry-run" in sys.argv)
+    print(f"Версия схемы: {migrator.current_version()}")
\ No newline at end of file
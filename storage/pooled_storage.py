@@ -0,0 +1,262 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Iterator, Dict, Any
+import logging
+
+import psycopg2
+
+from storage.postgres_storage import PostgresStorage
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeoutError(RuntimeError):
+    """Все соединения пула заняты дольше, чем допускает wait_timeout"""
+
+
+class _PooledConnection:
+    __slots__ = ('conn', 'created_at', 'last_used_at')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used_at = self.created_at
+
+
+# Класс PooledPostgresStorage
+# Потокобезопасный пул соединений, совместимый по интерфейсу с PostgresStorage:
+#     connection() - выдает соединение из пула и возвращает его обратно после использования
+#     close() - закрывает все соединения пула, новые выдачи после этого запрещены
+#     get_stats() - статистика пула (занято, свободно, ожидания, время ожидания)
+# Параметры:
+#     min_size - сколько соединений держать открытыми постоянно
+#     max_size - верхняя граница открытых соединений (стоит сопоставлять с num_threads бота)
+#     max_lifetime - через сколько секунд соединение пересоздается
+#     health_check_after - если соединение простаивало дольше, перед выдачей выполняется SELECT 1
+#     wait_timeout - сколько секунд ждать свободного соединения, прежде чем выдать ошибку
+class PooledPostgresStorage(PostgresStorage):
+    def __init__(self, dbname: str, user: str, password: str,
+                 host: str = 'localhost', port: str = '5433',
+                 min_size: int = 1, max_size: int = 10,
+                 max_lifetime: float = 1800.0, health_check_after: float = 30.0,
+                 wait_timeout: float = 10.0):
+        super().__init__(dbname, user, password, host, port)
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Некорректные размеры пула: min_size={min_size}, max_size={max_size}")
+
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+        self.wait_timeout = wait_timeout
+
+        self._idle = deque()
+        self._in_use = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self._waits = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._timeouts = 0
+        self._created = 0
+        self._discarded = 0
+
+        try:
+            self._warm_up()
+        except Exception as e:
+            # БД пока недоступна: соединения откроются при первых выдачах
+            logger.warning(f"Не удалось прогреть пул до {min_size} соединений: {e}")
+
+    @contextmanager
+    def connection(self) -> Iterator[psycopg2.extensions.connection]:
+        """
+        Выдает соединение из пула. После выхода из блока незавершенная
+        транзакция откатывается, а соединение возвращается в пул.
+        """
+        self._count_query()
+        pooled = self._checkout()
+        broken = False
+        try:
+            yield pooled.conn
+        except psycopg2.OperationalError as e:
+            broken = True
+            logger.error(f"Ошибка подключения к БД: {e}")
+            raise RuntimeError("Не удалось подключиться к базе данных") from e
+        except psycopg2.InterfaceError as e:
+            broken = True
+            logger.error(f"Соединение с БД потеряно: {e}")
+            raise
+        except psycopg2.Error as e:
+            logger.error(f"Ошибка PostgreSQL: {e}")
+            raise
+        finally:
+            self._checkin(pooled, broken)
+
+    def close(self) -> None:
+        """Закрывает свободные соединения и запрещает новые выдачи; занятые закрываются при возврате"""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            in_use = self._in_use
+            self._cond.notify_all()
+
+        for pooled in idle:
+            self._close_quietly(pooled)
+        logger.info(f"Пул соединений закрыт: закрыто {len(idle)}, занято {in_use}")
+
+    def open(self) -> None:
+        """Открывает пул заново после close() и прогревает min_size соединений"""
+        with self._cond:
+            self._closed = False
+        self._warm_up()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика пула для подбора размеров под num_threads"""
+        with self._cond:
+            return {
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'max_size': self.max_size,
+                'waits': self._waits,
+                'wait_time_total': round(self._wait_time_total, 3),
+                'wait_time_max': round(self._wait_time_max, 3),
+                'timeouts': self._timeouts,
+                'created': self._created,
+                'discarded': self._discarded,
+            }
+
+    def _warm_up(self) -> None:
+        while True:
+            with self._cond:
+                if self._closed or self._in_use + len(self._idle) >= self.min_size:
+                    return
+                self._in_use += 1
+            try:
+                pooled = self._connect()
+            except Exception:
+                with self._cond:
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+            self._checkin(pooled, broken=False)
+
+    def _connect(self) -> _PooledConnection:
+        try:
+            conn = psycopg2.connect(**self.connection_params)
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_READ_COMMITTED)
+        except psycopg2.OperationalError as e:
+            logger.error(f"Ошибка подключения к БД: {e}")
+            raise RuntimeError("Не удалось подключиться к базе данных") from e
+        with self._cond:
+            self._created += 1
+        return _PooledConnection(conn)
+
+    def _checkout(self) -> _PooledConnection:
+        deadline = None
+        wait_started = None
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("Пул соединений закрыт")
+
+                if self._idle:
+                    pooled = self._idle.pop()
+                    self._in_use += 1
+                    break
+
+                if self._in_use < self.max_size:
+                    self._in_use += 1
+                    pooled = None
+                    break
+
+                if wait_started is None:
+                    wait_started = time.monotonic()
+                    deadline = wait_started + self.wait_timeout
+                    self._waits += 1
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    self._record_wait(wait_started)
+                    raise PoolTimeoutError(
+                        f"Нет свободных соединений в пуле за {self.wait_timeout} с "
+                        f"(занято {self._in_use}/{self.max_size})"
+                    )
+                self._cond.wait(remaining)
+
+            if wait_started is not None:
+                self._record_wait(wait_started)
+
+        try:
+            if pooled is not None and self._is_usable(pooled):
+                return pooled
+            if pooled is not None:
+                self._discard(pooled)
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def _checkin(self, pooled: _PooledConnection, broken: bool) -> None:
+        conn = pooled.conn
+        if not broken and not conn.closed:
+            try:
+                # Репозитории не всегда завершают транзакцию после SELECT
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+
+        expired = time.monotonic() - pooled.created_at > self.max_lifetime
+        with self._cond:
+            self._in_use -= 1
+            keep = not broken and not conn.closed and not expired and not self._closed
+            if keep:
+                pooled.last_used_at = time.monotonic()
+                self._idle.append(pooled)
+            self._cond.notify()
+
+        if not keep:
+            self._discard(pooled)
+
+    def _is_usable(self, pooled: _PooledConnection) -> bool:
+        conn = pooled.conn
+        if conn.closed:
+            return False
+        now = time.monotonic()
+        if now - pooled.created_at > self.max_lifetime:
+            return False
+        if now - pooled.last_used_at < self.health_check_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error as e:
+            logger.warning(f"Соединение из пула не прошло проверку: {e}")
+            return False
+
+    def _discard(self, pooled: _PooledConnection) -> None:
+        with self._cond:
+            self._discarded += 1
+        self._close_quietly(pooled)
+
+    def _record_wait(self, wait_started: float) -> None:
+        waited = time.monotonic() - wait_started
+        self._wait_time_total += waited
+        self._wait_time_max = max(self._wait_time_max, waited)
+
+    @staticmethod
+    def _close_quietly(pooled: _PooledConnection) -> None:
+        try:
+            if not pooled.conn.closed:
+                pooled.conn.close()
+        except psycopg2.Error:
+            pass
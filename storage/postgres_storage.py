@@ -1,3 +1,4 @@
+import threading
 import psycopg2
 from contextlib import contextmanager
 from typing import Optional, Iterator
@@ -22,12 +23,14 @@ class PostgresStorage:
             'client_encoding': 'UTF8',
             'connect_timeout': 5
         }
+        self._local = threading.local()
 
     @contextmanager
     def connection(self) -> Iterator[psycopg2.extensions.connection]:
         """
         Контекстный менеджер для работы с подключением к БД
         """
+        self._count_query()
         conn = None
         try:
             conn = psycopg2.connect(**self.connection_params)
@@ -43,6 +46,24 @@ class PostgresStorage:
             if conn is not None and not conn.closed:
                 conn.close()
 
+    def dedicated_connection(self) -> psycopg2.extensions.connection:
+        """
+        Отдельное соединение вне пула (например, для LISTEN).
+        Закрывать его должен вызывающий код.
+        """
+        try:
+            return psycopg2.connect(**self.connection_params)
+        except psycopg2.OperationalError as e:
+            logger.error(f"Ошибка подключения к БД: {e}")
+            raise RuntimeError("Не удалось подключиться к базе данных") from e
+
+    def thread_query_count(self) -> int:
+        """Сколько раз текущий поток брал соединение (один вызов репозитория - одно соединение)"""
+        return getattr(self._local, 'queries', 0)
+
+    def _count_query(self) -> None:
+        self._local.queries = getattr(self._local, 'queries', 0) + 1
+
     def test_connection(self) -> bool:
         """Проверяет доступность базы данных"""
         try:
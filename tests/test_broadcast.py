@@ -0,0 +1,40 @@
+import pytest
+
+from admin.broadcast import parse_broadcast_command
+
+
+def test_plain_text_keeps_line_breaks():
+    assert parse_broadcast_command("/broadcast Привет!\nНовый уровень") == ("Привет!\nНовый уровень", None, None)
+
+
+def test_options_before_text():
+    assert parse_broadcast_command("/broadcast level=5 registered Привет") == ("Привет", 5, True)
+    assert parse_broadcast_command("/broadcast UNREGISTERED level=2 Привет") == ("Привет", 2, False)
+
+
+def test_option_followed_by_newline():
+    assert parse_broadcast_command("/broadcast level=3\nТекст") == ("Текст", 3, None)
+
+
+def test_option_like_words_inside_text_are_text():
+    assert parse_broadcast_command("/broadcast Все registered пользователи") == \
+        ("Все registered пользователи", None, None)
+    assert parse_broadcast_command("/broadcast registeredX hi") == ("registeredX hi", None, None)
+
+
+@pytest.mark.parametrize('command', [
+    "/broadcast",
+    "/broadcast   ",
+    "/broadcast level=5",
+    "/broadcast registered",
+    "/broadcast level=5 unregistered ",
+])
+def test_empty_text_is_rejected(command):
+    with pytest.raises(ValueError, match="Пустой текст"):
+        parse_broadcast_command(command)
+
+
+@pytest.mark.parametrize('command', ["/broadcast level=0 Привет", "/broadcast level=30 Привет", "/broadcast level=30"])
+def test_level_out_of_range_is_rejected(command):
+    with pytest.raises(ValueError, match="Уровень"):
+        parse_broadcast_command(command)
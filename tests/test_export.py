@@ -0,0 +1,96 @@
+import gzip
+
+import pytest
+
+from admin.export import EXPORT_TABLES, AdminExporter, parse_export_tables
+
+
+def test_parse_export_tables_defaults_to_all():
+    assert parse_export_tables([]) == list(EXPORT_TABLES)
+
+
+def test_parse_export_tables_is_case_insensitive():
+    assert parse_export_tables(['Users', 'TASKS']) == ['users', 'tasks']
+
+
+def test_parse_export_tables_rejects_unknown():
+    with pytest.raises(ValueError, match='admins'):
+        parse_export_tables(['users', 'admins'])
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = -1
+
+    def copy_expert(self, sql, file, size):
+        table = sql.split()[1]
+        if table in self.conn.failing:
+            raise RuntimeError(f"COPY {table} failed")
+        file.write(b"id\n1\n2\n")
+        self.rowcount = 2
+        self.conn.log.append(('copy', table))
+
+
+class FakeConnection:
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.log = []
+
+    def set_session(self, **kwargs):
+        self.log.append(('session', kwargs['isolation_level'], kwargs['readonly']))
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        self.log.append(('rollback',))
+
+    def close(self):
+        self.log.append(('close',))
+
+
+class FakeStorage:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def dedicated_connection(self):
+        return self.conn
+
+
+def test_export_closes_transaction_before_returning_files(tmp_path):
+    conn = FakeConnection()
+    files = AdminExporter(FakeStorage(conn), tmp_dir=str(tmp_path)).export(['users', 'tasks'])
+    try:
+        assert conn.log == [('session', 'REPEATABLE READ', True), ('copy', 'users'), ('copy', 'tasks'),
+                            ('rollback',), ('close',)]
+        assert [export_file.table for export_file in files] == ['users', 'tasks']
+        assert files[0].file_name.startswith('users_') and files[0].file_name.endswith('.csv.gz')
+        assert files[0].rows == 2
+        assert gzip.decompress(files[0].file.read()) == b"id\n1\n2\n"
+    finally:
+        for export_file in files:
+            export_file.close()
+
+
+def test_export_closes_written_files_on_error(tmp_path):
+    conn = FakeConnection(failing=('tasks',))
+    opened = []
+    exporter = AdminExporter(FakeStorage(conn), tmp_dir=str(tmp_path))
+    original = exporter._export_table
+
+    def export_table(*args):
+        export_file = original(*args)
+        opened.append(export_file)
+        return export_file
+
+    exporter._export_table = export_table
+    with pytest.raises(RuntimeError):
+        exporter.export(['users', 'tasks'])
+    assert conn.log[-1] == ('close',)
+    assert [export_file.file.closed for export_file in opened] == [True]
+
+
+def test_export_rejects_unknown_tables():
+    with pytest.raises(ValueError):
+        AdminExporter(FakeStorage(FakeConnection())).export(['admins'])
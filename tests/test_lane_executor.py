@@ -0,0 +1,114 @@
+import threading
+import time
+
+from service.lane_executor import LaneExecutor
+
+
+def keys_for_lanes(lanes):
+    """По одному ключу на каждую дорожку"""
+    found = {}
+    key = 0
+    while len(found) < lanes:
+        found.setdefault(hash(key) % lanes, key)
+        key += 1
+    return [found[lane] for lane in range(lanes)]
+
+
+def test_same_key_is_processed_in_order():
+    processed = []
+    executor = LaneExecutor(lambda item: processed.append(item), lanes=4, max_queue_per_lane=1000)
+    executor.start()
+    for number in range(200):
+        assert executor.submit(number % 3, (number % 3, number))
+    executor.stop()
+
+    assert len(processed) == 200
+    for key in range(3):
+        numbers = [number for item_key, number in processed if item_key == key]
+        assert numbers == sorted(numbers)
+
+
+def test_different_lanes_run_in_parallel():
+    first, second = keys_for_lanes(2)
+    release = threading.Event()
+    processed = []
+
+    def process(item):
+        if item == 'blocked':
+            release.wait(2)
+        processed.append(item)
+
+    executor = LaneExecutor(process, lanes=2)
+    executor.start()
+    executor.submit(first, 'blocked')
+    executor.submit(second, 'free')
+    deadline = time.monotonic() + 2
+    while 'free' not in processed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert processed == ['free']
+    release.set()
+    executor.stop()
+    assert processed == ['free', 'blocked']
+
+
+def test_submit_rejects_when_lane_is_full():
+    release = threading.Event()
+    executor = LaneExecutor(lambda item: release.wait(2), lanes=1, max_queue_per_lane=1)
+    executor.start()
+    executor.submit(1, 'running')
+    time.sleep(0.05)
+    assert executor.submit(1, 'queued')
+    assert not executor.submit(1, 'rejected', timeout=0.01)
+    assert executor.get_stats()['rejected'] == 1
+    release.set()
+    executor.stop()
+
+
+def test_errors_do_not_stop_the_lane():
+    processed = []
+
+    def process(item):
+        if item == 'bad':
+            raise ValueError(item)
+        processed.append(item)
+
+    executor = LaneExecutor(process, lanes=1)
+    executor.start()
+    for item in ('bad', 'good'):
+        executor.submit(1, item)
+    executor.stop()
+    assert processed == ['good']
+    assert executor.get_stats()['errors'] == 1
+
+
+def test_stop_drains_queues():
+    processed = []
+    executor = LaneExecutor(lambda item: processed.append(item), lanes=2, max_queue_per_lane=100)
+    executor.start()
+    for number in range(50):
+        executor.submit(number, number)
+    executor.stop(timeout=5)
+    assert sorted(processed) == list(range(50))
+
+
+def test_stop_on_full_lane_does_not_hang_or_drop_other_lanes():
+    slow_key, fast_key = keys_for_lanes(2)
+    processed = []
+
+    def process(item):
+        if item[0] == 'slow':
+            time.sleep(0.2)
+        processed.append(item)
+
+    executor = LaneExecutor(process, lanes=2, max_queue_per_lane=3)
+    executor.start()
+    for number in range(4):
+        executor.submit(slow_key, ('slow', number))
+    for number in range(3):
+        executor.submit(fast_key, ('fast', number))
+
+    started = time.monotonic()
+    executor.stop(timeout=0.3)
+    assert time.monotonic() - started < 1.0
+    assert [item for item in processed if item[0] == 'fast'] == [('fast', 0), ('fast', 1), ('fast', 2)]
+    assert len([item for item in processed if item[0] == 'slow']) < 4
@@ -0,0 +1,56 @@
+from service.level_images import LevelImageIndex
+
+
+def make_index(tmp_path, *names):
+    for name in names:
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"image")
+    index = LevelImageIndex(tmp_path)
+    index.reload()
+    return index
+
+
+def test_exact_name_wins_over_extensions(tmp_path):
+    index = make_index(tmp_path, "level5", "level5.jpg", "level5.png")
+    assert index.resolve("image:level5") == tmp_path / "level5"
+
+
+def test_extension_priority(tmp_path):
+    index = make_index(tmp_path, "level5.gif", "level5.png", "level5.jpeg")
+    assert index.resolve("image:level5") == tmp_path / "level5.jpeg"
+
+    index = make_index(tmp_path / "other", "level6.gif", "level6.png")
+    assert index.resolve("image:level6") == tmp_path / "other" / "level6.png"
+
+
+def test_uppercase_extension_and_full_name(tmp_path):
+    index = make_index(tmp_path, "level7.JPG")
+    assert index.resolve("image:level7") == tmp_path / "level7.JPG"
+    assert index.resolve("image:level7.JPG") == tmp_path / "level7.JPG"
+
+
+def test_subdirectories_and_whitespace(tmp_path):
+    index = make_index(tmp_path, "rules/level8.png")
+    assert index.resolve("image: rules/level8 ") == tmp_path / "rules" / "level8.png"
+
+
+def test_not_an_image_value(tmp_path):
+    index = make_index(tmp_path, "level9.png")
+    assert index.resolve(None) is None
+    assert index.resolve("Просто текст правил") is None
+    assert index.resolve("image:missing") is None
+
+
+def test_reload_picks_up_new_files(tmp_path):
+    index = make_index(tmp_path)
+    assert index.resolve("image:level10") is None
+    (tmp_path / "level10.png").write_bytes(b"image")
+    assert index.reload() == 1
+    assert index.resolve("image:level10") == tmp_path / "level10.png"
+
+
+def test_missing_directory(tmp_path):
+    index = LevelImageIndex(tmp_path / "missing")
+    assert index.reload() == 0
+    assert index.resolve("image:level1") is None
@@ -0,0 +1,62 @@
+import logging
+import queue
+
+from service.logging_setup import NonBlockingQueueHandler, SamplingFilter, parse_sample_rates
+
+
+def record(message, name='bot', level=logging.INFO):
+    return logging.LogRecord(name, level, __file__, 1, message, None, None)
+
+
+def kept(log_filter, records):
+    return [r.msg for r in records if log_filter.filter(r)]
+
+
+def test_parse_sample_rates():
+    rates = parse_sample_rates("[Keyboard]=0.05;logger:telebot=0.5; DEBUG:=2;broken;=0.1")
+    assert rates == {'[Keyboard]': 0.05, 'logger:telebot': 0.5, 'DEBUG:': 1.0}
+
+
+def test_message_prefix_keeps_every_nth():
+    log_filter = SamplingFilter({'[Keyboard]': 0.25})
+    messages = [record(f"[Keyboard] {i}") for i in range(8)]
+    assert kept(log_filter, messages) == ["[Keyboard] 0", "[Keyboard] 4"]
+    assert log_filter.dropped == 6
+
+
+def test_other_messages_pass():
+    log_filter = SamplingFilter({'[Keyboard]': 0.0})
+    assert log_filter.filter(record("[Router] ok"))
+    assert not log_filter.filter(record("[Keyboard] built"))
+
+
+def test_warning_is_never_dropped():
+    log_filter = SamplingFilter({'[Keyboard]': 0.0, 'logger:bot': 0.0})
+    assert log_filter.filter(record("[Keyboard] failed", level=logging.WARNING))
+    assert log_filter.filter(record("[Keyboard] failed", level=logging.ERROR))
+
+
+def test_logger_rule_covers_children_only():
+    log_filter = SamplingFilter({'logger:telebot': 0.5})
+    records = [record("a", 'telebot'), record("b", 'telebot.util'), record("c", 'telebot'),
+               record("d", 'telebotx')]
+    assert kept(log_filter, records) == ["a", "c", "d"]
+
+
+def test_logger_rule_checked_before_message_rule():
+    log_filter = SamplingFilter({'[Keyboard]': 1.0, 'logger:bot': 0.0})
+    assert not log_filter.filter(record("[Keyboard] built", 'bot'))
+
+
+def test_queue_handler_drops_when_full():
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=1))
+    logger = logging.getLogger('tests.queue_handler')
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        logger.warning("first %s", 1)
+        logger.warning("second")
+    finally:
+        logger.removeHandler(handler)
+    assert handler.queue.get_nowait().msg == "first 1"
+    assert handler.dropped == 1
@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from payments.poller import DEFAULT_MAX_INTERVAL, PaymentPoller
+
+
+class FakeDonations:
+    def __init__(self, payments):
+        self.payments = payments
+
+    def get_pending_payments(self, max_age=None):
+        return list(self.payments)
+
+
+def make_poller(payments, statuses, **kwargs):
+    events = []
+    checked = []
+
+    def fetch_status(payment_id):
+        checked.append(payment_id)
+        return {'status': statuses.get(payment_id, 'pending')}
+
+    poller = PaymentPoller(
+        FakeDonations(payments),
+        fetch_status=fetch_status,
+        on_succeeded=lambda payment: events.append(('succeeded', payment['payment_id'])),
+        on_canceled=lambda payment: events.append(('canceled', payment['payment_id'])),
+        workers=2,
+        **kwargs
+    )
+    return poller, checked, events
+
+
+def payment(donation_id, user_id, age=timedelta(0)):
+    return {'id': donation_id, 'user_id': user_id, 'payment_id': f"p{donation_id}",
+            'donation_date': datetime.now() - age}
+
+
+@pytest.mark.parametrize('age, interval', [
+    (timedelta(minutes=1), 20),
+    (timedelta(minutes=30), 60),
+    (timedelta(hours=3), 300),
+    (timedelta(hours=12), DEFAULT_MAX_INTERVAL),
+])
+def test_interval_grows_with_payment_age(age, interval):
+    poller, _, _ = make_poller([], {})
+    assert poller._interval_for(datetime.now() - age) == interval
+
+
+def test_interval_without_date_uses_first_step():
+    poller, _, _ = make_poller([], {})
+    assert poller._interval_for(None) == 20
+
+
+def test_pending_payment_waits_for_its_interval():
+    poller, checked, _ = make_poller([payment(1, 10)], {})
+    assert poller.run_cycle()['checked'] == 1
+    assert poller.run_cycle()['due'] == 0
+    assert checked == ['p1']
+
+
+def test_first_success_stops_user_checks_in_cycle():
+    payments = [payment(1, 10), payment(2, 10), payment(3, 20)]
+    poller, checked, events = make_poller(payments, {'p1': 'succeeded', 'p3': 'canceled'})
+    stats = poller.run_cycle()
+    assert sorted(checked) == ['p1', 'p3']
+    assert sorted(events) == [('canceled', 'p3'), ('succeeded', 'p1')]
+    assert stats['succeeded'] == 1 and stats['canceled'] == 1
+
+
+def test_canceled_payment_does_not_stop_user_checks():
+    poller, checked, _ = make_poller([payment(1, 10), payment(2, 10)], {'p1': 'canceled'})
+    poller.run_cycle()
+    assert checked == ['p1', 'p2']
+
+
+def test_errors_are_counted_and_rescheduled():
+    poller, _, _ = make_poller([payment(1, 10)], {'p1': 'error'})
+    assert poller.run_cycle()['errors'] == 1
+    assert poller.run_cycle()['due'] == 0
+
+
+def test_min_age_defers_first_check():
+    payments = [payment(1, 10), payment(2, 20, age=timedelta(minutes=10))]
+    poller, checked, _ = make_poller(payments, {}, min_age=timedelta(minutes=5))
+    poller.run_cycle()
+    assert checked == ['p2']
+
+
+def test_schedule_dropped_for_payments_no_longer_pending():
+    payments = [payment(1, 10)]
+    poller, _, _ = make_poller(payments, {})
+    poller.run_cycle()
+    assert 1 in poller._next_check
+    payments.clear()
+    poller.run_cycle()
+    assert poller._next_check == {}
@@ -0,0 +1,100 @@
+from types import SimpleNamespace
+
+from service.router import Router
+
+MENU = 1
+LEVEL = 2
+
+
+def make_router(state=MENU):
+    lookups = []
+
+    def get_state(message):
+        lookups.append(message.text)
+        return state
+
+    return Router(state_getter=get_state), lookups
+
+
+def message(text):
+    return SimpleNamespace(text=text, from_user=SimpleNamespace(id=1))
+
+
+def test_exact_text_in_state():
+    router, _ = make_router(state=LEVEL)
+    router.add_rule('menu', text="Далее", states=MENU)
+    router.add_rule('level', text="Далее", states=LEVEL)
+    assert router.resolve(message("Далее")) == 'level'
+
+
+def test_earlier_rule_wins_over_later_any_state_rule():
+    router, _ = make_router(state=MENU)
+    router.add_rule('state', text="Назад", states=MENU)
+    router.add_rule('any', text="Назад")
+    assert router.resolve(message("Назад")) == 'state'
+
+
+def test_earlier_any_state_rule_wins_without_state_lookup():
+    router, lookups = make_router(state=MENU)
+    router.add_rule('any', text="Назад")
+    router.add_rule('state', text="Назад", states=MENU)
+    assert router.resolve(message("Назад")) == 'any'
+    assert lookups == []
+
+
+def test_state_any_text_rule():
+    router, _ = make_router(state=LEVEL)
+    router.add_rule('name', states=LEVEL)
+    assert router.resolve(message("Иван")) == 'name'
+
+
+def test_fallback_after_exact_match_does_not_win():
+    router, _ = make_router(state=LEVEL)
+    router.add_rule('exact', text="5 уровень", states=LEVEL)
+    router.add_rule('contains', contains="уровень", states=LEVEL)
+    assert router.resolve(message("5 уровень")) == 'exact'
+    assert router.resolve(message("6 уровень")) == 'contains'
+
+
+def test_fallback_registered_first_wins():
+    router, _ = make_router(state=LEVEL)
+    router.add_rule('prefix', prefix="5 ", states=LEVEL)
+    router.add_rule('exact', text="5 уровень", states=LEVEL)
+    assert router.resolve(message("5 уровень")) == 'prefix'
+
+
+def test_fallback_checks_state_and_func():
+    router, _ = make_router(state=MENU)
+    router.add_rule('level', contains="уровень", states=LEVEL)
+    router.add_rule('func', func=lambda m: m.text.isdigit())
+    assert router.resolve(message("5 уровень")) is None
+    assert router.resolve(message("42")) == 'func'
+
+
+def test_strip_matching():
+    router, _ = make_router()
+    router.add_rule('stripped', text="Донат", strip=True)
+    assert router.resolve(message("  Донат ")) == 'stripped'
+
+
+def test_texts_with_func_are_all_checked():
+    router, _ = make_router()
+    router.add_rule('yes', texts=["Да", "Ок"], func=lambda m: True)
+    assert router.resolve(message("Ок")) == 'yes'
+    assert router.resolve(message("Нет")) is None
+
+
+def test_message_without_text():
+    router, _ = make_router()
+    router.add_rule('any', func=lambda m: True)
+    assert router.resolve(message(None)) is None
+
+
+def test_dispatch_calls_handler():
+    calls = []
+    router, _ = make_router()
+    router.add_rule(calls.append, text="Далее")
+    update = message("Далее")
+    assert router.dispatch(update) is True
+    assert calls == [update]
+    assert router.dispatch(message("другое")) is False
@@ -0,0 +1,102 @@
+import threading
+from datetime import datetime, timedelta
+
+from service.time_tasks import TimeTaskScheduler
+
+
+class FakeTasks:
+    def __init__(self, tasks=(), claimable=True):
+        self.tasks = list(tasks)
+        self.claimable = claimable
+        self.loads = []
+        self.claims = []
+
+    def get_pending_time_tasks(self, after, until):
+        self.loads.append((after, until))
+        return [task for task in self.tasks if (after is None or task[0] > after) and task[0] <= until]
+
+    def claim_time_task_expiry(self, user_id, level, now):
+        self.claims.append((user_id, level))
+        return self.claimable and (user_id, level) not in self.claims[:-1]
+
+
+def make_scheduler(repo, **kwargs):
+    notified = []
+    scheduler = TimeTaskScheduler(repo, lambda user_id, level: notified.append((user_id, level)),
+                                  lookahead=3600, reload_interval=300, max_overdue=86400, **kwargs)
+    return scheduler, notified
+
+
+def test_pop_due_returns_expired_in_order():
+    now = datetime.now()
+    scheduler, _ = make_scheduler(FakeTasks())
+    scheduler.add(3, 5, now - timedelta(seconds=1))
+    scheduler.add(1, 4, now - timedelta(seconds=10))
+    scheduler.add(2, 6, now + timedelta(seconds=60))
+    assert scheduler._pop_due(now) == [(1, 4), (3, 5)]
+    assert scheduler.get_stats()['scheduled'] == 1
+
+
+def test_add_ignores_tasks_beyond_lookahead():
+    scheduler, _ = make_scheduler(FakeTasks())
+    scheduler.add(1, 4, datetime.now() + timedelta(hours=2))
+    assert scheduler.get_stats()['scheduled'] == 0
+
+
+def test_first_reload_includes_recent_overdue_tasks():
+    now = datetime.now()
+    repo = FakeTasks([(now - timedelta(hours=1), 1, 3), (now - timedelta(days=3), 2, 3),
+                      (now + timedelta(minutes=30), 3, 3), (now + timedelta(hours=2), 4, 3)])
+    scheduler, _ = make_scheduler(repo)
+    scheduler._reload(now)
+    assert repo.loads == [(now - timedelta(days=1), now + timedelta(hours=1))]
+    assert scheduler.get_stats()['scheduled'] == 2
+
+
+def test_next_reload_starts_after_loaded_window():
+    now = datetime.now()
+    repo = FakeTasks([(now + timedelta(minutes=30), 1, 3), (now + timedelta(minutes=70), 2, 3)])
+    scheduler, _ = make_scheduler(repo)
+    scheduler._reload(now)
+    later = now + timedelta(minutes=15)
+    scheduler._reload(later)
+    assert repo.loads[1] == (now + timedelta(hours=1), later + timedelta(hours=1))
+    assert scheduler.get_stats()['scheduled'] == 2
+    assert scheduler.get_stats()['loaded_until'] == later + timedelta(hours=1)
+
+
+def test_fire_notifies_only_claimed_tasks():
+    now = datetime.now()
+    repo = FakeTasks()
+    scheduler, notified = make_scheduler(repo)
+    scheduler._fire(1, 4, now)
+    scheduler._fire(1, 4, now)
+    assert notified == [(1, 4)]
+    stats = scheduler.get_stats()
+    assert stats['notified'] == 1 and stats['skipped'] == 1
+
+
+def test_notify_errors_are_counted():
+    def notify(user_id, level):
+        raise RuntimeError("blocked")
+
+    scheduler = TimeTaskScheduler(FakeTasks(), notify)
+    scheduler._fire(1, 4, datetime.now())
+    assert scheduler.get_stats()['errors'] == 1
+
+
+def test_run_forever_fires_due_tasks():
+    now = datetime.now()
+    repo = FakeTasks([(now - timedelta(seconds=5), 1, 3)])
+    scheduler, notified = make_scheduler(repo)
+    stop_event = threading.Event()
+    thread = threading.Thread(target=scheduler.run_forever, args=(stop_event,))
+    thread.start()
+    scheduler.add(2, 4, datetime.now() + timedelta(milliseconds=100))
+    deadline = datetime.now() + timedelta(seconds=2)
+    while len(notified) < 2 and datetime.now() < deadline:
+        stop_event.wait(0.02)
+    stop_event.set()
+    scheduler._wakeup.set()
+    thread.join(2)
+    assert notified == [(1, 3), (2, 4)]